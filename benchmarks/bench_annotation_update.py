@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+BENCHMARK OF THE ANNOTATION OF THE ALIGNED READS AFTER EACH bowtie RUN (manifoldAlign.alignPlusParse()).
+BUILDS THE DATAFRAME OF baking() FOR --uniques UNIQUE READS AND THE SAM OUTPUT OF ONE bowtie RUN WHERE --mapped OF THEM ALIGN, --multi
+OF THOSE SEVERAL TIMES (-a), THEN ANNOTATES IT
+  - CELL BY CELL, WITH pdDataFrame.at[] FOR EVERY SAM RECORD (THE FORMER CODE);
+  - WITH apply_hits(): THE HITS, NAMED BY THE INTEGER ID OF THE READ, ARE COLLECTED AND APPLIED IN ONE ASSIGNMENT PER COLUMN.
+REPORTS THE TIME OF EACH AND EXITS WITH 1 IF THE TWO DATAFRAMES DIFFER.
+
+    python benchmarks/bench_annotation_update.py [--uniques 2000000] [--mapped 0.6] [--multi 0.1] [--samples 4]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from mirge.libs.countMatrix import sparse_counts
+from mirge.libs.manifoldAlign import apply_hits
+
+initialFlags = ['exact miRNA', 'hairpin miRNA', 'mature tRNA', 'primary tRNA', 'snoRNA', 'rRNA', 'ncrna others', 'mRNA', 'isomiR miRNA', 'spike-in']
+
+
+def reads_frame(rng, uniques, samples):
+    """
+    THE DATAFRAME OF baking(): annotFlag, THE ANNOTATION COLUMNS AND ONE SPARSE COUNT COLUMN PER SAMPLE, INDEXED BY SORTED UNIQUE READS
+    """
+    lengths = rng.integers(18, 31, size=uniques * 2)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)[rng.integers(0, 4, size=(uniques * 2, 30), dtype=np.uint8)]
+    seqs = np.unique([row[:length].tobytes().decode() for row, length in zip(bases, lengths)])
+    seqs = rng.permutation(seqs)[:uniques]
+    seqs.sort()
+    counts = sparse.random(len(seqs), samples, density=0.5, format="csr", random_state=1, data_rvs=lambda n: rng.integers(1, 100, size=n))
+    frame = pd.DataFrame({'annotFlag': np.zeros(len(seqs), dtype=int)}, index=pd.Index(seqs, name='Sequence'))
+    frame = frame.assign(**dict.fromkeys(initialFlags, ''))
+    return pd.concat([frame, sparse_counts(counts.astype(np.int64), frame.index, ["sample%d" % (s + 1) for s in range(samples)])], axis=1)
+
+
+def sam_lines(rng, seqs, mapped, multi):
+    """
+    THE SAM RECORDS (bytes) OF ONE bowtie RUN OVER seqs, WITH THE READS NAMED BY THEIR SEQUENCE (THE FORMER INPUT OF bowtie) AND BY THEIR
+    POSITION IN seqs (THE CURRENT ONE): UNALIGNED RECORDS FOR THE UNMAPPED READS, 2 TO 4 RECORDS FOR THE MULTI-MAPPED ONES
+    """
+    named = []
+    numbered = []
+    for queryId, seq in enumerate(seqs):
+        draw = rng.random()
+        if draw >= mapped:
+            records = [b"\t4\t*\t0\t0\t*\t*\t0\t0\t%s\t%s\tXM:i:0\n" % (seq, b"I" * len(seq))]
+        else:
+            records = [b"\t0\ttRNA-%d-%d\t%d\t255\t%dM\t*\t0\t0\t%s\t%s\tXA:i:0\tMD:Z:%d\tNM:i:0\n" % (rng.integers(0, 500), hit, 1 + hit, len(seq), seq, b"I" * len(seq), len(seq))
+                       for hit in range(rng.integers(2, 5) if draw < mapped * multi else 1)]
+        named.extend(seq + record for record in records)
+        numbered.extend(b"%d" % queryId + record for record in records)
+    return named, numbered
+
+
+def cell_by_cell(frame, column, lines):
+    colnames = list(frame.columns)
+    for srow in lines:
+        sam_line = srow.split(b'\t', 3)
+        if sam_line[2] != b"*":
+            seq = sam_line[0].decode()
+            frame.at[seq, column] = sam_line[2].decode()
+            frame.at[seq, colnames[0]] = 1
+    return frame
+
+
+def bulk(frame, column, lines, rows):
+    """
+    THE CURRENT PATH: THE READS ARE NAMED BY THEIR POSITION IN rows, THE DATAFRAME ROWS SENT TO bowtie
+    """
+    hitIds = []
+    refs = []
+    for srow in lines:
+        sam_line = srow.split(b'\t', 3)
+        if sam_line[2] != b"*":
+            hitIds.append(int(sam_line[0]))
+            refs.append(sam_line[2])
+    return apply_hits(frame, column, rows[np.asarray(hitIds, dtype=np.int64)], refs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the annotation update after each bowtie run")
+    parser.add_argument("--uniques", type=int, default=2000000)
+    parser.add_argument("--mapped", type=float, default=0.6, help="fraction of the reads that align")
+    parser.add_argument("--multi", type=float, default=0.1, help="fraction of the aligned reads with several alignments")
+    parser.add_argument("--samples", type=int, default=4)
+    bench = parser.parse_args()
+    rng = np.random.default_rng(1)
+
+    frame = reads_frame(rng, bench.uniques, bench.samples)
+    rows = rng.permutation(len(frame)) # THE ORDER OF THE READS IN THE SAM OUTPUT
+    named, numbered = sam_lines(rng, [seq.encode() for seq in frame.index.values[rows]], bench.mapped, bench.multi)
+    print("%d unique reads, %d SAM records" % (len(frame), len(named)))
+    results = {}
+    for label, update in (("cell by cell", lambda annotated: cell_by_cell(annotated, 'mature tRNA', named)),
+                          ("apply_hits", lambda annotated: bulk(annotated, 'mature tRNA', numbered, rows))):
+        annotated = frame.copy()
+        start = time.perf_counter()
+        update(annotated)
+        results[label] = (annotated, time.perf_counter() - start)
+        print("%-13s %8.2f s" % (label, results[label][1]))
+    same = results["cell by cell"][0].equals(results["apply_hits"][0])
+    print("speed-up      %8.1fx\nidentical DataFrames: %s" % (results["cell by cell"][1] / results["apply_hits"][1], same))
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+EQUIVALENCE CHECK AND BENCHMARK OF THE --numba-pll KERNELS (mirge/libs/kernels.py).
+EACH CALLER IS RUN ON SYNTHETIC DATA ONCE WITH ITS PURE PYTHON CODE AND ONCE WITH THE KERNEL; THE RESULTS MUST BE IDENTICAL.
+WITHOUT numba THE KERNELS RUN AS PLAIN PYTHON, WHICH STILL CHECKS THE EQUIVALENCE BUT NOT THE SPEED. EXITS WITH 1 ON ANY DIFFERENCE.
+THE QUICK CHECK OF THE SAME EQUIVALENCE, ON SMALL FIXED INPUTS, IS tests/test_kernels.py (python -m pytest tests).
+
+    python benchmarks/bench_kernels.py [--reads 200000] [--trf-reads 400] [--a2i-reads 300]
+"""
+import argparse
+import io
+import random
+import sys
+import time
+
+import numpy as np
+
+from mirge.classes.collapsedStore import CollapsedStore
+from mirge.libs import digest, kernels
+from mirge.libs import mirge2_tRF_a2i as a2i
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def compare(label, fallback, kernel, *args):
+    """
+    RUNS fallback WITH THE KERNELS OFF AND kernel WITH THE KERNELS ON (BOTH ON THE SAME args); RETURNS True IF THE RESULTS ARE EQUAL
+    """
+    kernels.enabled = False
+    expected, slow = timed(fallback, *args)
+    kernels.enabled = True
+    timed(kernel, *args) # THE FIRST CALL INCLUDES THE numba COMPILATION (OR LOADING IT FROM THE CACHE)
+    result, fast = timed(kernel, *args)
+    kernels.enabled = False
+    same = expected == result
+    print("%-28s python %8.3f s  kernel %8.3f s  speed-up %6.1fx  identical: %s" % (label, slow, fast, slow / max(fast, 1e-9), same))
+    return same
+
+
+def umi_fallback(store, front, back, min_len):
+    """
+    THE -umi BRANCH OF baking() WITHOUT --numba-pll
+    """
+    pureSeqs = []
+    pureCounts = []
+    trimmed = 0
+    for s, c in store.items():
+        pureSeq, cutumiSeq = digest.UMIParser(s, front, back)
+        if len(pureSeq) >= min_len:
+            pureSeqs.append(pureSeq)
+            pureCounts.append(c)
+            trimmed += c
+    pureStore = CollapsedStore()
+    pureStore.add(pureSeqs, pureCounts)
+    return sorted(pureStore.items()), trimmed
+
+
+def umi_kernel(store, front, back, min_len):
+    pureStore, trimmed = digest.umi_trim_packed(store, front, back, min_len)
+    return sorted(pureStore.items()), trimmed
+
+
+def synthetic_store(rng, reads):
+    store = CollapsedStore()
+    seqs = ["".join(rng.choice("ACGT") for _ in range(rng.randint(14, 40))) for _ in range(reads)]
+    seqs += [seq[:5] + "N" + seq[6:] for seq in seqs[:reads // 50]]
+    store.add(seqs, [rng.randint(1, 100) for _ in seqs])
+    return store
+
+
+def aligned_reads(rng, reads, width=60):
+    """
+    READS OF A tRNA CLUSTER AS IN THE *.potential_tRFs.clusters.detail FILE: DASH PADDED TO THE SAME width, WITH A FEW MISMATCHES
+    """
+    template = "".join(rng.choice("ACGT") for _ in range(width))
+    readInforDic = {}
+    for idx in range(1, reads + 1):
+        start = rng.randint(0, width // 2)
+        end = rng.randint(start + 14, width)
+        bases = [rng.choice("ACGT") if rng.random() < 0.03 else base for base in template[start:end]]
+        readInforDic[idx] = {'allignedSeq': "-" * start + "".join(bases) + "-" * (width - end), 'count': 1}
+    return readInforDic
+
+
+def isomirs(rng, reads):
+    """
+    A CANONICAL miRNA, ISOMIRS OF IT WITH SHIFTED ENDS AND A-TO-G CHANGES, THEIR COUNTS AND THE RETAINED SEQUENCES
+    """
+    flank = "".join(rng.choice("ACGT") for _ in range(6))
+    target = "".join(rng.choice("ACGT") for _ in range(22))
+    extended = flank + target + flank
+    seqs = {target}
+    while len(seqs) < reads:
+        start = rng.randint(3, 9)
+        seq = list(extended[start:start + rng.randint(18, 24)])
+        for pos in range(len(seq)):
+            if seq[pos] == "A" and rng.random() < 0.1:
+                seq[pos] = "G"
+        seqs.add("".join(seq))
+    seqs = sorted(seqs)
+    counts = [rng.randint(1, 500) for _ in seqs]
+    retained = {seq: 1 for seq in seqs if rng.random() < 0.8}
+    return target, seqs, counts, retained
+
+
+def a2i_call(target, seqs, counts, retained):
+    detail = io.StringIO()
+    result = a2i.A2IEditing(target, seqs, counts, "hsa-miR-test", detail, retained, "A", "G")
+    return result, detail.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="equivalence check and benchmark of the --numba-pll kernels")
+    parser.add_argument("--reads", type=int, default=200000, help="unique reads of the UMI test")
+    parser.add_argument("--trf-reads", type=int, default=400, help="reads of the tRF clustering test")
+    parser.add_argument("--a2i-reads", type=int, default=300, help="isomiRs of the A-to-I test")
+    bench = parser.parse_args()
+    rng = random.Random(1)
+    print("numba:", kernels.numba.__version__ if kernels.numba is not None else "not installed, the kernels run as python")
+
+    ok = True
+    store = synthetic_store(rng, bench.reads)
+    for front, back in ((0, 4), (4, 4), (4, 0), (12, 12)):
+        ok &= compare("UMI split -umi %d,%d" % (front, back), umi_fallback, umi_kernel, store, front, back, 16)
+    ok &= compare("tRF getDistance", a2i.getDistance, a2i.getDistance, aligned_reads(rng, bench.trf_reads))
+    target, seqs, counts, retained = isomirs(rng, bench.a2i_reads)
+    ok &= compare("A-to-I A2IEditing", a2i_call, a2i_call, target, seqs, counts, retained)
+    ok &= compare("mismatchCountAnalysis", a2i.mismatchCountAnalysis, a2i.mismatchCountAnalysis, target, seqs, counts, retained)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
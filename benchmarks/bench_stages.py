@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+"""
+PER-STAGE BENCHMARK OF THE miRge3.0 PIPELINE ON A SYNTHETIC DATASET (synthetic.py), TO CATCH THROUGHPUT AND MEMORY REGRESSIONS BEFORE A
+RELEASE. THE STAGES ARE
+    trim         baking(): TRIMMING BY THE WORKER POOL, COLLAPSING AND THE COUNT MATRIX, FROM THE FASTQ FILES          (ITEMS: READS)
+    collapse     CollapsedStore, SequenceTable AND sparse_counts() ALONE, ON THE EXPECTED TRIMMED READS              (ITEMS: READS)
+    align_parse  bwtAlign(): THE NINE bowtie CALLS AND THE PARSING OF THEIR SAM OUTPUT                              (ITEMS: UNIQUE READS)
+    summarize    summarize() WITHOUT THE STAGES BELOW                                                               (ITEMS: MAPPED UNIQUE READS)
+    gff          create_gff() (-gff), INSIDE summarize()
+    trf          trna_deliverables() (-trf), INSIDE summarize()
+    a2i          a2i_editing() (-ai), INSIDE summarize()
+    novel        predict_nmir() (-nmir); ONLY WITH bowtie, bowtie-build, samtools AND RNAfold INSTALLED            (ITEMS: UNMAPPED UNIQUE READS)
+EACH STAGE RUNS IN A PROCESS OF ITS OWN, SO ITS peak_rss_mb (FROM run.metrics.jsonl, SEE mirge/libs/metrics.py) IS ITS OWN; gff, trf AND
+a2i RUN IN THE summarize PROCESS AND SHARE ITS PEAK. own_s IS THE WALL TIME OF THE STAGE WITHOUT THE EXTERNAL COMMANDS (bowtie, ...) AND
+WITHOUT THE NESTED STAGES: THE PART THAT CHANGES WITH THE PYTHON CODE. WITHOUT bowtie (OR WITH --aligner truth), THE bowtie CALLS ARE
+ANSWERED FROM THE TRUTH TABLES OF THE DATASET BY truth_aligner.py.
+THE RESULTS GO TO --output AS JSON, WITH THE VERSIONS OF THE ENVIRONMENT; WITH --baseline (AN EARLIER --output) A STAGE WHOSE own_s OR
+peak_rss_mb GREW BY MORE THAN --tolerance IS REPORTED AS A REGRESSION AND THE EXIT STATUS IS 1.
+
+    python benchmarks/bench_stages.py [--data bench_data] [--reads 200000] [--samples 2] [--stages trim,align_parse,...] [--repeat 3]
+                                      [--output results.json] [--baseline previous.json] [--tolerance 0.25]
+"""
+import argparse
+import gzip
+import json
+import os
+import pickle
+import platform
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import synthetic
+
+all_stages = ["trim", "collapse", "align_parse", "summarize", "gff", "trf", "a2i", "novel"]
+nested_stages = ["gff", "trf", "a2i"] # THE metrics.stage() NAMES OF create_gff(), trna_deliverables() AND a2i_editing() IN summarize()
+summary_flags = {"gff": "-gff", "trf": "-trf", "a2i": "-ai"}
+needs = {"align_parse": ["trim"], "summarize": ["trim", "align_parse"], "novel": ["trim", "align_parse"]}
+floor_seconds = 0.05 # SMALLER CHANGES OF own_s ARE NOISE, WHATEVER THE RATIO
+floor_mb = 20.0
+block_lines = 1000000 # READS PER CollapsedStore.add() OF THE collapse STAGE
+
+
+def mirge_argv(data, dataset, threads, bowtiePath, flags):
+    """
+    THE COMMAND LINE OF miRge3.0 FOR THE DATASET, PARSED BY parseArg() IN EACH STAGE PROCESS; WITHOUT THE CHECKPOINTS AND THE
+    ANNOTATION CACHE (OFF WITHOUT -ckp AND -acd), SO THAT EVERY REPEAT DOES ALL THE WORK OF ITS STAGE
+    """
+    argv = ["miRge3.0", "-s", ",".join(str(data/(sample + ".fastq.gz")) for sample in dataset["sample_names"]), "-lib", str(data/"libs"),
+            "-on", dataset["organism"], "-db", dataset["ref_db"], "-a", dataset["adapter"], "-cpu", str(threads), "-shh"]
+    if dataset.get("umi"):
+        argv += ["-umi", dataset["umi"]]
+    if bowtiePath:
+        argv += ["-pbwt", str(bowtiePath)]
+    return argv + flags
+
+
+def stage_trim(args, data, work):
+    from mirge.libs.digest import baking
+    from mirge.libs.miRgeEssential import validate_files
+    fastqs, baseNames = validate_files(args, args.samples[0].split(","), str(work/"run.log"))
+    result = baking(args, fastqs, baseNames, work)
+    with open(work/"trim.pkl", "wb") as fout:
+        pickle.dump((baseNames,) + tuple(result), fout)
+    return sum(result[1].values())
+
+
+def stage_collapse(args, data, work):
+    from mirge.classes.collapsedStore import CollapsedStore, SequenceTable
+    from mirge.libs.countMatrix import sparse_counts
+    import pandas as pd
+    dataset = json.loads((data/"dataset.json").read_text())
+    seqTable = SequenceTable()
+    sampleCounts = []
+    reads = 0
+    for sample in dataset["sample_names"]:
+        store = CollapsedStore()
+        with gzip.open(data/(sample + ".inserts.txt.gz"), "rt") as fin:
+            block = []
+            for line in fin:
+                block.append(line.rstrip("\n"))
+                if len(block) == block_lines:
+                    store.add(block)
+                    reads += len(block)
+                    block = []
+            store.add(block)
+            reads += len(block)
+        sampleCounts.append(seqTable.intern(store))
+    sequences, countMatrix = seqTable.matrix(sampleCounts)
+    sparse_counts(countMatrix, pd.Index(sequences, name="Sequence"), dataset["sample_names"])
+    return reads
+
+
+def stage_align_parse(args, data, work):
+    from mirge.libs.manifoldAlign import bwtAlign
+    with open(work/"trim.pkl", "rb") as fin:
+        pdDataFrame = pickle.load(fin)[1]
+    items = len(pdDataFrame)
+    pdDataFrame = bwtAlign(args, pdDataFrame, work, args.mir_DB)
+    with open(work/"align.pkl", "wb") as fout:
+        pickle.dump(pdDataFrame, fout)
+    return items
+
+
+def stage_summarize(args, data, work):
+    from mirge.libs.summary import summarize
+    with open(work/"trim.pkl", "rb") as fin:
+        baseNames, pdDataFrame, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique, laneReadCounts = pickle.load(fin)
+    with open(work/"align.pkl", "rb") as fin:
+        pdDataFrame = pickle.load(fin)
+    pdMapped = pdDataFrame[pdDataFrame.annotFlag.eq(1)]
+    summarize(args, work, args.mir_DB, baseNames, pdMapped, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique, laneReadCounts)
+    return len(pdMapped)
+
+
+def stage_novel(args, data, work):
+    from mirge.libs.novel_mir import predict_nmir
+    with open(work/"trim.pkl", "rb") as fin:
+        baseNames = pickle.load(fin)[0]
+    with open(work/"align.pkl", "rb") as fin:
+        pdDataFrame = pickle.load(fin)
+    pdUnmapped = pdDataFrame[pdDataFrame.annotFlag.eq(0)]
+    predict_nmir(args, work, args.mir_DB, baseNames, pdUnmapped)
+    return len(pdUnmapped)
+
+
+stage_functions = {"trim": stage_trim, "collapse": stage_collapse, "align_parse": stage_align_parse, "summarize": stage_summarize, "novel": stage_novel}
+
+
+def run_stage(name, data, work, argv):
+    """
+    BODY OF A STAGE PROCESS: RUNS ONE STAGE UNDER metrics.stage(), WRITING work/<name>.metrics.jsonl
+    """
+    from mirge.libs import kernels, metrics
+    from mirge.libs.parse import parseArg
+    sys.argv = argv
+    args = parseArg()
+    kernels.enable(args.numba_pll)
+    metrics.start(work/(name + ".metrics.jsonl"), args)
+    with metrics.stage(name) as info:
+        info["items"] = stage_functions[name](args, data, work)
+    metrics.finish()
+
+
+def read_metrics(path):
+    with open(path) as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+def measure(name, records):
+    """
+    THE RESULT OF A STAGE FROM THE RECORDS OF ITS PROCESS; summarize ALSO GIVES THE RESULTS OF ITS NESTED STAGES
+    """
+    stages = {record["stage"]: record for record in records if record["type"] == "stage" and record.get("sample") is None}
+    external = {}
+    for record in records:
+        if record["type"] == "subprocess":
+            external[record["stage"]] = external.get(record["stage"], 0.0) + record["wall_s"]
+    main = stages[name]
+    results = {}
+    nestedWall = 0.0
+    for nested in nested_stages:
+        if nested in stages and name == "summarize":
+            record = stages[nested]
+            nestedWall += record["wall_s"]
+            results[nested] = {"wall_s": record["wall_s"], "cpu_s": record["cpu_s"], "external_s": round(external.get(nested, 0.0), 4),
+                               "own_s": round(record["wall_s"] - external.get(nested, 0.0), 4), "peak_rss_mb": record["peak_rss_mb"], "items": main["items"]}
+    results[name] = {"wall_s": main["wall_s"], "cpu_s": main["cpu_s"], "external_s": round(external.get(name, 0.0), 4),
+                     "own_s": round(main["wall_s"] - external.get(name, 0.0) - nestedWall, 4), "peak_rss_mb": main["peak_rss_mb"], "items": main["items"]}
+    workers = [record["worker_peak_rss_mb"] for record in records if record["type"] == "stage" and "worker_peak_rss_mb" in record]
+    if workers:
+        results[name]["worker_peak_rss_mb"] = max(workers)
+    for result in results.values():
+        result["items_per_s"] = round(result["items"] / result["own_s"], 1) if result["own_s"] > 0 else None
+    return results
+
+
+def environment():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+    for package in ("numpy", "pandas", "scipy", "cutadapt", "dnaio", "numba"):
+        try:
+            info[package] = __import__(package).__version__
+        except ImportError:
+            info[package] = None
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        info["commit"] = None
+    return info
+
+
+def prepare_data(bench):
+    """
+    GENERATES THE DATASET, OR REUSES THE ONE IN --data IF IT WAS GENERATED WITH THE SAME PARAMETERS
+    """
+    data = Path(bench.data)
+    params = synthetic.parser().parse_args([str(data), "--reads", str(bench.reads), "--samples", str(bench.samples), "--seed", str(bench.seed)]
+                                           + (["--umi", bench.umi] if bench.umi else []))
+    wanted = {name: value for name, value in vars(params).items() if name != "outdir"}
+    described = data/"dataset.json"
+    if described.exists():
+        dataset = json.loads(described.read_text())
+        if all(dataset.get(name) == value for name, value in wanted.items()):
+            return data, dataset
+    print("generating the dataset in %s ..." % data)
+    return data, synthetic.generate(params)
+
+
+def compare(results, baseline, tolerance):
+    """
+    THE REGRESSIONS OF results AGAINST baseline: [(STAGE, MEASURE, BASELINE, NOW)]
+    """
+    regressions = []
+    for name, result in results["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or "skipped" in result or "skipped" in before:
+            continue
+        for measure, floor in (("own_s", floor_seconds), ("peak_rss_mb", floor_mb)):
+            if result[measure] > before[measure] * (1 + tolerance) and result[measure] - before[measure] > floor:
+                regressions.append((name, measure, before[measure], result[measure]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-stage benchmark of miRge3.0 on a synthetic dataset")
+    parser.add_argument("--data", default="bench_data", help="dataset directory, generated if missing or different (Default: %(default)s)")
+    parser.add_argument("--reads", type=int, default=200000, help="reads per sample")
+    parser.add_argument("--samples", type=int, default=2)
+    parser.add_argument("--umi", default=None, help="UMI bases in the reads, e.g. 4,4")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--stages", default=",".join(all_stages))
+    parser.add_argument("--aligner", choices=["auto", "bowtie", "truth"], default="auto", help="auto: bowtie if it and the dataset indexes exist")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each stage; the fastest (own_s) is kept")
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth of own_s and peak_rss_mb")
+    parser.add_argument("--run-stage", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--work", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("mirge_argv", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    bench = parser.parse_args()
+    if bench.run_stage:
+        run_stage(bench.run_stage, Path(bench.data), Path(bench.work), bench.mirge_argv[1:])
+        return
+
+    selected = [name for name in bench.stages.split(",") if name]
+    unknown = set(selected) - set(all_stages)
+    if unknown:
+        parser.error("unknown stage(s) %s (one of %s)" % (", ".join(sorted(unknown)), ", ".join(all_stages)))
+    data, dataset = prepare_data(bench)
+    data = data.resolve()
+    realBowtie = shutil.which("bowtie") is not None and dataset.get("bowtie_indexes")
+    if bench.aligner == "bowtie" and not realBowtie:
+        sys.exit("bowtie or the bowtie indexes of the dataset are missing (generate the dataset with bowtie-build installed)")
+    bowtiePath = None if bench.aligner != "truth" and realBowtie else data/"bin"
+    skipped = {}
+    if "novel" in selected and (bowtiePath is not None or not all(shutil.which(tool) for tool in ("bowtie-build", "samtools", "RNAfold"))):
+        skipped["novel"] = "needs bowtie, bowtie-build, samtools and RNAfold"
+    flags = [summary_flags[name] for name in nested_stages if name in selected] # bwtAlign() ALREADY WRITES THE tRNA SAM FILES OF -trf
+    wanted = {("summarize" if name in nested_stages else name) for name in selected if name not in skipped}
+    wanted.update(*[needs.get(name, []) for name in list(wanted)])
+    processes = [name for name in all_stages if name in wanted]
+
+    print("aligner: %s; stages: %s" % ("bowtie" if bowtiePath is None else "truth tables", ", ".join(processes)))
+    best = {}
+    for attempt in range(bench.repeat):
+        work = data/"bench.work"
+        shutil.rmtree(work, ignore_errors=True)
+        work.mkdir()
+        for name in processes:
+            argv = mirge_argv(data, dataset, bench.threads, bowtiePath, flags)
+            with open(work/(name + ".log"), "w") as log:
+                status = subprocess.run([sys.executable, __file__, "--run-stage", name, "--data", str(data), "--work", str(work), "--"] + argv,
+                                        stdout=log, stderr=subprocess.STDOUT).returncode
+            if status:
+                sys.exit("stage %s failed, see %s" % (name, work/(name + ".log")))
+            for stage, result in measure(name, read_metrics(work/(name + ".metrics.jsonl"))).items():
+                if stage not in best or result["own_s"] < best[stage]["own_s"]:
+                    best[stage] = result
+
+    results = {"environment": environment(), "dataset": dataset, "aligner": "bowtie" if bowtiePath is None else "truth", "threads": bench.threads,
+               "repeat": bench.repeat, "stages": {}}
+    print("\n%-12s %10s %10s %10s %12s %14s" % ("stage", "wall_s", "own_s", "external_s", "peak_rss_mb", "items/s"))
+    for name in all_stages:
+        if name in skipped and name in selected:
+            results["stages"][name] = {"skipped": skipped[name]}
+            print("%-12s skipped: %s" % (name, skipped[name]))
+        elif name in best and (name in selected or name in processes):
+            result = results["stages"][name] = best[name]
+            print("%-12s %10.3f %10.3f %10.3f %12.1f %14s" % (name, result["wall_s"], result["own_s"], result["external_s"], result["peak_rss_mb"], result["items_per_s"]))
+    if bench.output:
+        Path(bench.output).write_text(json.dumps(results, indent=2) + "\n")
+    if bench.baseline:
+        regressions = compare(results, json.loads(Path(bench.baseline).read_text()), bench.tolerance)
+        for name, quantity, before, now in regressions:
+            print("REGRESSION %s %s: %s -> %s" % (name, quantity, before, now))
+        if not regressions:
+            print("\nno regression against %s (tolerance %.0f%%)" % (bench.baseline, 100 * bench.tolerance))
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+BENCHMARK OF THE PER-WORKER TRIMMING CACHE (-tc, --trim-cache).
+GENERATES A SYNTHETIC SMALL-RNA FASTQ WITH A ZIPF-LIKE ABUNDANCE OF INSERTS (A FEW SEQUENCES MAKE UP MOST OF THE READS),
+THEN TRIMS IT IN A SINGLE PROCESS WITH THE CACHE ON AND OFF. REPORTS READS/SECOND, THE CACHE HIT RATE AND CHECKS THAT
+BOTH RUNS COLLAPSE TO THE SAME COUNTS.
+
+    python benchmarks/bench_trim_cache.py [--reads 200000] [--uniques 20000] [--low-quality 0.1]
+"""
+import argparse
+import io
+import random
+import sys
+import time
+
+import dnaio
+
+from mirge.libs import digest
+from mirge.libs.parse import parseArg
+
+ADAPTER = "TGGAATTCTCGGGTGCCAAGGAACTCCAG"
+
+
+def synthetic_fastq(reads, uniques, low_quality, seed=1):
+    """
+    RETURNS A FASTQ (bytes) OF reads READS DRAWN FROM uniques INSERTS OF 18-26 nt, EACH FOLLOWED BY THE ILLUMINA ADAPTER.
+    A FRACTION low_quality OF THE READS GETS A LOW QUALITY TAIL, WHICH SENDS THEM DOWN THE UNCACHED PATH.
+    """
+    rng = random.Random(seed)
+    inserts = ["".join(rng.choice("ACGT") for _ in range(rng.randint(18, 26))) for _ in range(uniques)]
+    weights = [1.0 / (rank + 1) for rank in range(uniques)]
+    records = []
+    for idx, insert in enumerate(rng.choices(inserts, weights=weights, k=reads)):
+        seq = (insert + ADAPTER)[:50]
+        qual = "I" * len(seq)
+        if rng.random() < low_quality:
+            qual = qual[:-8] + "#" * 8
+        records.append("@read%d\n%s\n+\n%s\n" % (idx, seq, qual))
+    return "".join(records).encode()
+
+
+def trim_all(args, data, buffer_size):
+    """
+    RUNS THE TRIMMING WORKER FUNCTION IN THIS PROCESS OVER ALL CHUNKS OF data; RETURNS THE COLLAPSED COUNTS, THE ELAPSED TIME AND THE CACHE STATISTICS
+    """
+    digest.init_worker(args)
+    chunks = [bytes(chunk) for chunk in dnaio.read_chunks(io.BytesIO(data), buffer_size)]
+    start = time.perf_counter()
+    collapsed = {}
+    for chunk in chunks:
+        store, count, hist, umi_missing = digest.cutadapt(chunk)
+        for seq, seqCount in store.items():
+            collapsed[seq] = collapsed.get(seq, 0) + seqCount
+    elapsed = time.perf_counter() - start
+    info = digest.trim_cached.cache_info() if digest.trim_cached is not None else None
+    return collapsed, elapsed, info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the trimming cache")
+    parser.add_argument("--reads", type=int, default=200000)
+    parser.add_argument("--uniques", type=int, default=20000)
+    parser.add_argument("--low-quality", type=float, default=0.1, help="fraction of reads with a low quality tail")
+    parser.add_argument("--cache", type=int, default=65536, help="cache size of the cached run")
+    bench = parser.parse_args()
+
+    data = synthetic_fastq(bench.reads, bench.uniques, bench.low_quality)
+    results = {}
+    for label, cache in (("no cache", 0), ("cache", bench.cache)):
+        sys.argv = ["miRge3.0", "-s", "bench.fastq", "-lib", ".", "-on", "human", "-db", "miRBase", "-a", ADAPTER, "-tc", str(cache)]
+        args = parseArg()
+        results[label] = trim_all(args, data, args.buffer_size)
+    print()
+    for label, (collapsed, elapsed, info) in results.items():
+        line = "%-9s %8.0f reads/s  %7.2f s" % (label, bench.reads / elapsed, elapsed)
+        if info is not None:
+            lookups = info.hits + info.misses
+            line += "  hit rate %.1f%% of cached lookups (%d/%d), %.1f%% of all reads" % (100.0 * info.hits / max(lookups, 1), info.hits, lookups, 100.0 * info.hits / bench.reads)
+        print(line)
+    print("speed-up  %.2fx" % (results["no cache"][1] / results["cache"][1]))
+    print("identical collapsed counts:", results["no cache"][0] == results["cache"][0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+EQUIVALENCE CHECK AND BENCHMARK OF THE UMI DEDUPLICATION OF -udd (mirge/libs/umiNetwork.py).
+SIMULATES READS OF KNOWN MOLECULES (INSERT + 3' UMI) WITH PCR AMPLIFICATION AND SEQUENCING ERRORS IN THE UMIs, THEN
+  - CHECKS THAT THE INDEXED NETWORK GIVES THE SAME NUMBER OF MOLECULES PER INSERT AS A PLAIN ALL-PAIRS IMPLEMENTATION OF THE
+    directional AND adjacency METHODS (UMI-tools), ON --check-molecules MOLECULES;
+  - TIMES THE THREE METHODS ON --molecules MOLECULES AND COMPARES THEIR COUNTS WITH THE TRUE NUMBER OF MOLECULES.
+EXITS WITH 1 ON ANY DIFFERENCE.
+
+    python benchmarks/bench_umi_network.py [--molecules 1000000] [--inserts 2000] [--umi 10] [--error-rate 0.002]
+"""
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+from mirge.classes.collapsedStore import CollapsedStore
+from mirge.libs import umiNetwork
+
+
+def simulate(rng, molecules, inserts, umiLen, errorRate):
+    """
+    A CollapsedStore OF READS insert + UMI AND THE TRUE NUMBER OF MOLECULES. EACH MOLECULE GETS 1-20 READS; EACH UMI BASE OF EACH READ IS
+    WRONG WITH PROBABILITY errorRate.
+    """
+    np_rng = np.random.default_rng(rng.randint(0, 1 << 30))
+    insertSeqs = ["".join(rng.choice("ACGT") for _ in range(rng.randint(18, 24))) for _ in range(inserts)]
+    weights = 1.0 / np.arange(1, inserts + 1)
+    owner = np_rng.choice(inserts, size=molecules, p=weights / weights.sum())
+    umis = np_rng.integers(0, 4, size=(molecules, umiLen), dtype=np.uint8)
+    truth = len(set(zip(owner.tolist(), map(bytes, umis))))
+    copies = np_rng.integers(1, 21, size=molecules)
+    reads = np.repeat(umis, copies, axis=0)
+    errors = np_rng.random(reads.shape) < errorRate
+    reads[errors] = (reads[errors] + np_rng.integers(1, 4, size=int(errors.sum()), dtype=np.uint8)) % 4
+    readOwner = np.repeat(owner, copies)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)[reads].view("S%d" % umiLen).ravel()
+    collapsed = Counter(zip(readOwner.tolist(), bases.tolist()))
+    store = CollapsedStore()
+    store.add([insertSeqs[insert] + umi.decode() for insert, umi in collapsed], list(collapsed.values()))
+    return store, truth
+
+
+def hamming1(a, b):
+    return sum(x != y for x, y in zip(a, b)) == 1
+
+
+def reference(store, front, back, min_len, method):
+    """
+    PLAIN UMI-tools ALGORITHMS: FOR EACH INSERT, ALL PAIRS OF UMIs ARE COMPARED. RETURNS insert -> NUMBER OF MOLECULES.
+    """
+    byInsert = {}
+    for s, c in store.items():
+        insert, umi = umiNetwork.umi_split(s, front, back)
+        if len(insert) >= min_len:
+            byInsert.setdefault(insert, {})[umi] = c
+    result = {}
+    for insert, counts in byInsert.items():
+        nodes = sorted(counts, key=lambda umi: (-counts[umi], umi))
+        if method == "directional":
+            edges = {a: [b for b in nodes if hamming1(a, b) and counts[a] >= 2 * counts[b] - 1] for a in nodes}
+        else:
+            edges = {a: [b for b in nodes if hamming1(a, b)] for a in nodes}
+        found = set()
+        molecules = 0
+        for node in nodes:
+            if node in found:
+                continue
+            component = {node}
+            queue = [node]
+            while queue:
+                for neighbour in edges[queue.pop()]:
+                    if neighbour not in component:
+                        component.add(neighbour)
+                        queue.append(neighbour)
+            if method == "directional":
+                molecules += 1
+            else:
+                members = [umi for umi in nodes if umi in component]
+                covered = set()
+                for lead, umi in enumerate(members, 1):
+                    covered.update([umi] + edges[umi])
+                    if covered >= component:
+                        molecules += lead
+                        break
+            found |= component
+        result[insert] = molecules
+    return result
+
+
+def indexed(store, front, back, min_len, method):
+    pureStore, total = umiNetwork.dedup(store, front, back, min_len, method)
+    return dict(pureStore.items()), total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="equivalence check and benchmark of the -udd UMI network")
+    parser.add_argument("--molecules", type=int, default=1000000, help="molecules of the timing run")
+    parser.add_argument("--check-molecules", type=int, default=5000, help="molecules of the equivalence check")
+    parser.add_argument("--inserts", type=int, default=2000)
+    parser.add_argument("--umi", type=int, default=10, help="UMI length (3' end of the read)")
+    parser.add_argument("--error-rate", type=float, default=0.002, help="sequencing error rate of the UMI bases")
+    bench = parser.parse_args()
+    rng = random.Random(1)
+
+    ok = True
+    store, truth = simulate(rng, bench.check_molecules, bench.inserts // 2, bench.umi, 0.02)
+    for method in ("directional", "adjacency"):
+        expected = reference(store, 0, bench.umi, 16, method)
+        result, total = indexed(store, 0, bench.umi, 16, method)
+        same = expected == result
+        ok &= same
+        print("%-12s %7d molecules (true %d), identical to the all-pairs implementation: %s" % (method, total, truth, same))
+
+    store, truth = simulate(rng, bench.molecules, bench.inserts, bench.umi, bench.error_rate)
+    print("\n%d reads, %d distinct reads, %d true molecules" % (store.total(), len(store), truth))
+    for method in umiNetwork.umi_methods:
+        start = time.perf_counter()
+        result, total = indexed(store, 0, bench.umi, 16, method)
+        print("%-12s %8.2f s  %9d molecules  (%+.2f%% of the true count)" % (method, time.perf_counter() - start, total, 100.0 * (total - truth) / truth))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
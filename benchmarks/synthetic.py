@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+"""
+GENERATOR OF REPRODUCIBLE SYNTHETIC SMALL RNA DATASETS FOR THE BENCHMARKS (bench_stages.py). UNDER OUTDIR IT WRITES:
+    libs/human/annotation.Libs, fasta.Libs, index.Libs
+                            A MINIATURE miRge LIBRARY (-lib OUTDIR/libs -on human -db miRBase): miRNA HAIRPINS AND THEIR MATURE miRNAs
+                            (WITH MERGED PARALOGS), tRNAs WITH DUPLICATED COPIES, THEIR PRE-tRNAs AND tRF CLUSTERS, snoRNAs, rRNAs, OTHER
+                            ncRNAs, mRNAs AND A SMALL GENOME CARRYING THE miRNA GENES AND A FEW NOVEL ONES. THE FASTA FILE OF EACH bowtie
+                            INDEX IS WRITTEN AS index.Libs/<index>.fa; THE INDEXES THEMSELVES ARE BUILT WHEN bowtie-build IS INSTALLED.
+    <sample>.fastq.gz       READS OF A MIXTURE OF miRNAs, isomiRs (SOME A-TO-I EDITED), tRFs, tRF-1s, snoRNA, rRNA, ncRNA AND mRNA
+                            FRAGMENTS, NOVEL miRNAs AND UNMAPPABLE READS, WITH OPTIONAL UMI BASES, THE 3' ADAPTER, SEQUENCING ERRORS
+                            AND A ZIPF EXPRESSION PROFILE THAT VARIES FROM SAMPLE TO SAMPLE
+    <sample>.inserts.txt.gz THE EXPECTED TRIMMED READ (INSERT AND UMI BASES) OF EACH READ, ONE PER LINE
+    truth/<index>.tsv       FOR EACH DISTINCT INSERT, WHERE IT LIES ON THE REFERENCES OF THE INDEX (SEE truth_aligner.py)
+    bin/bowtie, bin/bowtie-inspect
+                            WRAPPERS OF truth_aligner.py THAT ANSWER THE bowtie CALLS OF miRge FROM THE TRUTH TABLES, FOR MACHINES WITHOUT
+                            bowtie (-pbwt OUTDIR/bin)
+    dataset.json            THE PARAMETERS: THE SAME PARAMETERS GIVE THE SAME FILES
+
+    python benchmarks/synthetic.py OUTDIR [--samples 2] [--reads 200000] [--mirnas 300] [--umi 4,4] [--error-rate 0.001] ...
+"""
+import argparse
+import gzip
+import json
+import pickle
+import random
+import re
+import shutil
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+organism = "human" # tRF DETECTION (-trf) IS ONLY SUPPORTED FOR human
+ref_db = "miRBase"
+truseq = "TGGAATTCTCGGGTGCCAAGGAACTCCAG"
+complement = str.maketrans("ACGT", "TGCA")
+
+# THE bowtie INDEXES OF A LIBRARY, NAMED AS IN manifoldAlign.bwtAlign(), summarize() AND a2i_editing()
+index_names = {
+    "mirna": organism + "_mirna_" + ref_db,
+    "hairpin": organism + "_hairpin_" + ref_db,
+    "mature_trna": organism + "_mature_trna",
+    "pre_trna": organism + "_pre_trna",
+    "snorna": organism + "_snorna",
+    "rrna": organism + "_rrna",
+    "ncrna_others": organism + "_ncrna_others",
+    "mrna": organism + "_mrna",
+    "genome": organism + "_genome",
+}
+# OTHER RNA CLASSES: NAME PREFIX AND LENGTH RANGE
+other_classes = {"snorna": ("SNORD", 70, 140), "rrna": ("RNA5-8SP", 150, 1900), "ncrna_others": ("LINC", 100, 400), "mrna": ("NM_", 500, 2000)}
+anticodons = [("Ala", "AGC"), ("Arg", "ACG"), ("Asn", "GTT"), ("Asp", "GTC"), ("Cys", "GCA"), ("Gln", "CTG"), ("Glu", "CTC"), ("Gly", "GCC"),
+              ("His", "GTG"), ("Ile", "AAT"), ("Leu", "CAG"), ("Lys", "CTT"), ("Met", "CAT"), ("Phe", "GAA"), ("Ser", "GCT"), ("Thr", "AGT"),
+              ("Trp", "CCA"), ("Tyr", "GTA"), ("Val", "CAC")]
+# CLOVERLEAF OF A 72 nt tRNA + CCA, ANTICODON (XXX) AT 34-36 AS summarize() EXPECTS IT
+trna_structure = "(((((((..((((........)))).(((((..XXX..))))).....(((((.......))))))))))))..."
+trna_body = 72
+# tRF CLUSTERS OF EACH tRNA (1-BASED, INCLUSIVE, ON THE MATURE tRNA)
+trf_clusters = [("5'-tRF", 1, 18), ("5'-half", 1, 34), ("i-tRF", 20, 40), ("3'-half", 36, 75), ("3'-tRF", 58, 75)]
+# miRNA HAIRPIN: FLANK, 5p ARM, LOOP, 3p ARM, FLANK
+flank, arm, loop = 20, 22, 12
+categories = ["mirna", "isomir", "trf", "pretrna", "snorna", "rrna", "ncrna_others", "mrna", "novel", "unmapped"]
+default_mix = "mirna=0.55,isomir=0.15,trf=0.08,pretrna=0.02,snorna=0.04,rrna=0.06,ncrna_others=0.03,mrna=0.03,novel=0.01,unmapped=0.03"
+low_quality_fraction = 0.1 # READS WHOSE LAST BASES HAVE A LOW QUALITY (THEY SKIP THE TRIMMING CACHE OF THE WORKERS)
+max_mismatches = 3 # THE TRUTH TABLES KEEP THE PLACEMENTS WITH AT MOST THIS MANY MISMATCHES (bowtie -v 3)
+
+
+def random_seq(rng, length):
+    return "".join(rng.choices("ACGT", k=length))
+
+
+def revcomp(seq):
+    return seq.translate(complement)[::-1]
+
+
+def parse_mix(text):
+    """
+    "mirna=0.5,trf=0.1,..." -> PROBABILITIES OF THE READ categories (THE MISSING ONES ARE 0), NORMALIZED
+    """
+    mix = dict.fromkeys(categories, 0.0)
+    for item in text.split(","):
+        name, value = item.split("=")
+        if name not in mix:
+            raise argparse.ArgumentTypeError("unknown read category '%s' (one of %s)" % (name, ", ".join(categories)))
+        mix[name] = float(value)
+    total = sum(mix.values())
+    return {name: value / total for name, value in mix.items()}
+
+
+class Library:
+    """
+    THE SEQUENCES OF A MINIATURE LIBRARY. refs[KEY OF index_names] MAPS THE REFERENCE NAMES OF EACH bowtie INDEX TO THEIR SEQUENCES.
+    """
+    def __init__(self):
+        self.refs = {key: {} for key in index_names}
+        self.matures = {} # HAIRPIN -> [(MATURE NAME, 0-BASED START IN THE HAIRPIN)]
+        self.novel = {} # NOVEL HAIRPIN -> SEQUENCE; ONLY IN THE GENOME
+        self.loci = {} # HAIRPIN OR NOVEL HAIRPIN -> (CHROMOSOME, 0-BASED START, STRAND)
+        self.merges = [] # (MERGED NAME, [MATURE NAMES WITH THE SAME SEQUENCE])
+        self.trnas = [] # (AMINO ACID, ANTICODON, [NAMES OF THE IDENTICAL COPIES])
+        self.pre = {} # tRNA COPY -> (PRE-tRNA NAME, LEADER LENGTH)
+        self.copies = defaultdict(dict) # INDEX KEY -> NAME -> ALL THE NAMES OF THE INDEX WITH THE SAME SEQUENCE
+        self.edited = set() # HAIRPINS WHOSE isomiRs ARE A-TO-I EDITED
+
+
+def hairpin(rng):
+    """
+    A miRNA HAIRPIN: THE 3p ARM PAIRS WITH THE 5p ARM EXCEPT FOR TWO MISMATCHES
+    """
+    arm5 = random_seq(rng, arm)
+    arm3 = list(revcomp(arm5))
+    for pos in (6, 15):
+        arm3[pos] = rng.choice([base for base in "ACGT" if base != arm3[pos]])
+    return random_seq(rng, flank) + arm5 + random_seq(rng, loop) + "".join(arm3) + random_seq(rng, flank)
+
+
+def build_library(params):
+    rng = random.Random(params.seed)
+    lib = Library()
+    for i in range(params.mirnas):
+        name = "hsa-mir-%d" % (i + 1)
+        seq = hairpin(rng)
+        if i % 25 == 1: # A PARALOG OF THE PREVIOUS GENE: SAME 5p miRNA, MERGED IN THE ANNOTATION
+            previous = lib.refs["hairpin"]["hsa-mir-%d" % i]
+            seq = seq[:flank] + previous[flank:flank + arm] + seq[flank + arm:]
+        lib.refs["hairpin"][name] = seq
+        lib.matures[name] = [("hsa-miR-%d-5p" % (i + 1), flank), ("hsa-miR-%d-3p" % (i + 1), flank + arm + loop)]
+        for mature, start in lib.matures[name]:
+            lib.refs["mirna"][mature] = seq[start:start + arm]
+        if i % 10 == 3:
+            lib.edited.add(name)
+    bySequence = defaultdict(list)
+    for mature, seq in lib.refs["mirna"].items():
+        bySequence[seq].append(mature)
+    for names in bySequence.values():
+        for mature in names:
+            lib.copies["mirna"][mature] = names
+        if len(names) > 1:
+            lib.merges.append(("/".join(names), names))
+    for i in range(params.novel):
+        lib.novel["novel-mir-%d" % (i + 1)] = hairpin(rng)
+
+    for k in range(params.trnas):
+        aa, anticodon = anticodons[k % len(anticodons)]
+        body = random_seq(rng, trna_body)
+        body = body[:33] + anticodon + body[36:]
+        names = ["tRNA-%s-%s-%d-1" % (aa, anticodon, k // len(anticodons) + 1)]
+        if k % 5 == 0: # MULTICOPY GENE: AN IDENTICAL MATURE tRNA, WITH ITS OWN PRE-tRNA
+            names.append(names[0][:-1] + "2")
+        lib.trnas.append((aa, anticodon, names))
+        for name in names:
+            lib.refs["mature_trna"][name] = body + "CCA"
+            lib.copies["mature_trna"][name] = names
+            leader = random_seq(rng, 10)
+            trailer = random_seq(rng, rng.randint(15, 20))
+            trailer = trailer[:-1] + "G" if trailer.endswith("T") else trailer
+            lib.refs["pre_trna"]["pre_" + name] = leader + body + trailer + "TTTT"
+            lib.pre[name] = ("pre_" + name, len(leader))
+
+    for key, (prefix, shortest, longest) in other_classes.items():
+        for i in range(params.other_rnas):
+            lib.refs[key]["%s%d" % (prefix, i + 1)] = random_seq(rng, rng.randint(shortest, longest))
+
+    # THE GENOME: THE miRNA AND NOVEL HAIRPINS, ON BOTH STRANDS, SEPARATED BY RANDOM SPACERS, OVER THREE CHROMOSOMES
+    chromosomes = {"chr%d" % (c + 1): [] for c in range(3)}
+    lengths = dict.fromkeys(chromosomes, 0)
+    genes = list(lib.refs["hairpin"].items()) + list(lib.novel.items())
+    for g, (name, seq) in enumerate(genes):
+        chrom = "chr%d" % (g % 3 + 1)
+        spacer = random_seq(rng, rng.randint(100, 400))
+        strand = "+" if g % 2 == 0 else "-"
+        chromosomes[chrom].append(spacer)
+        lib.loci[name] = (chrom, lengths[chrom] + len(spacer), strand)
+        chromosomes[chrom].append(seq if strand == "+" else revcomp(seq))
+        lengths[chrom] += len(spacer) + len(seq)
+    for chrom, parts in chromosomes.items():
+        lib.refs["genome"][chrom] = "".join(parts) + random_seq(rng, 1000)
+    return lib
+
+
+def write_fasta(path, records, width=None):
+    with open(path, "w") as fout:
+        for name, seq in records:
+            fout.write(">" + name + "\n")
+            for start in range(0, len(seq), width or max(len(seq), 1)):
+                fout.write(seq[start:start + (width or len(seq))] + "\n")
+
+
+def write_library(lib, libDir, build):
+    """
+    WRITES THE LIBRARY IN THE LAYOUT OF THE miRge LIBRARIES; build: RUN bowtie-build ON EACH INDEX
+    """
+    annotation, fasta, index = (libDir/organism/name for name in ("annotation.Libs", "fasta.Libs", "index.Libs"))
+    for path in (annotation, fasta, index):
+        path.mkdir(parents=True, exist_ok=True)
+
+    write_fasta(fasta/(organism + "_mature_" + ref_db + ".fa"), lib.refs["mirna"].items())
+    # THE REFERENCE SEQUENCE OF EACH miRNA FOR a2i_editing(), UNDER ITS OWN AND ITS MERGED NAME
+    write_fasta(fasta/(organism + "_mirna_SNP_pseudo_" + ref_db + ".fa"),
+                list(lib.refs["mirna"].items()) + [(merged, lib.refs["mirna"][names[0]]) for merged, names in lib.merges])
+    with open(fasta/(organism + "_genome.pckl"), "wb") as fout:
+        pickle.dump(lib.refs["genome"], fout)
+    with open(annotation/(organism + "_genome_repeats.pckl"), "wb") as fout:
+        pickle.dump({}, fout)
+    with open(annotation/(organism + "_merges_" + ref_db + ".csv"), "w") as fout:
+        for merged, names in lib.merges:
+            fout.write(",".join([merged] + names) + "\n")
+    with open(annotation/(organism + "_miRNAs_in_repetitive_element_" + ref_db + ".csv"), "w") as fout:
+        fout.write("hsa-miR-2-3p,synthetic repeat\n")
+
+    # miRBase-LIKE GFF3 OF THE miRNA GENES, IN GENOME COORDINATES
+    with open(annotation/(organism + "_" + ref_db + ".gff3"), "w") as fout:
+        fout.write("##gff-version 3\n# synthetic miRNA annotation for the miRge3.0 benchmarks\n")
+        for number, (name, seq) in enumerate(lib.refs["hairpin"].items(), 1):
+            chrom, start, strand = lib.loci[name]
+            fout.write("%s\t.\tmiRNA_primary_transcript\t%d\t%d\t.\t%s\t.\tID=MI%07d;Alias=MI%07d;Name=%s\n" % (chrom, start + 1, start + len(seq), strand, number, number, name))
+            for mature, offset in lib.matures[name]:
+                matureStart = start + offset if strand == "+" else start + len(seq) - offset - arm
+                mimat = number * 2 + (offset > flank)
+                fout.write("%s\t.\tmiRNA\t%d\t%d\t.\t%s\t.\tID=MIMAT%07d;Alias=MIMAT%07d;Name=%s;Derives_from=MI%07d\n" % (chrom, matureStart + 1, matureStart + arm, strand, mimat, mimat, mature, number))
+
+    # tRNA ANNOTATION OF -trf
+    with open(annotation/(organism + "_trna.str"), "w") as fstr, open(annotation/(organism + "_trna_aminoacid_anticodon.csv"), "w") as faa:
+        for aa, anticodon, names in lib.trnas:
+            for name in names:
+                fstr.write(">%s\n%s\n%s\n" % (name, lib.refs["mature_trna"][name], trna_structure))
+                faa.write("%s,%s,%s\n%s,%s,%s\n" % (name, aa, anticodon, lib.pre[name][0], aa, anticodon))
+    with open(annotation/(organism + "_trna_deduplicated_list.csv"), "w") as fout:
+        fout.write("unique tRNA,duplicated tRNAs\n")
+        for aa, anticodon, names in lib.trnas:
+            if len(names) > 1:
+                fout.write("%s,%s\n" % (names[0], "/".join(names)))
+    with open(annotation/(organism + "_tRF_infor.csv"), "w") as finfo, open(annotation/(organism + "_tRF_merges.csv"), "w") as fmerge:
+        finfo.write("cluster name,tRF type,tRNA,position,sequence,tRNA sequence\n")
+        for aa, anticodon, names in lib.trnas:
+            seq = lib.refs["mature_trna"][names[0]]
+            for number, (trfType, start, end) in enumerate(trf_clusters, 1):
+                clusters = ["%s_Cluster%d" % (name, number) for name in names]
+                for cluster, name in zip(clusters, names):
+                    finfo.write("%s,%s,%s,%d-%d,%s,%s\n" % (cluster, trfType, name, start, end, seq[start - 1:end], seq))
+                fmerge.write("tRF-%s-%s-%s-%d,%s\n" % (aa, anticodon, names[0].split("-")[-2], number, "/".join(clusters)))
+
+    for key, name in index_names.items():
+        fastaFile = index/(name + ".fa")
+        write_fasta(fastaFile, lib.refs[key].items(), width=60)
+        if build:
+            subprocess.run([shutil.which("bowtie-build"), "-q", str(fastaFile), str(index/name)], check=True)
+
+
+def place(ref, offset, query):
+    """
+    THE ALIGNMENT OF query PUT AT offset OF ref (offset MAY BE NEGATIVE, AND THE QUERY MAY RUN PAST THE END OF ref):
+    (1-BASED POSITION, MISMATCHES, BASES THAT MUST BE TRIMMED FROM THE 5' AND 3' ENDS OF THE QUERY TO FIT IN ref, bowtie MISMATCH
+    DESCRIPTORS "READ OFFSET:REFERENCE BASE>READ BASE"), OR None IF THE QUERY DOES NOT OVERLAP ref
+    """
+    trim5 = max(0, -offset)
+    trim3 = max(0, offset + len(query) - len(ref))
+    if trim5 + trim3 >= len(query):
+        return None
+    mismatches = ["%d:%s>%s" % (i, ref[offset + i], query[i]) for i in range(trim5, len(query) - trim3) if ref[offset + i] != query[i]]
+    return offset + trim5 + 1, len(mismatches), trim5, trim3, ",".join(mismatches)
+
+
+class Truth:
+    """
+    THE PLACEMENTS OF THE DISTINCT INSERTS ON THE REFERENCES OF EACH INDEX, COLLECTED WHILE THE READS ARE SIMULATED
+    """
+    def __init__(self, lib):
+        self.lib = lib
+        self.hits = {key: defaultdict(set) for key in index_names}
+        self.seen = set()
+
+    def add(self, key, query, name, offset, strand="+"):
+        ref = self.lib.refs[key][name]
+        if strand == "+":
+            hit = place(ref, offset, query)
+        else: # THE READ ALIGNS TO THE FORWARD STRAND AS ITS REVERSE COMPLEMENT: ITS 5' END IS THE RIGHT END, AND THE MISMATCHES ARE
+              # DESCRIBED FROM THE 5' END OF THE READ, ON ITS STRAND
+            hit = place(ref, offset, revcomp(query))
+            if hit is not None:
+                details = []
+                for detail in filter(None, hit[4].split(",")):
+                    position, change = detail.split(":")
+                    details.append("%d:%s" % (len(query) - 1 - int(position), change.translate(complement)))
+                hit = (hit[0], hit[1], hit[3], hit[2], ",".join(reversed(details)))
+        if hit is not None and hit[1] <= max_mismatches:
+            self.hits[key][query].add((name, strand) + hit)
+
+    def register(self, query, category, source, offset):
+        """
+        PLACES A NEW INSERT ON EVERY INDEX THAT HOLDS ITS SOURCE: source IS A HAIRPIN, A NOVEL HAIRPIN, A tRNA COPY, A PRE-tRNA OR AN
+        OTHER RNA, AND offset THE 0-BASED POSITION OF THE UNMODIFIED INSERT IN IT
+        """
+        if query in self.seen or category == "unmapped":
+            return
+        self.seen.add(query)
+        lib = self.lib
+        if category in ("mirna", "isomir", "novel"):
+            if category != "novel":
+                self.add("hairpin", query, source, offset)
+                for mature, start in lib.matures[source]:
+                    if abs(offset - start) <= 4:
+                        for name in lib.copies["mirna"][mature]:
+                            self.add("mirna", query, name, offset - start)
+            chrom, start, strand = lib.loci[source]
+            length = len(lib.refs["hairpin"].get(source) or lib.novel[source])
+            self.add("genome", query, chrom, start + offset if strand == "+" else start + length - offset - len(query), strand)
+        elif category == "trf":
+            for name in lib.copies["mature_trna"][source]:
+                self.add("mature_trna", query, name, offset)
+            footer = re.sub("T{3,}$", "", query) # bwtAlign() ALIGNS THE READS ENDING WITH TTT TO THE PRE-tRNAs WITHOUT THEIR T STRETCH
+            if footer != query:
+                for name in lib.copies["mature_trna"][source]:
+                    preName, leader = lib.pre[name]
+                    self.add("pre_trna", footer, preName, leader + offset)
+        elif category == "pretrna":
+            footer = re.sub("T{3,}$", "", query)
+            if footer != query:
+                self.add("pre_trna", footer, source, offset)
+        else:
+            self.add(category, query, source, offset)
+
+    def write(self, truthDir):
+        truthDir.mkdir(parents=True, exist_ok=True)
+        for key, hits in self.hits.items():
+            with open(truthDir/(index_names[key] + ".tsv"), "w") as fout:
+                for query in sorted(hits):
+                    for hit in sorted(hits[query]):
+                        fout.write(query + "\t" + "\t".join(str(field) for field in hit) + "\n")
+
+
+def expression(nprng, count, zipf, noise):
+    """
+    RELATIVE EXPRESSION OF count REFERENCES IN ONE SAMPLE: A ZIPF PROFILE OVER A FIXED RANKING, TIMES A LOG-NORMAL SAMPLE EFFECT
+    """
+    weights = 1.0 / np.arange(1, count + 1) ** zipf * nprng.lognormal(0.0, noise, size=count)
+    return weights / weights.sum()
+
+
+def make_insert(rng, lib, category, source, sources):
+    """
+    ONE INSERT OF THE category FROM ITS source: (INSERT, source, 0-BASED OFFSET OF THE UNMODIFIED INSERT IN THE SOURCE)
+    """
+    if category in ("mirna", "isomir", "novel"):
+        seq = lib.novel[source] if category == "novel" else lib.refs["hairpin"][source]
+        start = flank if category == "novel" or rng.random() < 0.7 else flank + arm + loop
+        if category == "mirna":
+            return seq[start:start + arm], start
+        offset = start + rng.choice((-1, 0, 0, 0, 1))
+        insert = seq[offset:start + arm + rng.choice((-3, -2, -1, 0, 0, 1, 2))]
+        if category == "isomir" and rng.random() < 0.2: # NON-TEMPLATED 3' A OR U
+            insert = insert[:-1] + rng.choice("AT")
+        if source in lib.edited and rng.random() < 0.3: # A-TO-I EDITING IN THE SEED
+            seeds = [pos for pos in range(1, 8) if insert[pos] == "A"]
+            if seeds:
+                pos = rng.choice(seeds)
+                insert = insert[:pos] + "G" + insert[pos + 1:]
+        return insert, offset
+    if category == "trf":
+        trfType, start, end = rng.choice(trf_clusters)
+        start = min(max(1, start + rng.randint(-1, 1)), end - 16)
+        end = min(trna_body + 3, end + rng.randint(-1, 1))
+        return lib.refs["mature_trna"][source][start - 1:end], start - 1
+    if category == "pretrna": # tRF-1: THE 3' TRAILER AND ITS T STRETCH
+        seq = lib.refs["pre_trna"][source]
+        offset = lib.pre[source[len("pre_"):]][1] + trna_body
+        return seq[offset:], offset
+    if category == "unmapped":
+        return random_seq(rng, rng.randint(18, 30)), 0
+    seq = lib.refs[category][source]
+    length = rng.randint(18, 32)
+    offset = rng.randint(0, len(seq) - length)
+    return seq[offset:offset + length], offset
+
+
+def mutate(rng, seq, rate):
+    """
+    SUBSTITUTES EACH BASE WITH PROBABILITY rate
+    """
+    if rate <= 0:
+        return seq
+    positions = [pos for pos in range(len(seq)) if rng.random() < rate]
+    if not positions:
+        return seq
+    seq = list(seq)
+    for pos in positions:
+        seq[pos] = rng.choice([base for base in "ACGT" if base != seq[pos]])
+    return "".join(seq)
+
+
+def simulate_sample(params, lib, truth, sample, outDir):
+    rng = random.Random(params.seed * 1000 + sample + 1)
+    nprng = np.random.default_rng(params.seed * 1000 + sample + 1)
+    mix = parse_mix(params.mix)
+    sources = {
+        "mirna": list(lib.refs["hairpin"]), "isomir": list(lib.refs["hairpin"]), "novel": list(lib.novel),
+        "trf": [names[0] for aa, anticodon, names in lib.trnas], "pretrna": list(lib.refs["pre_trna"]), "unmapped": [None],
+    }
+    for key in other_classes:
+        sources[key] = list(lib.refs[key])
+    chosen = {category: [] for category in categories}
+    readCategories = nprng.choice(len(categories), size=params.reads, p=[mix[category] for category in categories])
+    for c, category in enumerate(categories):
+        needed = int((readCategories == c).sum())
+        if needed and sources[category]:
+            weights = expression(nprng, len(sources[category]), params.zipf, params.sample_noise)
+            chosen[category] = iter(nprng.choice(len(sources[category]), size=needed, p=weights).tolist())
+    front, back = [int(value) for value in params.umi.split(",")] if params.umi else (0, 0)
+    name = "sample%d" % (sample + 1)
+    with gzip.open(outDir/(name + ".fastq.gz"), "wt", compresslevel=3) as fq, gzip.open(outDir/(name + ".inserts.txt.gz"), "wt", compresslevel=3) as fins:
+        for r, c in enumerate(readCategories.tolist()):
+            category = categories[c]
+            source = sources[category][next(chosen[category])] if sources[category] else None
+            if source is None and category != "unmapped":
+                category, source = "unmapped", None
+            insert, offset = make_insert(rng, lib, category, source, sources)
+            insert = mutate(rng, insert, params.error_rate)
+            truth.register(insert, category, source, offset)
+            trimmed = random_seq(rng, front) + insert + random_seq(rng, back)
+            read = trimmed + mutate(rng, params.adapter, params.error_rate)
+            read = (read + random_seq(rng, max(0, params.read_length - len(read))))[:params.read_length]
+            quality = "I" * len(read)
+            if rng.random() < low_quality_fraction:
+                quality = quality[:-5] + "#####"
+            fq.write("@%s.%d\n%s\n+\n%s\n" % (name, r + 1, read, quality))
+            fins.write(trimmed + "\n")
+    return name
+
+
+def write_aligner_wrappers(outDir):
+    """
+    bin/bowtie AND bin/bowtie-inspect: SHELL WRAPPERS OF truth_aligner.py FOR -pbwt
+    """
+    binDir = outDir/"bin"
+    binDir.mkdir(parents=True, exist_ok=True)
+    aligner = Path(__file__).resolve().parent/"truth_aligner.py"
+    for tool in ("bowtie", "bowtie-inspect"):
+        wrapper = binDir/tool
+        wrapper.write_text("#!/bin/sh\nexec '%s' '%s' %s '%s' \"$@\"\n" % (sys.executable, aligner, tool, (outDir/"truth").resolve()))
+        wrapper.chmod(0o755)
+
+
+def generate(params):
+    """
+    WRITES THE DATASET OF params (AN argparse.Namespace OF THE OPTIONS OF THIS SCRIPT) TO params.outdir
+    """
+    outDir = Path(params.outdir)
+    outDir.mkdir(parents=True, exist_ok=True)
+    lib = build_library(params)
+    build = params.build_index and shutil.which("bowtie-build") is not None
+    write_library(lib, outDir/"libs", build)
+    truth = Truth(lib)
+    samples = [simulate_sample(params, lib, truth, sample, outDir) for sample in range(params.samples)]
+    truth.write(outDir/"truth")
+    write_aligner_wrappers(outDir)
+    description = {name: value for name, value in vars(params).items() if name != "outdir"}
+    description.update(sample_names=samples, organism=organism, ref_db=ref_db, bowtie_indexes=build, distinct_inserts=len(truth.seen))
+    (outDir/"dataset.json").write_text(json.dumps(description, indent=2) + "\n")
+    return description
+
+
+def parser():
+    parser = argparse.ArgumentParser(description="synthetic small RNA dataset and miniature library for the miRge3.0 benchmarks")
+    parser.add_argument("outdir")
+    parser.add_argument("--samples", type=int, default=2)
+    parser.add_argument("--reads", type=int, default=200000, help="reads per sample (depth)")
+    parser.add_argument("--mirnas", type=int, default=300, help="miRNA genes in the library")
+    parser.add_argument("--novel", type=int, default=10, help="miRNA genes in the genome only")
+    parser.add_argument("--trnas", type=int, default=60)
+    parser.add_argument("--other-rnas", type=int, default=40, help="snoRNAs, rRNAs, other ncRNAs and mRNAs, each")
+    parser.add_argument("--mix", default=default_mix, help="fraction of the reads of each category (Default: %(default)s)")
+    parser.add_argument("--zipf", type=float, default=1.1, help="exponent of the expression profile: the higher, the fewer distinct reads")
+    parser.add_argument("--sample-noise", type=float, default=0.5, help="sigma of the log-normal expression change between samples")
+    parser.add_argument("--error-rate", type=float, default=0.001, help="sequencing error rate per base")
+    parser.add_argument("--umi", default=None, help="random bases before and after the insert, e.g. 4,4 (run miRge with the same -umi)")
+    parser.add_argument("--adapter", default=truseq)
+    parser.add_argument("--read-length", type=int, default=75)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-build-index", dest="build_index", action="store_false", help="do not run bowtie-build even if it is installed")
+    return parser
+
+
+if __name__ == "__main__":
+    print(json.dumps(generate(parser().parse_args()), indent=2))
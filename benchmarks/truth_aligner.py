@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+A STAND-IN FOR bowtie AND bowtie-inspect ON THE SYNTHETIC DATASETS OF synthetic.py, FOR MACHINES WITHOUT bowtie: THE ALIGNMENTS ARE READ
+FROM THE TRUTH TABLES (truth/<index>.tsv) WRITTEN BY THE GENERATOR INSTEAD OF BEING SEARCHED FOR, AND FILTERED WITH THE OPTIONS OF THE
+CALL (-v/-n MISMATCHES, -5/-3 TRIMMING, --norc, -a, --best --strata, -m), THEN WRITTEN IN THE SAM (-S) OR NATIVE FORMAT OF bowtie 1.
+IT ONLY KNOWS THE PLACEMENTS THE GENERATOR MADE, SO IT TIMES THE PARSING AND ANNOTATION CODE OF miRge WITHOUT THE COST OF THE ALIGNMENT.
+THE bin/bowtie AND bin/bowtie-inspect WRAPPERS OF A DATASET CALL IT AS
+
+    truth_aligner.py bowtie TRUTHDIR [--version | bowtie options] INDEX READS.fa|- [HITS]
+    truth_aligner.py bowtie-inspect TRUTHDIR [-n | -e [-a WIDTH]] INDEX
+"""
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+version = "1.3.0"
+# bowtie OPTIONS THAT TAKE A VALUE; THE OTHERS ARE FLAGS
+value_options = {"-n", "-v", "-5", "-3", "-p", "--threads", "-m", "-k", "-l", "-e", "-L", "-I", "-X", "--seed"}
+
+
+def parse_options(argv):
+    """
+    argv -> (OPTIONS {OPTION: VALUE OR True}, POSITIONAL ARGUMENTS)
+    """
+    options, positional = {}, []
+    words = iter(argv)
+    for word in words:
+        if word in value_options:
+            options[word] = next(words)
+        elif word.startswith("-") and len(word) > 1:
+            options[word] = True
+        else:
+            positional.append(word)
+    return options, positional
+
+
+def read_truth(truthDir, index):
+    """
+    THE TRUTH TABLE OF AN INDEX: QUERY -> [(REFERENCE, STRAND, 1-BASED POSITION, MISMATCHES, TRIM5, TRIM3, DESCRIPTORS)]
+    """
+    truth = defaultdict(list)
+    path = Path(truthDir)/(Path(index).name + ".tsv")
+    if path.exists():
+        with open(path) as fin:
+            for line in fin:
+                query, ref, strand, pos, mm, trim5, trim3, detail = line.rstrip("\n").split("\t")
+                truth[query].append((ref, strand, int(pos), int(mm), int(trim5), int(trim3), detail))
+    return truth
+
+
+def read_fasta(path):
+    """
+    YIELDS (NAME, SEQUENCE) OF A FASTA FILE, OR OF THE STANDARD INPUT FOR "-"
+    """
+    name, seq = None, []
+    with (open(sys.stdin.fileno(), closefd=False) if path == "-" else open(path)) as fin:
+        for line in fin:
+            line = line.rstrip("\n")
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(seq)
+                name, seq = line[1:].split()[0] if len(line) > 1 else "", []
+            elif line:
+                seq.append(line)
+    if name is not None:
+        yield name, "".join(seq)
+
+
+def alignments(query, hits, options):
+    """
+    THE HITS OF query THAT bowtie WOULD REPORT WITH options: [(REFERENCE, STRAND, 1-BASED POSITION, MISMATCHES, ALIGNED BASES, DESCRIPTORS)]
+    """
+    allowed = int(options.get("-v", options.get("-n", 2)))
+    trim5, trim3 = int(options.get("-5", 0)), int(options.get("-3", 0))
+    length = len(query) - trim5 - trim3
+    found = []
+    for ref, strand, pos, mm, t5, t3, detail in hits:
+        if strand == "-" and "--norc" in options or t5 > trim5 or t3 > trim3 or length <= 0:
+            continue
+        # THE MISMATCHES IN THE BASES TRIMMED BY -5/-3 DO NOT COUNT
+        details = [d for d in filter(None, detail.split(",")) if trim5 <= int(d.split(":")[0]) < len(query) - trim3]
+        if len(details) > allowed:
+            continue
+        # THE LEFTMOST ALIGNED BASE MOVES BY THE EXTRA BASES TRIMMED FROM THE END OF THE READ ON THE LEFT
+        pos += (trim5 - t5) if strand == "+" else (trim3 - t3)
+        aligned = query[trim5:len(query) - trim3]
+        found.append((ref, strand, pos, len(details), aligned, ",".join("%d:%s" % (int(d.split(":")[0]) - trim5, d.split(":")[1]) for d in details)))
+    found.sort(key=lambda hit: (hit[3], hit[0], hit[2], hit[1]))
+    if "--best" in options and "--strata" in options and found:
+        found = [hit for hit in found if hit[3] == found[0][3]]
+    if "-m" in options and len(found) > int(options["-m"]):
+        return []
+    if "-a" not in options:
+        found = found[:int(options.get("-k", 1))]
+    return found
+
+
+def revcomp(seq):
+    return seq.translate(str.maketrans("ACGTN", "TGCAN"))[::-1]
+
+
+def bowtie(truthDir, argv):
+    if "--version" in argv:
+        print("bowtie-align-s version %s (truth_aligner.py, synthetic datasets only)" % version)
+        return 0
+    options, positional = parse_options(argv)
+    index, reads = positional[:2]
+    fout = open(positional[2], "w") if len(positional) > 2 else sys.stdout
+    truth = read_truth(truthDir, index)
+    sam = "-S" in options or "--sam" in options
+    if sam:
+        fout.write("@HD\tVN:1.0\tSO:unsorted\n")
+        fastaFile = Path(str(index) + ".fa")
+        if fastaFile.exists():
+            for name, seq in read_fasta(fastaFile):
+                fout.write("@SQ\tSN:%s\tLN:%d\n" % (name, len(seq)))
+        fout.write("@PG\tID:Bowtie\tVN:%s\tCL:\"%s\"\n" % (version, " ".join(["bowtie"] + argv)))
+    processed = aligned = 0
+    for name, query in read_fasta(reads):
+        processed += 1
+        hits = alignments(query, truth.get(query, ()), options)
+        aligned += bool(hits)
+        for ref, strand, pos, mm, seq, detail in hits:
+            seq = seq if strand == "+" else revcomp(seq)
+            if sam:
+                fout.write("%s\t%d\t%s\t%d\t255\t%dM\t*\t0\t0\t%s\t%s\tXA:i:%d\tMD:Z:%d\tNM:i:%d\n" % (name, 0 if strand == "+" else 16, ref, pos, len(seq), seq, "I" * len(seq), mm, len(seq), mm))
+            else:
+                fout.write("%s\t%s\t%s\t%d\t%s\t%s\t0\t%s\n" % (name, strand, ref, pos - 1, seq, "I" * len(seq), detail))
+        if not hits and sam:
+            fout.write("%s\t4\t*\t0\t0\t*\t*\t0\t0\t%s\t%s\tXM:i:0\n" % (name, query, "I" * len(query)))
+    if fout is not sys.stdout:
+        fout.close()
+    sys.stderr.write("# reads processed: %d\n# reads with at least one reported alignment: %d\n# reads that failed to align: %d\n" % (processed, aligned, processed - aligned))
+    return 0
+
+
+def bowtie_inspect(argv):
+    width = int(argv[argv.index("-a") + 1]) if "-a" in argv else 60 # -a: LINE WIDTH OF -e
+    for name, seq in read_fasta(argv[-1] + ".fa"):
+        if "-n" in argv:
+            print(name)
+        else:
+            print(">" + name)
+            for start in range(0, len(seq), width):
+                print(seq[start:start + width])
+    return 0
+
+
+if __name__ == "__main__":
+    tool, truthDir = sys.argv[1:3]
+    sys.exit(bowtie(truthDir, sys.argv[3:]) if tool == "bowtie" else bowtie_inspect(sys.argv[3:]))
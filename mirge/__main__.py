@@ -14,9 +14,12 @@ import cutadapt
 
 #Custom miRge libraries 
 from mirge.libs.parse import parseArg
-from mirge.libs.miRgeEssential import check_dependencies, validate_files
+from mirge.libs.miRgeEssential import check_dependencies, validate_files, sample_sheet
 from mirge.libs.digest import baking 
+from mirge.libs.sniff import sniff_inputs
 from mirge.libs.summary import summarize
+from mirge.libs.countMatrix import to_csv_blocks
+from mirge.libs import kernels, metrics, profiling
 from mirge.libs.manifoldAlign import bwtAlign
 from mirge.libs.novel_mir import predict_nmir
 from mirge.classes.exportHTML import FormatHTML
@@ -24,6 +27,7 @@ from mirge.classes.exportHTML import FormatHTML
 def main():
     globalstart = time.perf_counter()     
     args = parseArg()
+    kernels.enable(args.numba_pll)
     samples = args.samples
     if args.outDirName:
         ourDir_n = str(args.outDirName)
@@ -39,6 +43,8 @@ def main():
     outlog.write(" ".join(sys.argv))
     outlog.write("\n")
     outlog.close()
+    metrics.start(Path(workDir)/"run.metrics.jsonl", args)
+    profiling.start(args, workDir)
     check_dependencies(args, str(runlogFile))
     outlog = open(str(runlogFile),"a+")
     if args.tRNA_frag and args.organism_name != "human":
@@ -83,7 +89,7 @@ def main():
         fastq_fullPath,base_names = validate_files(args, file_list, str(runlogFile))
     elif Path(file_list[0]).exists() and Path(file_list[0]).suffix in file_exts: # READ TXT OR CSV FILE HERE
         with open(file_list[0]) as file:
-            lines = [line.strip() for line in file]
+            lines = sample_sheet([line.strip() for line in file])
             fastq_fullPath, base_names = validate_files(args, lines, str(runlogFile))
     else:  # READ FASTQ OR FASTQ.gz FILES HERE
         fastq_fullPath, base_names = validate_files(args, file_list, str(runlogFile))
@@ -91,8 +97,15 @@ def main():
         print(f"\nmiRge3.0 will process {len(fastq_fullPath)} out of {len(file_list)} input file(s).\n")
     outlog.write(f"\nmiRge3.0 will process {len(fastq_fullPath)} out of {len(file_list)} input file(s).\n\n")
     outlog.close()
-    pdDataFrame,sampleReadCounts,trimmedReadCounts,trimmedReadCountsUnique = baking(args, fastq_fullPath, base_names, workDir)
-    pdDataFrame = bwtAlign(args,pdDataFrame,workDir,ref_db)
+    if args.sniff != "off":
+        with metrics.stage("input_check"):
+            sniff_inputs(args, fastq_fullPath, base_names, str(runlogFile))
+    with metrics.stage("trimming") as stageInfo, profiling.stage("baking"):
+        pdDataFrame,sampleReadCounts,trimmedReadCounts,trimmedReadCountsUnique,laneReadCounts = baking(args, fastq_fullPath, base_names, workDir)
+        stageInfo.update(reads=sum(sampleReadCounts.values()), unique_out=len(pdDataFrame))
+    with metrics.stage("alignment", unique_in=len(pdDataFrame)) as stageInfo, profiling.stage("bwtAlign"):
+        pdDataFrame = bwtAlign(args,pdDataFrame,workDir,ref_db)
+        stageInfo.update(unique_out=int(pdDataFrame.annotFlag.sum()))
     outlog = open(str(runlogFile),"a+")
     if not args.quiet:
         print(f"Summarizing and tabulating results...")
@@ -101,14 +114,16 @@ def main():
     summary_Start_time = time.perf_counter()
     pdMapped = pdDataFrame[pdDataFrame.annotFlag.eq(1)]
     pdUnmapped = pdDataFrame[pdDataFrame.annotFlag.eq(0)]
-    summarize(args, workDir, ref_db, base_names, pdMapped, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique)
+    with metrics.stage("summary", unique_in=len(pdMapped)):
+        with profiling.stage("summarize"):
+            summarize(args, workDir, ref_db, base_names, pdMapped, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique, laneReadCounts)
 
-    #fileToCSV = Path(workDir)/"miRge3_collapsed.csv"
-    mappedfileToCSV = Path(workDir)/"mapped.csv"
-    unmappedfileToCSV = Path(workDir)/"unmapped.csv"
-    #pdDataFrame.to_csv(fileToCSV)
-    pdMapped.to_csv(mappedfileToCSV)
-    pdUnmapped.to_csv(unmappedfileToCSV)
+        #fileToCSV = Path(workDir)/"miRge3_collapsed.csv"
+        mappedfileToCSV = Path(workDir)/"mapped.csv"
+        unmappedfileToCSV = Path(workDir)/"unmapped.csv"
+        #pdDataFrame.to_csv(fileToCSV)
+        to_csv_blocks(pdMapped, mappedfileToCSV)
+        to_csv_blocks(pdUnmapped, unmappedfileToCSV)
     summary_End_time = time.perf_counter()
     """
     Enabling Visualization HTML format
@@ -138,7 +153,8 @@ def main():
             print("Predicting novel miRNAs\n")
         outlog.write("Predicting novel miRNAs\n")
         outlog.close()
-        predict_nmir(args, workDir, ref_db, base_names, pdUnmapped)
+        with metrics.stage("novel_mirna", unique_in=len(pdUnmapped)), profiling.stage("predict_nmir"):
+            predict_nmir(args, workDir, ref_db, base_names, pdUnmapped)
         outlog = open(str(runlogFile),"a+")
     else:
         html.novelTab(0)
@@ -158,6 +174,7 @@ def main():
         print(f'\nThe analysis completed in {round(globalend_time-globalstart, 4)} second(s)\n')     
     outlog.write(f"\nThe analysis completed in {round(globalend_time-globalstart, 4)} second(s)\n")
     outlog.close()
+    metrics.finish()
 
 
 
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+import os
+import heapq
+import shutil
+import tempfile
+import numpy as np
+from scipy import sparse
+
+"""
+COMPACT STORE OF COLLAPSED READS (UNIQUE SEQUENCE -> READ COUNT)
+READS UP TO 32 nt MADE OF A, C, G AND T ONLY ARE PACKED INTO ONE 64 BIT INTEGER (2 BITS PER BASE) AND KEPT, PER READ LENGTH,
+AS SORTED NUMPY ARRAYS OF CODES AND COUNTS. THIS COSTS 16 BYTES PER UNIQUE SEQUENCE INSTEAD OF ~100 BYTES FOR A str KEY IN A dict.
+LONGER READS AND READS WITH N (OR ANY OTHER CHARACTER) GO TO A REGULAR dict, THE OVERFLOW.
+WITH A memory_budget THE STORE SPILLS ITS CONTENT AS SORTED RUNS TO A SCRATCH DIRECTORY WHENEVER IT GROWS PAST THE BUDGET, AND 
+compact() PRODUCES THE FINAL COUNTS BY A k-WAY MERGE OF THE RUNS, READ BLOCK BY BLOCK FROM MEMORY MAPPED FILES.
+"""
+
+base2bit = np.full(256, 255, dtype=np.uint8)
+for code, base in enumerate(b"ACGT"):
+    base2bit[base] = code
+bit2base = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+def encode(seqs, length):
+    """
+    PACKS A LIST OF SEQUENCES, ALL OF THE SAME length (<= 32), INTO uint64 CODES.
+    RETURNS THE CODES AND A BOOLEAN MASK OF THE SEQUENCES THAT COULD BE PACKED (ONLY A, C, G AND T)
+    """
+    bases = base2bit[np.frombuffer("".join(seqs).encode(), dtype=np.uint8)].reshape(len(seqs), length)
+    packable = (bases != 255).all(axis=1)
+    codes = np.zeros(len(seqs), dtype=np.uint64)
+    for col in range(length):
+        codes = (codes << np.uint64(2)) | bases[:, col].astype(np.uint64)
+    return codes, packable
+
+
+def decode(codes, length):
+    """
+    UNPACKS uint64 CODES OF SEQUENCES OF THE GIVEN length BACK TO A LIST OF str
+    """
+    if length == 0 or len(codes) == 0:
+        return [""] * len(codes)
+    shifts = np.arange(length - 1, -1, -1, dtype=np.uint64) * np.uint64(2)
+    digits = ((codes[:, None] >> shifts) & np.uint64(3)).astype(np.uint8)
+    return bit2base[digits].view("S%d" % length).ravel().astype(str).tolist()
+
+
+def collapse(codes, counts):
+    """
+    SUMS THE counts OF IDENTICAL codes; RETURNS SORTED UNIQUE CODES AND THEIR TOTAL COUNTS
+    """
+    if len(codes) == 0:
+        return codes, counts
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    counts = counts[order]
+    starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+    return codes[starts], np.add.reduceat(counts, starts)
+
+
+def merge_sorted_runs(runs, block=1 << 20):
+    """
+    k-WAY MERGE OF SORTED RUNS OF UNIQUE (codes, counts) ARRAYS (numpy OR MEMORY MAPPED) INTO ONE SORTED ARRAY OF UNIQUE CODES AND 
+    THEIR SUMMED COUNTS. EACH ROUND TAKES UP TO block ENTRIES FROM EVERY RUN, UP TO THE SMALLEST OF THEIR LAST CODES, SO ONLY ONE BLOCK 
+    PER RUN IS EVER READ FROM DISK AT A TIME AND THE OUTPUT IS WRITTEN STRAIGHT INTO ITS FINAL ARRAYS.
+    """
+    runs = [(codes, counts) for codes, counts in runs if len(codes)]
+    total = sum(len(codes) for codes, counts in runs)
+    outCodes = np.empty(total, dtype=np.uint64)
+    outCounts = np.empty(total, dtype=np.int64)
+    filled = 0
+    starts = [0] * len(runs)
+    while True:
+        live = [idx for idx, (codes, counts) in enumerate(runs) if starts[idx] < len(codes)]
+        if not live:
+            break
+        threshold = min(runs[idx][0][min(starts[idx] + block, len(runs[idx][0])) - 1] for idx in live)
+        codeParts = []
+        countParts = []
+        for idx in live:
+            codes, counts = runs[idx]
+            stop = starts[idx] + int(np.searchsorted(codes[starts[idx]:starts[idx] + block], threshold, side="right"))
+            codeParts.append(np.asarray(codes[starts[idx]:stop]))
+            countParts.append(np.asarray(counts[starts[idx]:stop]))
+            starts[idx] = stop
+        codes, counts = collapse(np.concatenate(codeParts), np.concatenate(countParts))
+        outCodes[filled:filled + len(codes)] = codes
+        outCounts[filled:filled + len(codes)] = counts
+        filled += len(codes)
+    outCodes.resize(filled, refcheck=False)
+    outCounts.resize(filled, refcheck=False)
+    return outCodes, outCounts
+
+
+class CollapsedStore:
+    max_packed = 32 # 2 BITS PER BASE IN A 64 BIT KEY; THE LENGTH IS IMPLIED BY THE ARRAY THE KEY IS STORED IN
+    compact_every = 4000000 # PENDING (NOT YET COLLAPSED) ENTRIES ALLOWED BEFORE THEY ARE MERGED INTO THE SORTED ARRAYS
+    overflow_entry_bytes = 120 # APPROXIMATE MEMORY OF ONE dict ENTRY OF THE OVERFLOW, ON TOP OF THE SEQUENCE ITSELF
+
+    def __init__(self, memory_budget=None, scratch_dir=None):
+        self.packed = {} # length -> (sorted unique uint64 codes, int64 counts)
+        self.pending = {} # length -> list of (codes, counts) added since the last compaction
+        self.pending_size = 0
+        self.overflow = {} # sequence -> count, for everything that cannot be packed
+        self.overflow_bytes = 0
+        self.memory_budget = memory_budget # BYTES OF MEMORY BEFORE SPILLING TO scratch_dir; None KEEPS EVERYTHING IN MEMORY
+        self.scratch_dir = scratch_dir
+        self.spill_dir = None # CREATED INSIDE scratch_dir AT THE FIRST SPILL
+        self.runs = [] # ONE dict PER SPILL: length -> (codes .npy, counts .npy), AND 'overflow' -> SORTED TEXT FILE
+        if memory_budget:
+            self.compact_every = max(min(self.compact_every, memory_budget // 64), 1024) # A COMPACTION NEEDS ~40 BYTES PER ENTRY
+
+    def add(self, seqs, counts=None):
+        """
+        ADDS A BATCH OF SEQUENCES WITH THEIR COUNTS (ONE READ EACH IF counts IS NOT GIVEN)
+        """
+        counts = np.ones(len(seqs), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        byLength = {}
+        for idx, seq in enumerate(seqs):
+            seqLen = len(seq)
+            if seqLen <= self.max_packed:
+                try:
+                    byLength[seqLen].append(idx)
+                except KeyError:
+                    byLength[seqLen] = [idx]
+            else:
+                self.add_overflow(seq, int(counts[idx]))
+        for seqLen, idxs in byLength.items():
+            idxs = np.asarray(idxs)
+            codes, packable = encode([seqs[i] for i in idxs], seqLen)
+            if not packable.all():
+                for i in idxs[~packable]:
+                    self.add_overflow(seqs[i], int(counts[i]))
+            self.add_packed(seqLen, codes[packable], counts[idxs[packable]])
+        self.check_budget()
+
+    def add_overflow(self, seq, count):
+        """
+        ADDS count READS OF A SEQUENCE THAT CANNOT BE PACKED
+        """
+        if seq in self.overflow:
+            self.overflow[seq] += count
+        else:
+            self.overflow[seq] = count
+            self.overflow_bytes += len(seq) + self.overflow_entry_bytes
+
+    def add_packed(self, length, codes, counts):
+        """
+        ADDS ALREADY PACKED codes OF THE GIVEN length
+        """
+        if len(codes) == 0:
+            return
+        try:
+            self.pending[length].append((codes, counts))
+        except KeyError:
+            self.pending[length] = [(codes, counts)]
+        self.pending_size += len(codes)
+        if self.pending_size >= self.compact_every:
+            self.collapse_pending()
+
+    def update(self, mapping):
+        """
+        ADDS A dict (OR ANY MAPPING) OF sequence -> count
+        """
+        self.add(list(mapping.keys()), np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping)))
+
+    def merge(self, other):
+        """
+        ADDS ALL THE COUNTS OF ANOTHER CollapsedStore TO THIS ONE
+        """
+        if other.runs:
+            other.compact()
+        for length, (codes, counts) in other.packed.items():
+            self.add_packed(length, codes, counts)
+        for length, parts in other.pending.items():
+            for codes, counts in parts:
+                self.add_packed(length, codes, counts)
+        for seq, count in other.overflow.items():
+            self.add_overflow(seq, count)
+        self.check_budget()
+
+    def collapse_pending(self):
+        """
+        COLLAPSES THE PENDING ENTRIES INTO THE SORTED ARRAYS OF UNIQUE CODES (IN MEMORY ONLY)
+        """
+        for length, parts in self.pending.items():
+            if length in self.packed:
+                parts = [self.packed[length]] + parts
+            codes = np.concatenate([part[0] for part in parts])
+            counts = np.concatenate([part[1] for part in parts])
+            self.packed[length] = collapse(codes, counts)
+        self.pending = {}
+        self.pending_size = 0
+
+    def compact(self):
+        """
+        COLLAPSES THE PENDING ENTRIES INTO THE SORTED ARRAYS OF UNIQUE CODES; IF THE STORE HAS SPILLED, THE RUNS ON DISK ARE MERGED 
+        BACK WITH WHAT IS IN MEMORY AND REMOVED
+        """
+        self.collapse_pending()
+        if self.runs:
+            self.merge_runs()
+
+    def nbytes(self):
+        """
+        APPROXIMATE MEMORY USED BY THE COUNTS HELD IN MEMORY
+        """
+        return sum(codes.nbytes + counts.nbytes for codes, counts in self.packed.values()) + 16 * self.pending_size + self.overflow_bytes
+
+    def check_budget(self):
+        """
+        SPILLS THE STORE TO DISK WHEN IT HAS GROWN PAST ITS memory_budget
+        """
+        if self.memory_budget and self.nbytes() > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """
+        WRITES THE IN-MEMORY COUNTS AS ONE SORTED RUN (A .npy PAIR PER READ LENGTH AND A SORTED TEXT FILE OF THE OVERFLOW) AND EMPTIES THE STORE
+        """
+        self.collapse_pending()
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="miRge3_collapse.", dir=self.scratch_dir)
+        runId = len(self.runs)
+        run = {}
+        for length, (codes, counts) in self.packed.items():
+            codesFile = os.path.join(self.spill_dir, "run%d.len%d.codes.npy" % (runId, length))
+            countsFile = os.path.join(self.spill_dir, "run%d.len%d.counts.npy" % (runId, length))
+            np.save(codesFile, codes)
+            np.save(countsFile, counts)
+            run[length] = (codesFile, countsFile)
+        if self.overflow:
+            run['overflow'] = os.path.join(self.spill_dir, "run%d.overflow.txt" % runId)
+            with open(run['overflow'], 'w') as fout:
+                for seq in sorted(self.overflow):
+                    fout.write("%s\t%d\n" % (seq, self.overflow[seq]))
+        self.runs.append(run)
+        self.packed = {}
+        self.overflow = {}
+        self.overflow_bytes = 0
+
+    def merge_runs(self):
+        """
+        k-WAY MERGE OF ALL THE SPILLED RUNS AND THE IN-MEMORY COUNTS INTO THE FINAL SORTED ARRAYS AND OVERFLOW dict
+        """
+        lengths = set(self.packed)
+        for run in self.runs:
+            lengths.update(key for key in run if key != 'overflow')
+        for length in sorted(lengths):
+            parts = [(np.load(run[length][0], mmap_mode="r"), np.load(run[length][1], mmap_mode="r")) for run in self.runs if length in run]
+            if length in self.packed:
+                parts.append(self.packed[length])
+            self.packed[length] = merge_sorted_runs(parts)
+        overflowFiles = [open(run['overflow']) for run in self.runs if 'overflow' in run]
+        inMemory = ["%s\t%d\n" % (seq, self.overflow[seq]) for seq in sorted(self.overflow)]
+        self.overflow = {}
+        self.overflow_bytes = 0
+        for line in heapq.merge(inMemory, *overflowFiles, key=lambda line: line.split("\t", 1)[0]):
+            seq, count = line.rstrip("\n").split("\t")
+            self.add_overflow(seq, int(count))
+        for fin in overflowFiles:
+            fin.close()
+        self.runs = []
+        self.discard()
+
+    def discard(self):
+        """
+        REMOVES THE SCRATCH FILES OF THE SPILLED RUNS
+        """
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+    def __len__(self):
+        self.compact()
+        return sum(len(codes) for codes, counts in self.packed.values()) + len(self.overflow)
+
+    def total(self):
+        """
+        TOTAL NUMBER OF READS IN THE STORE
+        """
+        self.compact()
+        return int(sum(int(counts.sum()) for codes, counts in self.packed.values()) + sum(self.overflow.values()))
+
+    def counts(self):
+        """
+        THE COUNTS OF ALL UNIQUE SEQUENCES, IN THE SAME ORDER AS items() AND arrays()
+        """
+        self.compact()
+        parts = [self.packed[length][1] for length in sorted(self.packed)]
+        parts.append(np.fromiter(self.overflow.values(), dtype=np.int64, count=len(self.overflow)))
+        return np.concatenate(parts)
+
+    def length_histogram(self, bins):
+        """
+        NUMBER OF READS PER SEQUENCE LENGTH, AS AN ARRAY OF SIZE bins; LONGER SEQUENCES ARE COUNTED IN THE LAST BIN
+        """
+        if self.runs:
+            self.compact()
+        hist = np.zeros(bins, dtype=np.int64)
+        for length, parts in self.pending.items():
+            hist[min(length, bins - 1)] += sum(int(counts.sum()) for codes, counts in parts)
+        for length, (codes, counts) in self.packed.items():
+            hist[min(length, bins - 1)] += int(counts.sum())
+        for seq, count in self.overflow.items():
+            hist[min(len(seq), bins - 1)] += count
+        return hist
+
+    def arrays(self):
+        """
+        RETURNS ALL UNIQUE SEQUENCES AS A LIST OF str AND THEIR COUNTS AS AN int64 ARRAY
+        """
+        self.compact()
+        seqs = []
+        for length in sorted(self.packed):
+            seqs.extend(decode(self.packed[length][0], length))
+        seqs.extend(self.overflow.keys())
+        return seqs, self.counts()
+
+    def items(self):
+        """
+        ITERATES OVER (sequence, count) PAIRS, ONE READ LENGTH AT A TIME
+        """
+        self.compact()
+        for length in sorted(self.packed):
+            codes, counts = self.packed[length]
+            yield from zip(decode(codes, length), counts.tolist())
+        yield from self.overflow.items()
+
+
+class SequenceTable:
+    """
+    THE UNIQUE SEQUENCES OF ALL THE SAMPLES OF A RUN, AS ROWS OF ONE COUNT MATRIX. EACH SAMPLE ONLY KEEPS ITS PACKED (code, count) ARRAYS
+    PER READ LENGTH AND ITS OVERFLOW (intern()); THE ROW IDS ARE GIVEN ONCE, AT THE END, BY ONE np.unique PER READ LENGTH OVER ALL THE
+    SAMPLES (matrix()), SO THE WORK GROWS WITH THE TOTAL NUMBER OF (sample, sequence) ENTRIES RATHER THAN WITH samples x uniques.
+    """
+    def intern(self, store):
+        """
+        RETURNS THE ENTRY OF A CollapsedStore FOR matrix(): ITS PACKED (codes, counts) PER READ LENGTH AND ITS OVERFLOW (sequences, counts)
+        """
+        store.compact()
+        overflowSeqs = np.array(list(store.overflow), dtype=object)
+        overflowCounts = np.fromiter(store.overflow.values(), dtype=np.int64, count=len(store.overflow))
+        return dict(store.packed), (overflowSeqs, overflowCounts)
+
+    def row_ids(self, sampleCounts):
+        """
+        NUMBERS THE DISTINCT SEQUENCES OF THE ENTRIES OF intern(); RETURNS THE SEQUENCES, INDEXED BY ROW ID, AND THE (row ids, counts) OF
+        EACH SAMPLE
+        """
+        seqParts = []
+        idParts = [[] for entry in sampleCounts]
+        countParts = [[] for entry in sampleCounts]
+        size = 0
+        lengths = sorted(set().union(*[packed for packed, overflow in sampleCounts]))
+        groups = [(length, [packed.get(length) for packed, overflow in sampleCounts]) for length in lengths]
+        groups.append((None, [overflow for packed, overflow in sampleCounts])) # THE OVERFLOW SEQUENCES, NOT PACKED
+        for length, parts in groups:
+            present = [(col, part) for col, part in enumerate(parts) if part is not None and len(part[0])]
+            if not present:
+                continue
+            unique, inverse = np.unique(np.concatenate([part[0] for col, part in present]), return_inverse=True)
+            seqParts.append(np.asarray(decode(unique, length) if length is not None else unique, dtype=object))
+            start = 0
+            for col, (keys, counts) in present:
+                idParts[col].append(inverse[start:start + len(keys)].astype(np.int64) + size)
+                countParts[col].append(counts)
+                start += len(keys)
+            size += len(unique)
+        seqs = np.concatenate(seqParts) if seqParts else np.zeros(0, dtype=object)
+        ids = [(np.concatenate(idPart) if idPart else np.zeros(0, dtype=np.int64), np.concatenate(countPart) if countPart else np.zeros(0, dtype=np.int64))
+               for idPart, countPart in zip(idParts, countParts)]
+        return seqs, ids
+
+    def matrix(self, sampleCounts):
+        """
+        ASSEMBLES THE ENTRIES OF intern() OF EVERY SAMPLE, IN COLUMN ORDER, INTO ONE SPARSE CSR MATRIX OF sequences x samples.
+        THE ROWS ARE SORTED BY SEQUENCE; RETURNS THE SORTED SEQUENCES AND THE MATRIX.
+        """
+        seqs, sampleCounts = self.row_ids(sampleCounts)
+        size = len(seqs)
+        order = np.argsort(seqs, kind="stable")
+        rank = np.empty(size, dtype=np.int64)
+        rank[order] = np.arange(size, dtype=np.int64)
+        rows = np.concatenate([rank[ids] for ids, counts in sampleCounts]) if sampleCounts else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate([np.full(len(ids), col, dtype=np.int64) for col, (ids, counts) in enumerate(sampleCounts)]) if sampleCounts else np.zeros(0, dtype=np.int64)
+        data = np.concatenate([counts for ids, counts in sampleCounts]) if sampleCounts else np.zeros(0, dtype=np.int64)
+        countMatrix = sparse.coo_matrix((data, (rows, cols)), shape=(size, len(sampleCounts))).tocsr()
+        return seqs[order].tolist(), countMatrix
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+import os
+import json
+import zipfile
+import hashlib
+import subprocess
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+"""
+PERSISTENT CACHE OF THE OUTCOME OF THE bowtie CASCADE OF bwtAlign() FOR EACH UNIQUE READ, SHARED BY ALL THE RUNS ON THE SAME LIBRARY:
+THE READS FOUND IN THE CACHE ARE ANNOTATED FROM IT, ONLY THE OTHERS GO TO bowtie, AND THE CACHE IS UPDATED WITH THEM AFTER THE RUN.
+THE OUTCOME OF A READ IS THE ITERATION OF THE CASCADE THAT ANNOTATED IT (-1 FOR NONE), THE REFERENCE IT GOT, AND ITS SAM RECORDS IN THAT
+ITERATION, WHICH GO TO THE SAM FILES OF -bam AND -trf AS IF bowtie HAD WRITTEN THEM.
+THE CACHE OF AN ORGANISM AND A DATABASE IS ONE .npz FILE NAMED AFTER A FINGERPRINT OF THE CASCADE (ITS bowtie INDEXES, OPTIONS AND
+VERSION), IN THE DIRECTORY GIVEN WITH --annotation-cache-dir; WITHOUT IT THERE IS NO CACHE. A NEW VERSION OF THE LIBRARY GETS A NEW FILE.
+"""
+
+cache_version = 1 # BUMP WHENEVER THE CASCADE OF bwtAlign() (ITERATIONS, INDEXES, bowtie OPTIONS, ANNOTATION) CHANGES
+max_entries = 2000000 # READS KEPT IN A CACHE FILE; THE ONES NOT SEEN FOR THE LONGEST TIME ARE DROPPED FIRST
+record_separator = "\x1e" # BETWEEN THE SAM RECORDS OF TWO READS IN THE FILE; THE RECORDS OF ONE READ ARE SEPARATED BY NEW LINES
+
+
+def cache_dir(args):
+    """
+    THE CACHE DIRECTORY, --annotation-cache-dir; None (NO CACHE) WITHOUT IT
+    """
+    return Path(args.annotation_cache_dir) if args.annotation_cache_dir else None
+
+
+def bowtie_version(bwtCommand):
+    """
+    THE FIRST LINE OF bowtie --version, OR "" IF bowtie DOES NOT ANSWER
+    """
+    bowtie = subprocess.run(str(bwtCommand) + " --version", shell=True, capture_output=True, text=True)
+    return bowtie.stdout.split('\n')[0].strip() if bowtie.returncode == 0 else ""
+
+
+def library_fingerprint(indexFiles, parameters, bowtieVersion, spikeIn):
+    """
+    FINGERPRINT OF THE CASCADE: THE NAME, SIZE AND MODIFICATION TIME OF THE FILES OF ITS bowtie INDEXES indexFiles (PATHS WITHOUT
+    EXTENSION), THE bowtie OPTIONS OF EACH ITERATION (parameters), THE bowtie VERSION, -spk (WHICH ADDS AN ITERATION) AND cache_version.
+    THE INDEXES ARE ONLY stat()ED, NEVER READ: REBUILDING OR REPLACING ONE CHANGES ITS MODIFICATION TIME
+    """
+    files = []
+    for indexFile in indexFiles:
+        indexFile = Path(indexFile)
+        for path in sorted(indexFile.parent.glob(indexFile.name + ".*")):
+            stat = path.stat()
+            files.append([str(path), stat.st_size, stat.st_mtime_ns])
+    key = {'cache_version': cache_version, 'spikeIn': bool(spikeIn), 'bowtie': bowtieVersion, 'parameters': list(parameters), 'files': files}
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def open_cache(args, ref_db, indexFiles, parameters, bwtCommand):
+    """
+    THE AnnotationCache OF THE CASCADE THAT RUNS bwtCommand WITH THE bowtie INDEXES indexFiles AND THE OPTIONS parameters, OR None IF THE
+    CACHE IS DISABLED
+    """
+    cacheDir = cache_dir(args)
+    if cacheDir is None:
+        return None
+    fingerprint = library_fingerprint(indexFiles, parameters, bowtie_version(bwtCommand), args.spikeIn)
+    return AnnotationCache(cacheDir/(args.organism_name + "_" + ref_db + "_" + fingerprint + ".npz"))
+
+
+def join_text(values, separator="\n"):
+    return np.frombuffer(separator.join(values).encode(), dtype=np.uint8)
+
+
+def split_text(array, count, separator="\n"):
+    return array.tobytes().decode().split(separator) if count else []
+
+
+class AnnotationCache:
+    """
+    THE ENTRIES OF A CACHE FILE: sequences (pd.Index), stages (int8), refs AND sams (object ARRAYS), AND lastSeen, THE NUMBER OF THE LAST
+    RUN THAT HAD EACH READ (run IS THE NUMBER OF THE CURRENT ONE)
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.clear()
+        self.load()
+        self.added = []
+
+    def clear(self):
+        self.sequences = pd.Index([], dtype=object)
+        self.stages = np.zeros(0, dtype=np.int8)
+        self.refs = np.zeros(0, dtype=object)
+        self.sams = np.zeros(0, dtype=object)
+        self.lastSeen = np.zeros(0, dtype=np.int64)
+        self.run = 1
+
+    def load(self):
+        """
+        READS THE CACHE FILE; A MISSING OR UNREADABLE FILE GIVES AN EMPTY CACHE
+        """
+        if not self.path.exists():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                count = len(data['stages'])
+                self.sequences = pd.Index(split_text(data['sequences'], count), dtype=object)
+                self.refs = np.array(split_text(data['refs'], count), dtype=object)
+                self.sams = np.array(split_text(data['sams'], count, record_separator), dtype=object)
+                self.stages = data['stages']
+                self.lastSeen = data['last_seen']
+                self.run = int(data['run']) + 1
+            if not (len(self.sequences) == len(self.refs) == len(self.sams) == len(self.lastSeen) == count):
+                raise ValueError("inconsistent annotation cache")
+        except (OSError, ValueError, KeyError, UnicodeDecodeError, zipfile.BadZipFile):
+            self.clear()
+
+    def lookup(self, sequences):
+        """
+        THE POSITION IN THE CACHE OF EACH OF THE sequences (-1 IF IT IS NOT CACHED), WHICH ALSO MARKS THE CACHED ONES AS SEEN BY THIS RUN
+        """
+        entries = self.sequences.get_indexer(sequences)
+        self.lastSeen[entries[entries >= 0]] = self.run
+        return entries
+
+    def add(self, sequences, stages, refs, sams):
+        """
+        ADDS THE OUTCOMES OF THE READS ALIGNED BY THIS RUN; save() WRITES THEM
+        """
+        self.added.append((list(sequences), np.asarray(stages, dtype=np.int8), list(refs), list(sams)))
+
+    def save(self):
+        """
+        WRITES THE CACHE WITH THE ADDED READS. THE FILE IS RE-READ FIRST, SO THAT THE READS ADDED BY ANOTHER RUN SINCE load() ARE KEPT,
+        THEN WRITTEN UNDER A TEMPORARY NAME AND RENAMED, SO AN INTERRUPTED RUN NEVER LEAVES A TRUNCATED FILE BEHIND. RETURNS THE NUMBER OF
+        READS IN THE CACHE.
+        """
+        mine = (self.sequences, self.stages, self.refs, self.sams, self.lastSeen, self.run)
+        self.clear()
+        self.load()
+        run = max(self.run, mine[5])
+        seen = np.where(mine[4] == mine[5], run, mine[4]) # THE READS OF THIS RUN, UNDER ITS FINAL NUMBER
+        parts = [(self.sequences, self.stages, self.refs, self.sams, self.lastSeen), (mine[0], mine[1], mine[2], mine[3], seen)]
+        for sequences, stages, refs, sams in self.added:
+            parts.append((pd.Index(sequences, dtype=object), stages, np.array(refs, dtype=object), np.array(sams, dtype=object), np.full(len(stages), run, dtype=np.int64)))
+        sequences = pd.Index(np.concatenate([np.asarray(part[0], dtype=object) for part in parts]), dtype=object)
+        lastSeen = np.concatenate([part[4] for part in parts])
+        # ONE ENTRY PER READ, THE MOST RECENTLY SEEN (ENTRIES OF THE SAME READ HAVE THE SAME OUTCOME), THEN THE max_entries MOST RECENT
+        order = np.lexsort((np.arange(len(lastSeen)), -lastSeen))
+        order = order[~sequences[order].duplicated(keep='first')][:max_entries]
+        arrays = {
+            'sequences': join_text(sequences[order]),
+            'stages': np.concatenate([part[1] for part in parts]).astype(np.int8)[order],
+            'refs': join_text(np.concatenate([part[2] for part in parts])[order]),
+            'sams': join_text(np.concatenate([part[3] for part in parts])[order], record_separator),
+            'last_seen': lastSeen[order],
+            'run': np.asarray(run),
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmpPath = self.path.with_name(self.path.name + ".%d.tmp" % os.getpid())
+        with open(tmpPath, 'wb') as fout:
+            np.savez_compressed(fout, **arrays)
+        os.replace(tmpPath, self.path)
+        self.added = []
+        self.load()
+        return len(order)
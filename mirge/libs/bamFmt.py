@@ -4,12 +4,13 @@ import pandas as pd
 from pathlib import Path
 import subprocess
 import os, sys
+from mirge.libs import metrics
 
 def fetchGenCor(args, index_file_name, dict_gen_coordinates):
     bwtCommand = Path(args.bowtie_path)/"bowtie-inspect" if args.bowtie_path else "bowtie-inspect"
     bwtExec = str(bwtCommand) +" -n "+ str(index_file_name)
     print("[CMD:]", bwtExec)
-    bowtie = subprocess.run(str(bwtExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+    bowtie = metrics.run(bwtExec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
     if bowtie.returncode==0:
         bwtOut = bowtie.stdout
         bwtErr = bowtie.stderr
@@ -85,7 +86,7 @@ def createBAM(args, workDir, base_names):
         bam_sortidx = Path(workDir)/file_Sortbam_idx
         samCom2bam = str(samtoolsCommandPre) + "view -bS " + str(sam_name) + " > " + str(bam_name)
         print("[CMD:]", samCom2bam)
-        samcreation = subprocess.run(str(samCom2bam), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+        samcreation = metrics.run(samCom2bam, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
         if samcreation.returncode !=0:
             print("Error in creating BAM file!. Ignoring this step\n")
             pass
@@ -94,7 +95,7 @@ def createBAM(args, workDir, base_names):
             pass
         bamsort = str(samtoolsCommandPre) + "sort -@ " + str(args.threads) + " " + str(bam_name) + " -o " + str(bam_sortname)
         print("[CMD:]", bamsort)
-        bamsorting = subprocess.run(str(bamsort), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+        bamsorting = metrics.run(bamsort, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
         if bamsorting.returncode !=0:
             print("Error in Sorting BAM file!. Ignoring this step\n")
             pass
@@ -103,7 +104,7 @@ def createBAM(args, workDir, base_names):
             pass
         bamindex = str(samtoolsCommandPre) + "index " + str(bam_sortname) + " " + str(bam_sortidx)
         print("[CMD:]", bamindex)
-        bamindexing = subprocess.run(str(bamindex), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+        bamindexing = metrics.run(bamindex, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
         if bamindexing.returncode !=0:
             print("Error indexing BAM file!. Ignoring this step\n")
             pass
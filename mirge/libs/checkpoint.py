@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+import os
+import json
+import zipfile
+import hashlib
+import concurrent.futures
+from pathlib import Path
+import numpy as np
+
+from mirge.classes.collapsedStore import CollapsedStore
+
+"""
+ON-DISK CHECKPOINTS OF THE TRIMMED AND COLLAPSED READS OF EACH SAMPLE, SO THAT A RUN THAT ONLY CHANGES DOWNSTREAM OPTIONS
+(-gff, -trf, -ai, -nmir, -db, ...) DOES NOT TRIM THE SAME FASTQ FILES AGAIN.
+CHECKPOINTS ARE ONLY USED WITH --checkpoint-dir.
+A CHECKPOINT IS ONE .npz FILE NAMED AFTER A FINGERPRINT OF THE INPUT FILE CONTENT AND A HASH OF THE TRIMMING OPTIONS; IT HOLDS THE
+PACKED CollapsedStore, THE READ COUNTS AND THE READ LENGTH (AND UMI) HISTOGRAMS OF THE SAMPLE.
+"""
+
+checkpoint_version = 2 # BUMP WHENEVER THE TRIMMING RESULT OR THE FILE LAYOUT CHANGES, WHICH INVALIDATES ALL THE EXISTING CHECKPOINTS
+
+# EVERY OPTION THAT CHANGES THE TRIMMED AND COLLAPSED READS (SEE stipulate(), init_worker() AND THE UMI STEP OF baking())
+trim_options = ['adapters', 'cut', 'nextseq_trim', 'quality_cutoff', 'phred64', 'trim_n', 'minimum_length', 'error_rate', 'overlap',
+        'times', 'action', 'match_read_wildcards', 'match_adapter_wildcards', 'indels', 'uniq_mol_ids', 'umiDedup', 'qiagenumi']
+
+hash_block = 1 << 22 # BYTES PER READ WHEN HASHING AN INPUT FILE
+
+
+def checkpoint_dir(args):
+    """
+    THE CHECKPOINT DIRECTORY, --checkpoint-dir; None (NO CHECKPOINTS) WITHOUT IT
+    """
+    return Path(args.checkpoint_dir) if args.checkpoint_dir else None
+
+
+def input_fingerprint(path):
+    """
+    CONTENT FINGERPRINT OF AN INPUT FILE: blake2b OF ITS SIZE AND OF ITS WHOLE CONTENT. EVERY BYTE IS HASHED, SO THAT A FASTQ FILE OF THE
+    SAME SIZE WITH DIFFERENT READS (RE-BASECALLED, RE-DEMULTIPLEXED, ...) NEVER LOADS THE CHECKPOINT OF THE FORMER ONE
+    """
+    digest = hashlib.blake2b(str(os.path.getsize(path)).encode(), digest_size=16)
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(hash_block), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def options_hash(args):
+    """
+    HASH OF THE TRIMMING OPTIONS AND OF checkpoint_version
+    """
+    options = {name: getattr(args, name, None) for name in trim_options}
+    options['checkpoint_version'] = checkpoint_version
+    return hashlib.blake2b(json.dumps(options, sort_keys=True, default=str).encode(), digest_size=8).hexdigest()
+
+
+def checkpoint_path(args, inFiles):
+    """
+    PATH OF THE CHECKPOINT OF ONE SAMPLE (ONE INPUT FILE, OR THE LIST OF ITS LANE FILES) FOR THE CURRENT TRIMMING OPTIONS, 
+    OR None IF CHECKPOINTS ARE DISABLED
+    """
+    ckDir = checkpoint_dir(args)
+    if ckDir is None:
+        return None
+    inFiles = list(inFiles) if isinstance(inFiles, (list, tuple)) else [inFiles]
+    if len(inFiles) == 1:
+        fingerprint = input_fingerprint(inFiles[0])
+    else: # blake2b RELEASES THE GIL, SO THE LANE FILES ARE HASHED IN PARALLEL
+        with concurrent.futures.ThreadPoolExecutor(min(len(inFiles), os.cpu_count() or 1)) as pool:
+            fingerprints = list(pool.map(input_fingerprint, inFiles))
+        fingerprint = hashlib.blake2b("".join(fingerprints).encode(), digest_size=16).hexdigest()
+    return ckDir/(fingerprint + "_" + options_hash(args) + ".npz")
+
+
+def save(path, store, **stats):
+    """
+    WRITES A CollapsedStore AND THE SAMPLE STATISTICS (NUMBERS OR numpy ARRAYS) TO path. THE FILE IS WRITTEN UNDER A TEMPORARY NAME
+    AND RENAMED, SO AN INTERRUPTED RUN NEVER LEAVES A TRUNCATED CHECKPOINT BEHIND.
+    """
+    store.compact()
+    arrays = {}
+    for length, (codes, counts) in store.packed.items():
+        arrays['codes_%d' % length] = codes
+        arrays['counts_%d' % length] = counts
+    arrays['overflow_seqs'] = np.frombuffer("\n".join(store.overflow.keys()).encode(), dtype=np.uint8)
+    arrays['overflow_counts'] = np.fromiter(store.overflow.values(), dtype=np.int64, count=len(store.overflow))
+    for name, value in stats.items():
+        arrays['stat_' + name] = np.asarray(value)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmpPath = path.with_name(path.name + ".%d.tmp" % os.getpid())
+    with open(tmpPath, 'wb') as fout:
+        np.savez_compressed(fout, **arrays)
+    os.replace(tmpPath, path)
+
+
+def load(path, store=None):
+    """
+    READS A CHECKPOINT WRITTEN BY save() INTO store (A NEW CollapsedStore BY DEFAULT); RETURNS THE STORE AND A dict OF THE STATISTICS,
+    OR None IF THERE IS NO READABLE CHECKPOINT AT path. A store WITH A memory_budget (--max-memory) GETS THE READS ONE LENGTH AT A TIME
+    AND SPILLS LIKE A STORE FILLED BY THE TRIMMING
+    """
+    if path is None or not Path(path).exists():
+        return None
+    store = CollapsedStore() if store is None else store
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            stats = {}
+            for name in data.files:
+                if name.startswith('codes_'):
+                    length = int(name[len('codes_'):])
+                    if store.memory_budget:
+                        store.add_packed(length, data[name], data['counts_%d' % length])
+                        store.check_budget()
+                    else:
+                        store.packed[length] = (data[name], data['counts_%d' % length])
+                elif name.startswith('stat_'):
+                    value = data[name]
+                    stats[name[len('stat_'):]] = value.item() if value.ndim == 0 else value
+            overflowSeqs = data['overflow_seqs'].tobytes().decode()
+            if overflowSeqs or len(data['overflow_counts']):
+                for seq, count in zip(overflowSeqs.split("\n"), data['overflow_counts'].tolist()):
+                    store.add_overflow(seq, count)
+                store.check_budget()
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        store.discard()
+        return None
+    return store, stats
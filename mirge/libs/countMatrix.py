@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+"""
+HELPERS FOR THE SEQUENCE x SAMPLE COUNT MATRIX THAT FLOWS FROM baking() THROUGH bwtAlign() INTO summarize().
+THE SAMPLE COLUMNS OF THE DATAFRAME ARE pandas SPARSE COLUMNS (Sparse[int64, 0]) SO THAT MEMORY SCALES WITH THE NON-ZERO COUNTS,
+NOT WITH sequences x samples; THE ANNOTATION COLUMNS (annotFlag, exact miRNA, ...) STAY DENSE.
+SUMS AND GROUPINGS ARE DONE ON THE scipy.sparse MATRIX BEHIND THOSE COLUMNS; ONLY SMALL SUBSETS ARE EVER MADE DENSE.
+"""
+
+
+def sparse_counts(countMatrix, index, base_names):
+    """
+    WRAPS A scipy.sparse sequences x samples MATRIX AS A DATAFRAME OF SPARSE COUNT COLUMNS
+    """
+    return pd.DataFrame.sparse.from_spmatrix(sparse.csc_matrix(countMatrix, dtype=np.int64), index=index, columns=base_names)
+
+
+def count_matrix(df, base_names):
+    """
+    THE COUNT COLUMNS OF df AS A scipy.sparse CSR MATRIX (ROWS IN THE ORDER OF df)
+    """
+    if len(df.index) == 0:
+        return sparse.csr_matrix((0, len(base_names)), dtype=np.int64)
+    columns = []
+    for file_name in base_names:
+        values = df[file_name].array
+        if isinstance(values, pd.arrays.SparseArray):
+            rows = values.sp_index.to_int_index().indices
+            columns.append(sparse.csc_matrix((values.sp_values.astype(np.int64), rows, [0, len(rows)]), shape=(len(df.index), 1)))
+        else:
+            columns.append(sparse.csc_matrix(np.asarray(values, dtype=np.int64).reshape(-1, 1)))
+    return sparse.hstack(columns, format="csr")
+
+
+def dense_counts(df, base_names):
+    """
+    RETURNS A COPY OF df WITH DENSE int COUNT COLUMNS; ONLY MEANT FOR SMALL SUBSETS (miRNA, tRNA, ... ROWS) THAT ARE WRITTEN ROW BY ROW
+    """
+    df = df.copy()
+    for file_name in base_names:
+        if isinstance(df[file_name].dtype, pd.SparseDtype):
+            df[file_name] = df[file_name].sparse.to_dense().astype(np.int64)
+    return df
+
+
+def class_sums(df, mask, base_names):
+    """
+    SUM OF THE COUNTS OF EACH SAMPLE OVER THE ROWS OF df SELECTED BY THE BOOLEAN mask
+    """
+    totals = count_matrix(df[np.asarray(mask, dtype=bool)], base_names).sum(axis=0)
+    return dict(zip(base_names, np.asarray(totals, dtype=np.int64).ravel().tolist()))
+
+
+def group_sum(df, key, base_names):
+    """
+    SPARSE EQUIVALENT OF df.groupby(key).sum()[base_names]: key IS A COLUMN OR AN INDEX LEVEL OF df.
+    EACH ROW IS ASSIGNED TO ITS GROUP WITH A groups x rows INDICATOR MATRIX, WHICH IS MULTIPLIED WITH THE COUNT MATRIX.
+    """
+    keys = df.index.get_level_values(key) if key in df.index.names else df[key]
+    codes, groups = pd.factorize(keys, sort=True)
+    keep = codes >= 0 # groupby DROPS MISSING KEYS
+    indicator = sparse.csr_matrix((np.ones(int(keep.sum()), dtype=np.int64), (codes[keep], np.flatnonzero(keep))), shape=(len(groups), len(keys)))
+    summed = (indicator @ count_matrix(df, base_names)).toarray()
+    return pd.DataFrame(summed, index=pd.Index(groups, name=key), columns=base_names)
+
+
+def to_csv_blocks(df, path, block_rows=100000):
+    """
+    WRITES df TO A CSV FILE block_rows ROWS AT A TIME, SO THAT ONLY ONE BLOCK OF THE SPARSE COUNTS IS EVER DENSE
+    """
+    base_names = [col for col in df.columns if isinstance(df[col].dtype, pd.SparseDtype)]
+    with open(path, "w") as fo:
+        for start in range(0, max(len(df.index), 1), block_rows):
+            dense_counts(df.iloc[start:start + block_rows], base_names).to_csv(fo, header=(start == 0))
@@ -1,18 +1,33 @@
 #!/usr/bin/env python
 import dnaio
+import io
 import os
+import sys
+import re
+import gzip
+import shutil
 import time
+import queue
+import threading
+import multiprocessing
 import concurrent.futures
+import functools
 import pandas as pd
 from pathlib import Path
 import numpy as np
+from xopen import xopen
 
 from cutadapt.adapters import warn_duplicate_adapters
 from cutadapt.parser import AdapterParser
+from cutadapt.qualtrim import quality_trim_index
 from cutadapt.modifiers import (LengthTagModifier, SuffixRemover, PrefixSuffixAdder,
         ZeroCapper, QualityTrimmer, UnconditionalCutter, NEndTrimmer, AdapterCutter,
         PairedAdapterCutterError, PairedAdapterCutter, NextseqQualityTrimmer, Shortener)
 from mirge.classes.exportHTML import FormatJS
+from mirge.classes.collapsedStore import CollapsedStore, SequenceTable
+from mirge.libs.countMatrix import sparse_counts
+from mirge.libs import kernels, checkpoint, umiNetwork, metrics, profiling
+from mirge.libs.miRgeEssential import is_fasta
 
 
 def parse_cutoffs(s):
@@ -84,12 +99,124 @@ def stipulate(args):
     if args.trim_n:
         pipeline_add(NEndTrimmer())
     add_unconditional_cutters(pipeline_add, args.cut)
-        
-    print("modifiers (cutadapt):", modifiers)
     return modifiers
 
 
-fo_tcf_fq_out = None
+def init_worker(args, profileDir=None):
+    """
+    INITIALIZER OF THE TRIMMING WORKERS. EACH WORKER BUILDS ITS OWN CUTADAPT MODIFIERS FROM THE USER ARGUMENTS, 
+    SO NOTHING IS INHERITED FROM THE PARENT AND THE POOL WORKS WITH fork, forkserver AND spawn START METHODS ALIKE.
+    WITH profileDir (--profile AND --profile-workers), THE WORKER PROFILES ONE CHUNK IN args.profile_workers.
+    """
+    global ingredients, min_len, umi, qiagenumi, umi_len, umi_cutter, front_trimmer, compression_level, cached_ingredients, trim_cached, min_quality, exact_cutter, exact_adapter
+    umi = args.uniq_mol_ids
+    compression_level = args.compression_level
+    qiagenumi = args.qiagenumi
+    min_len = args.minimum_length
+    ingredients = stipulate(args)
+    exact_cutter, exact_adapter = exact_adapter_cutter(ingredients) if args.exact_adapter else (None, None)
+    """
+    THE QIAseq UMI FOLLOWS THE 3' ADAPTER: IT IS READ FROM THE RAW READ, RIGHT AFTER THE END OF THE ADAPTER MATCH. THE 5' QUALITY 
+    TRIMMER IS APPLIED BY trim_read() ITSELF SO THAT THE MATCH COORDINATES CAN BE SHIFTED BACK TO THE RAW READ.
+    """
+    umi_len = int(umi.split(",")[1]) if qiagenumi else 0
+    umi_cutter = front_trimmer = None
+    for modifier in ingredients:
+        if qiagenumi and isinstance(modifier, AdapterCutter):
+            umi_cutter = modifier
+        elif qiagenumi and isinstance(modifier, QualityTrimmer) and modifier.cutoff_front > 0:
+            front_trimmer = modifier
+    """
+    ONCE NO BASE IS BELOW THE QUALITY CUTOFF, QUALITY TRIMMING IS A NO-OP AND THE RESULT ONLY DEPENDS ON THE SEQUENCE: SUCH READS ARE 
+    TRIMMED THROUGH A BOUNDED LRU CACHE KEYED ON THE RAW SEQUENCE, SO REPEATED READS SKIP THE ADAPTER ALIGNMENT. 
+    NEXTSEQ TRIMMING TREATS G AS A LOW QUALITY BASE, SO IT ALWAYS DISABLES THE CACHE. 
+    """
+    cached_ingredients = [modifier for modifier in ingredients if not isinstance(modifier, QualityTrimmer)]
+    min_quality = chr(max(parse_cutoffs(args.quality_cutoff)) + args.phred64) if args.quality_cutoff is not None else ""
+    if args.trim_cache > 0 and args.nextseq_trim is None:
+        trim_cached = functools.lru_cache(maxsize=args.trim_cache)(trim_sequence)
+    else:
+        trim_cached = None
+    if profileDir is not None:
+        profiling.start_worker(profileDir, args.profile_workers)
+
+
+def back_adapter_sequence(adapter):
+    """
+    THE SEQUENCE OF A PLAIN 3' ADAPTER (-a SEQ OR -a name=SEQ: NEITHER ANCHORED WITH $ NOR NON-INTERNAL WITH X), OR None FOR ANY OTHER
+    ADAPTER. THE ADAPTER IS RECOGNIZED BY ITS where ATTRIBUTE (Where.BACK IN cutadapt 2.x) RATHER THAN BY ITS TYPE, SO THAT NO
+    VERSION-SPECIFIC CLASS HAS TO BE IMPORTED; AN ADAPTER WITHOUT IT IS NEVER TAKEN FOR A PLAIN ONE.
+    """
+    where = getattr(adapter, 'where', None)
+    sequence = getattr(adapter, 'sequence', None)
+    if getattr(where, 'name', None) == 'BACK' and isinstance(sequence, str):
+        return sequence
+    return None
+
+
+def exact_adapter_cutter(modifiers):
+    """
+    FINDS THE AdapterCutter THAT CAN TAKE THE EXACT-MATCH FAST PATH IN trim_read(): A SINGLE PLAIN 3' ADAPTER WITHOUT WILDCARDS, SEARCHED
+    ONCE (-n 1) AND TRIMMED (--action trim). RETURNS THE CUTTER AND THE ADAPTER SEQUENCE, OR (None, None), IN WHICH CASE EVERY READ GOES
+    THROUGH THE AdapterCutter.
+    """
+    for modifier in modifiers:
+        if isinstance(modifier, AdapterCutter) and modifier.times == 1 and modifier.action == 'trim' and len(modifier.adapters) == 1:
+            adapter = modifier.adapters[0]
+            sequence = back_adapter_sequence(adapter)
+            if sequence is not None and not getattr(adapter, 'adapter_wildcards', True):
+                return modifier, sequence
+    return None, None
+
+
+def worker_pool(args):
+    """
+    CREATES THE TRIMMING POOL ONCE PER RUN; IT IS SHARED BY ALL THE SAMPLES. WORKERS ARE STARTED FROM A CLEAN forkserver 
+    (OR spawn WHERE forkserver IS NOT AVAILABLE) RATHER THAN FORKED FROM THE PARENT AND ITS GROWING COUNT MATRIX.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("forkserver")
+        mp_context.set_forkserver_preload([__name__]) # cutadapt, dnaio and pandas are imported once by the server, not by every worker
+    else:
+        mp_context = multiprocessing.get_context("spawn")
+    return concurrent.futures.ProcessPoolExecutor(max_workers=args.threads, mp_context=mp_context, initializer=init_worker,
+                                                 initargs=(args, profiling.profileDir if args.profile_workers else None))
+
+
+class TrimPool:
+    """
+    THE POOL OF worker_pool(), STARTED BY THE FIRST get(): A RUN WHOSE INPUTS ARE ALL COLLAPSED FASTA FILES OR RESTORED FROM CHECKPOINTS
+    NEVER STARTS IT. AS A CONTEXT MANAGER IT SHUTS THE POOL DOWN ON EXIT, ALSO WHEN THE RUN FAILS, CANCELLING THE CHUNKS NOT STARTED YET
+    """
+    def __init__(self, args):
+        self.args = args
+        self.executor = None
+
+    def get(self):
+        if self.executor is None:
+            self.executor = worker_pool(self.args)
+        return self.executor
+
+    def usage(self):
+        """
+        metrics.pool_usage() OF THE POOL, (0, 0) BEFORE IT IS STARTED
+        """
+        return metrics.pool_usage(self.executor) if self.executor is not None else (0.0, 0.0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if self.executor is not None:
+            if excType is not None and sys.version_info >= (3, 9):
+                self.executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                self.executor.shutdown(wait=True)
+            self.executor = None
+        return False
+
+
+rlen_bins = 1024 # SIZE OF THE READ LENGTH HISTOGRAMS RETURNED BY THE WORKERS; LONGER READS ARE COUNTED IN THE LAST BIN
 
 
 def baking(args, inFileArray, inFileBaseArray, workDir):
@@ -97,185 +224,178 @@ def baking(args, inFileArray, inFileBaseArray, workDir):
     THIS FUNCTION IS CALLED FIRST FROM THE miRge3.0. 
     THIS FUNCTION PREPARES FUNCTIONS REQUIRED TO RUN IN CUTADAPT 2.7 AND PARSE ONE FILE AT A TIME. 
     """
-    global ingredients, threads, buffer_size, trimmed_reads, fasta, fileTowriteFasta, min_len, umi, qiagenumi, qiaAdapter
-    numlines=10000
+    global ingredients, threads, buffer_size, trimmed_reads, fasta, fileTowriteFasta, min_len, umi, qiagenumi
     umi = args.uniq_mol_ids
     qiagenumi = args.qiagenumi
     fasta = args.fasta
     threads = args.threads
     buffer_size = args.buffer_size
     min_len = args.minimum_length
-    if qiagenumi:
-        qiaAdapter = str(args.adapters[0][1])
     ingredients = stipulate(args)
+    print("modifiers (cutadapt):", ingredients)
+    new_store = CollapsedStore
+    if args.max_memory:
+        # A QUARTER OF THE BUDGET FOR THE COUNTS IN MEMORY (COMPACTING AND MERGING NEED A FEW TIMES THAT), AN EIGHTH FOR THE CHUNKS IN FLIGHT
+        new_store = functools.partial(CollapsedStore, memory_budget=args.max_memory // 4, scratch_dir=args.scratch_dir or str(workDir))
+        buffer_size = max(min(buffer_size, args.max_memory // (8 * max(threads, 1) * 2)), 1 << 20)
     df_mirged=pd.DataFrame()
-    complete_set=pd.DataFrame()
+    seqTable = SequenceTable() # ONE ROW ID PER UNIQUE SEQUENCE ACROSS ALL SAMPLES
+    sampleCounts = [] # (row ids, counts) OF EACH SAMPLE, IN THE ORDER OF inFileBaseArray
     begningTime = time.perf_counter()
     sampleReadCounts={}
     trimmedReadCounts={}
     trimmedReadCountsUnique={}
     digestReadCounts={}
+    laneReadCounts={} # SAMPLE -> {LANE FILE: INPUT READS}, FOR THE SAMPLES GIVEN AS SEVERAL FILES
     visual_treat = {'rlen':{}, 'hist':{}}
     runlogFile = Path(workDir)/"run.log"
     outlog = open(str(runlogFile),"a+")
-    for index, FQfile in enumerate(inFileArray):
-
-        fno_fq = str(inFileBaseArray[index]) + '.trim.fq'
-        fo_tcf_fq = Path(workDir)/fno_fq
-        global fo_tcf_fq_out
-        print('Openning file:', fo_tcf_fq)
-        fo_tcf_fq_out = open(fo_tcf_fq, 'w')
-
-        start = time.perf_counter()
-        finish2=finish3=finish4=finish5=0
-        with concurrent.futures.ProcessPoolExecutor(max_workers=threads) as executor:
-            with dnaio.open(FQfile, mode='r') as readers:
-                readobj=[]
-                count=trimmed=trimmed_write=0
-                completeDict = {}
-                for reads in readers:
-                    count+=1
-                    readobj.append(reads)
-                    if len(readobj) == 1000000:
-                        future = [executor.submit(cutadapt, readobj[i:i+numlines]) for i in range(0, len(readobj), numlines)] # sending bunch of reads (#1000000) for parallel execution
-                        for fqres_pairs in concurrent.futures.as_completed(future): 
-                            for temp in fqres_pairs.result()[1]:
-                                trimmed_write += 1
-                                fo_tcf_fq_out.write(temp)
-                            for each_list in fqres_pairs.result()[0]: # retreving results from parallel execution
-                                varx = list(each_list)
-                                try:
-                                    visual_treat['rlen'][str(inFileBaseArray[index])].append(len(varx[0]))
-                                except KeyError:
-                                    visual_treat['rlen'][str(inFileBaseArray[index])]= [len(varx[0])]
-                                if varx[0] in completeDict: # Collapsing, i.e., counting the occurance of each read for each data 
-                                    completeDict[varx[0]] += int(varx[1])
-                                    trimmed+=int(varx[1])
-                                else:
-                                    completeDict[varx[0]] = int(varx[1])
-                                    trimmed+=int(varx[1])
-                        readobj=[]
-                future=[]
-                future.extend([executor.submit(cutadapt, readobj[i:i+numlines]) for i in range(0, len(readobj), numlines)]) # sending remaining reads for parallel execution
-                for fqres_pairs in concurrent.futures.as_completed(future):
-                    for temp in fqres_pairs.result()[1]:
-                        trimmed_write += 1
-                        fo_tcf_fq_out.write(temp)
-                    for each_list in fqres_pairs.result()[0]: # retreving results from parallel execution
-                        varx = list(each_list)
-                        try:
-                            visual_treat['rlen'][str(inFileBaseArray[index])].append(len(varx[0]))
-                        except KeyError:
-                            visual_treat['rlen'][str(inFileBaseArray[index])]= [len(varx[0])]
-                        if varx[0] in completeDict: # Collapsing, i.e., counting the occurance of each read for each data 
-                            completeDict[varx[0]] += int(varx[1])
-                            trimmed+=int(varx[1])
-                        else:
-                            completeDict[varx[0]] = int(varx[1])
-                            trimmed+=int(varx[1])
-                readobj=[]
-        print("Write file reads:", trimmed_write)
-        if umi:
-            trimmed=0
-            umicompleteDict=dict()
-            umi_cut = umi.split(",")
-            if not args.umiDedup:
-                for s, c in completeDict.items():
-                    pureSeq, cutumiSeq = UMIParser(s, int(umi_cut[0]), int(umi_cut[1]))
-                    try:
-                        visual_treat['hist'][str(inFileBaseArray[index])].append(c)
-                    except KeyError:
-                        visual_treat['hist'][str(inFileBaseArray[index])] = [c]
-                    if len(pureSeq) >= int(min_len):
-                        if pureSeq in umicompleteDict:
-                            umicompleteDict[pureSeq] += c
-                            trimmed += c
-                        else:
-                            umicompleteDict[pureSeq] = c
+    with TrimPool(args) as pool: # STARTED BY THE FIRST SAMPLE TO TRIM, SHUT DOWN EVEN IF THE RUN FAILS
+        for index, FQfile in enumerate(inFileArray):
+            if args.trim_fq_out:
+                fno_fq = str(inFileBaseArray[index]) + '.trim.fq.gz'
+                fo_tcf_fq = Path(workDir)/fno_fq
+            else:
+                fo_tcf_fq = None
+            start = time.perf_counter()
+            finish2=finish3=finish4=finish5=0
+            count=trimmed=umi_missing=0
+            completeDict = new_store()
+            visual_treat['rlen'][str(inFileBaseArray[index])] = np.zeros(rlen_bins, dtype=np.int64)
+            laneFiles = list(FQfile) if isinstance(FQfile, (list, tuple)) else [FQfile] # ALL THE LANES OF THE SAMPLE GO INTO ONE COLLAPSED TABLE
+            laneCounts = np.zeros(len(laneFiles), dtype=np.int64)
+            collapsedInput = is_fasta(laneFiles[0])
+            ckPath = checkpoint.checkpoint_path(args, laneFiles) if not collapsedInput else None
+            sampleStage = metrics.begin("trimming", inFileBaseArray[index], files=len(laneFiles))
+            workerCpu = pool.usage()[0]
+            # -udd AND -tfq WRITE PER-SAMPLE FILES WHILE TRIMMING, SO THEY ALWAYS TRIM (THE RESULT OF -tfq RUNS IS STILL CHECKPOINTED)
+            restored = checkpoint.load(ckPath, new_store()) if not args.umiDedup and not args.trim_fq_out else None
+            if restored is not None:
+                completeDict, ckStats = restored
+                count, trimmed, umi_missing, laneCounts = ckStats['count'], ckStats['trimmed'], ckStats['umi_missing'], ckStats['lane_counts']
+                visual_treat['rlen'][str(inFileBaseArray[index])] = ckStats['rlen']
+                if umi:
+                    visual_treat['hist'][str(inFileBaseArray[index])] = (ckStats['umi_values'], ckStats['umi_freqs'])
+                if not args.quiet:
+                    print(f'Loaded the trimmed and collapsed reads of {inFileBaseArray[index]} from the checkpoint {ckPath}')
+                outlog.write(f'Loaded the trimmed and collapsed reads of {inFileBaseArray[index]} from the checkpoint {ckPath}\n')
+            elif collapsedInput:
+                for lane, laneFile in enumerate(laneFiles):
+                    completeDict = collapsed_fasta(laneFile, completeDict)
+                    laneCounts[lane] = completeDict.total() - laneCounts.sum()
+                count = trimmed = completeDict.total()
+                visual_treat['rlen'][str(inFileBaseArray[index])] = completeDict.length_histogram(rlen_bins)
+                if umi: # NO UMI WAS SEEN: AN EMPTY UMI HISTOGRAM
+                    visual_treat['hist'][str(inFileBaseArray[index])] = (np.zeros(0, np.int64), np.zeros(0, np.int64))
+                if not args.quiet:
+                    print(f'Reading collapsed reads from the FASTA file {inFileBaseArray[index]}; trimming and UMI removal are skipped')
+                outlog.write(f'Reading collapsed reads from the FASTA file {inFileBaseArray[index]}; trimming and UMI removal are skipped\n')
+                if umi or args.umiDedup:
+                    print(f'WARNING: -umi and -udd are ignored for the collapsed reads of {inFileBaseArray[index]}')
+                    outlog.write(f'WARNING: -umi and -udd are ignored for the collapsed reads of {inFileBaseArray[index]}\n')
+            else:
+                fastq_blocks = read_ahead([fastq_chunks(laneFile, buffer_size, args.decompress_threads) for laneFile in laneFiles], threads*2)
+                shards = [] # THE SHARDS OF THE TRIMMED FASTQ WRITTEN BY THIS RUN, IN INPUT ORDER
+                if args.trim_fq_out:
+                    remove_shards(fo_tcf_fq) # LEFT BY AN EARLIER RUN THAT FAILED IN THE SAME OUTPUT DIRECTORY
+                for lane, fqres_pairs in trim_stream(pool.get(), fastq_blocks, threads*2, fo_tcf_fq, shards): # keeps at most 2 chunks per worker in flight
+                    count += fqres_pairs[1]
+                    laneCounts[lane] += fqres_pairs[1]
+                    visual_treat['rlen'][str(inFileBaseArray[index])] += fqres_pairs[2] # per chunk read length histograms are simply added
+                    trimmed += int(fqres_pairs[2].sum())
+                    completeDict.merge(fqres_pairs[0]) # Collapsing, i.e., counting the occurance of each read for each data 
+                    umi_missing += fqres_pairs[3]
+                if args.trim_fq_out:
+                    merge_shards(fo_tcf_fq, shards)
+            if qiagenumi and not collapsedInput:
+                umi_missing_pct = round(100.0 * umi_missing / count, 2) if count else 0
+                if not args.quiet:
+                    print(f'QIAseq UMI not found in {umi_missing} of {count} reads ({umi_missing_pct}%) for file {inFileBaseArray[index]}')
+                outlog.write(f'QIAseq UMI not found in {umi_missing} of {count} reads ({umi_missing_pct}%) for file {inFileBaseArray[index]}\n')
+            if umi and not collapsedInput and restored is None:
+                trimmed=0
+                umicompleteDict=new_store()
+                umi_cut = umi.split(",")
+                visual_treat['hist'][str(inFileBaseArray[index])] = np.unique(completeDict.counts(), return_counts=True)
+                pureSeqs = []
+                pureCounts = []
+                if not args.umiDedup and kernels.enabled:
+                    completeDict, trimmed = umi_trim_packed(completeDict, int(umi_cut[0]), int(umi_cut[1]), int(min_len), new_store())
+                    print("trimmed1:", trimmed)
+                    digestReadCounts = {inFileBaseArray[index]:trimmed}
+                elif not args.umiDedup:
+                    for s, c in completeDict.items():
+                        pureSeq, cutumiSeq = UMIParser(s, int(umi_cut[0]), int(umi_cut[1]))
+                        if len(pureSeq) >= int(min_len):
+                            pureSeqs.append(pureSeq)
+                            pureCounts.append(c)
                             trimmed += c
-                completeDict = umicompleteDict
-                print("trimmed1:", trimmed)
+                    umicompleteDict.add(pureSeqs, pureCounts)
+                    completeDict = umicompleteDict
+                    print("trimmed1:", trimmed)
+                    digestReadCounts = {inFileBaseArray[index]:trimmed}
+                elif args.umiDedup:
+                    temp_umiFile = Path(workDir)/(inFileBaseArray[index]+"_umiCounts.npz") # SEE umiNetwork.read_table()
+                    completeDict, trimmed = umiNetwork.dedup(completeDict, int(umi_cut[0]), int(umi_cut[1]), int(min_len), args.umi_method, temp_umiFile, umicompleteDict)
+                    print("trimmed2:", trimmed)
+                    digestReadCounts = {inFileBaseArray[index]:trimmed}
+            else:
+                print("trimmed3:", trimmed)
                 digestReadCounts = {inFileBaseArray[index]:trimmed}
-            elif args.umiDedup:
-                intermediate_umi = inFileBaseArray[index]+"_umiCounts.csv"
-                temp_umiFile = Path(workDir)/intermediate_umi
-                iumiFile = open(temp_umiFile,"a+")
-                iumiFile.write("UMISeq" + "," +"transcriptSeq," + "UMICounts" +"\n")
-                for s, c in completeDict.items():
-                    pureSeq, cutumiSeq = UMIParser(s, int(umi_cut[0]), int(umi_cut[1]))
-                    try:
-                        visual_treat['hist'][str(inFileBaseArray[index])].append(c)
-                    except KeyError:
-                        visual_treat['hist'][str(inFileBaseArray[index])] = [c]
-                    if len(pureSeq) >= int(min_len):
-                        iumiFile.write(str(cutumiSeq) + "," + str(pureSeq) + "," + str(c) +"\n")
-                        if pureSeq in umicompleteDict:
-                            umicompleteDict[pureSeq] += 1
-                            trimmed += 1
-                        else:
-                            umicompleteDict[pureSeq] = 1
-                            trimmed += 1
-                completeDict = umicompleteDict 
-                print("trimmed2:", trimmed)
-                digestReadCounts = {inFileBaseArray[index]:trimmed}
-                iumiFile.close()
-        else:
-            visual_treat['hist'][str(inFileBaseArray[index])] = []
-            print("trimmed3:", trimmed)
-            digestReadCounts = {inFileBaseArray[index]:trimmed}
-            # umi_seq = umi_seq[:umi_cut[1]]
-            # max_ad = 19 + int(umi_cut[1])
-            # umi_seq = umi_seq[:max_ad][-int(umi_cut[1]):]
-        uniqTrimmedReads = {inFileBaseArray[index]:len(completeDict)}
-        #digestReadCounts = {inFileBaseArray[index]:sum(completeDict.values())}
-        inputReadCounts = {inFileBaseArray[index]:count}
-        sampleReadCounts.update(inputReadCounts)
-        trimmedReadCounts.update(digestReadCounts)
-        trimmedReadCountsUnique.update(uniqTrimmedReads)
-        finish2 = time.perf_counter()
-        if not args.quiet:
-            print(f'Cutadapt finished for file {inFileBaseArray[index]} in {round(finish2-start, 4)} second(s)')
-        outlog.write(f'Cutadapt finished for file {inFileBaseArray[index]} in {round(finish2-start, 4)} second(s)\n')
-        """
-        CREATING PANDAS MATRIX FOR ALL THE SAMPLES THAT CAME THROUGH 
-        WILL BE EDITED TO A FUNCTION, ONCE UMI COMES IN PICTURE
-        """
-        if args.tcf_out:
-            fno = str(inFileBaseArray[index]) + '.trim.collapse.fa'
-            fo_tcf = Path(workDir)/fno
-            header_count = 1
-            with open(fo_tcf,'w') as fo:
-                for seqs in sorted(completeDict, key=completeDict.get, reverse=True):
-                    head_r = ">seq"+str(header_count)+"_"+str(completeDict[seqs])+"\n"
-                    fo.write(head_r)
-                    fo.write(str(seqs)+"\n")
-                    header_count+=1
-
-        collapsed_df = pd.DataFrame(list(completeDict.items()), columns=['Sequence', inFileBaseArray[index]])
-        collapsed_df.set_index('Sequence',inplace = True)
-        if len(inFileBaseArray) == 1:
-            complete_set = collapsed_df 
-            collapsed_df = pd.DataFrame() 
-        elif len(inFileBaseArray) > 1:
-            complete_set = complete_set.join(collapsed_df, how='outer')
-            collapsed_df = pd.DataFrame() 
-        complete_set = complete_set.fillna(0).astype(int)
-
-        finish3 = time.perf_counter()
-        if not args.quiet:
-            print(f'Collapsing finished for file {inFileBaseArray[index]} in {round(finish3-finish2, 4)} second(s)\n')
-        outlog.write(f'Collapsing finished for file {inFileBaseArray[index]} in {round(finish3-finish2, 4)} second(s)\n')
+                # umi_seq = umi_seq[:umi_cut[1]]
+                # max_ad = 19 + int(umi_cut[1])
+                # umi_seq = umi_seq[:max_ad][-int(umi_cut[1]):]
+            if ckPath is not None and restored is None and not args.umiDedup:
+                umiHist = visual_treat['hist'].get(str(inFileBaseArray[index]), (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)))
+                checkpoint.save(ckPath, completeDict, count=count, trimmed=trimmed, umi_missing=umi_missing, lane_counts=laneCounts, rlen=visual_treat['rlen'][str(inFileBaseArray[index])], umi_values=umiHist[0], umi_freqs=umiHist[1])
+            uniqTrimmedReads = {inFileBaseArray[index]:len(completeDict)}
+            #digestReadCounts = {inFileBaseArray[index]:sum(completeDict.values())}
+            inputReadCounts = {inFileBaseArray[index]:count}
+            sampleReadCounts.update(inputReadCounts)
+            if len(laneFiles) > 1:
+                laneReadCounts[inFileBaseArray[index]] = dict(zip([Path(laneFile).name for laneFile in laneFiles], laneCounts.tolist()))
+            trimmedReadCounts.update(digestReadCounts)
+            trimmedReadCountsUnique.update(uniqTrimmedReads)
+            finish2 = time.perf_counter()
+            if not args.quiet:
+                print(f'Cutadapt finished for file {inFileBaseArray[index]} in {round(finish2-start, 4)} second(s)')
+            outlog.write(f'Cutadapt finished for file {inFileBaseArray[index]} in {round(finish2-start, 4)} second(s)\n')
+            """
+            CREATING PANDAS MATRIX FOR ALL THE SAMPLES THAT CAME THROUGH 
+            WILL BE EDITED TO A FUNCTION, ONCE UMI COMES IN PICTURE
+            """
+            if args.tcf_out:
+                fno = str(inFileBaseArray[index]) + '.trim.collapse.fa'
+                fo_tcf = Path(workDir)/fno
+                header_count = 1
+                tcfSeqs, tcfCounts = completeDict.arrays()
+                with open(fo_tcf,'w') as fo:
+                    for seqIdx in np.argsort(-tcfCounts, kind='stable'):
+                        head_r = ">seq"+str(header_count)+"_"+str(tcfCounts[seqIdx])+"\n"
+                        fo.write(head_r)
+                        fo.write(str(tcfSeqs[seqIdx])+"\n")
+                        header_count+=1
+
+            sampleCounts.append(seqTable.intern(completeDict))
+            completeDict = None
+
+            finish3 = time.perf_counter()
+            if not args.quiet:
+                print(f'Collapsing finished for file {inFileBaseArray[index]} in {round(finish3-finish2, 4)} second(s)\n')
+            outlog.write(f'Collapsing finished for file {inFileBaseArray[index]} in {round(finish3-finish2, 4)} second(s)\n')
+            workerUsage = pool.usage()
+            sampleStage.update(reads=count, trimmed_reads=trimmed, unique_out=trimmedReadCountsUnique[inFileBaseArray[index]], checkpoint=restored is not None,
+                               worker_cpu_s=round(workerUsage[0] - workerCpu, 4), worker_peak_rss_mb=workerUsage[1])
+            metrics.end(sampleStage)
     
-    #complete_set['SeqLength'] = complete_set.index.str.len()
+    sequences, countMatrix = seqTable.matrix(sampleCounts)
+    seqTable = sampleCounts = None
     initialFlags = ['exact miRNA','hairpin miRNA','mature tRNA','primary tRNA','snoRNA','rRNA','ncrna others','mRNA','isomiR miRNA','spike-in'] # keeping other columns ready for next assignment
+    complete_set = pd.DataFrame({'annotFlag': np.zeros(len(sequences), dtype=int)}, index=pd.Index(sequences, name='Sequence'))
     complete_set = complete_set.assign(**dict.fromkeys(initialFlags, ''))
-    annotFlags = ['annotFlag']
-    complete_set = complete_set.assign(**dict.fromkeys(annotFlags, '0'))
-    #lengthCol = ['SeqLength']
-    finalColumns = annotFlags +initialFlags + inFileBaseArray # rearranging the columns as we want  
-    #finalColumns = lengthCol + annotFlags +initialFlags + inFileBaseArray # rearranging the columns as we want  
-    complete_set = complete_set.reindex(columns=finalColumns)
-    complete_set = complete_set.astype({"annotFlag": int})
+    counts_df = sparse_counts(countMatrix, complete_set.index, inFileBaseArray)
+    complete_set = pd.concat([complete_set, counts_df], axis=1) # annotFlag, initialFlags, then one count column per sample
+    countMatrix = counts_df = None
     finish4 = time.perf_counter()
     if not args.quiet:
         print(f'Matrix creation finished in {round(finish4-finish3, 4)} second(s)\n')
@@ -288,27 +408,14 @@ def baking(args, inFileArray, inFileBaseArray, workDir):
     div_idnum = 1
     for sample_files in inFileBaseArray:
         rlenDistID = "readLengthID_" + str(div_idnum)
-        val = visual_treat['rlen'][sample_files]
-        #print(sample_files)
-        maxVal = sorted(val)[-1]
-        minVal = sorted(val)[0]
-        hist, bins = np.histogram(val, bins=(maxVal-minVal))
-        hist = hist.tolist()
-        #print(hist, bins)
-        histData.readLenDist(rlenDistID, sample_files, str(hist), str(list(bins)))
+        rlen = visual_treat['rlen'][sample_files]
+        lengths = np.flatnonzero(rlen)
+        hist, bins = histogram_from_counts(lengths, rlen[lengths])
+        histData.readLenDist(rlenDistID, sample_files, str(hist), str(bins))
         if umi:
             umiDistID = "umiDivID_" + str(div_idnum)
-            val = visual_treat['hist'][sample_files]
-            #val = visual_treat['rlen'][sample_files]
-            #print(sample_files)
-            maxVal = sorted(val)[-1]
-            #maxVal = val.sort()[-1]
-            minVal = sorted(val)[0]
-            hist, bins = np.histogram(val, bins=(maxVal-minVal))
-            hist = hist.tolist()
-            bins = bins.tolist()
-            #print(hist, bins)
-            histData.sampleUMIDist(umiDistID, sample_files, str(hist), str(list(bins)))
+            hist, bins = histogram_from_counts(*visual_treat['hist'][sample_files])
+            histData.sampleUMIDist(umiDistID, sample_files, str(hist), str(bins))
         div_idnum += 1
     #print(visual_treat['hist'])
     EndTime = time.perf_counter()
@@ -316,7 +423,20 @@ def baking(args, inFileArray, inFileBaseArray, workDir):
         print(f'Data pre-processing completed in {round(EndTime-begningTime, 4)} second(s)\n')
     outlog.write(f'\nData pre-processing completed in {round(EndTime-begningTime, 4)} second(s)\n\n')
     outlog.close()
-    return(complete_set, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique)
+    return(complete_set, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique, laneReadCounts)
+
+
+def histogram_from_counts(values, freqs):
+    """
+    SAME AS np.histogram(val, bins=(maxVal-minVal)) OVER ALL THE OBSERVATIONS, BUT COMPUTED FROM THE DISTINCT VALUES AND 
+    THEIR FREQUENCIES, SO THAT THE OBSERVATIONS NEVER NEED TO BE EXPANDED INTO A LIST OR SORTED.
+    """
+    if len(values) == 0:
+        return [], []
+    minVal = int(values.min())
+    maxVal = int(values.max())
+    hist, bins = np.histogram(values, bins=max(maxVal-minVal, 1), weights=freqs)
+    return hist.astype(np.int64).tolist(), bins.tolist()
 
 
 def UMIParser(s, f, b):
@@ -333,54 +453,238 @@ def UMIParser(s, f, b):
     #return (front, center, end)
 
 
+collapsed_count = re.compile(r"^seq\d+_(\d+)$|_x(\d+)$") # >seqN_COUNT (--tcf-out) OR >NAME_xCOUNT (miRDeep2 COLLAPSED READS)
+
+
+def collapsed_fasta(FAfile, store=None, batch_size=1000000):
+    """
+    LOADS A FASTA FILE (OR FASTA.gz) STRAIGHT INTO A CollapsedStore, WITHOUT TRIMMING. THE READ COUNT OF EACH SEQUENCE IS TAKEN FROM 
+    ITS HEADER WHEN IT IS >seqN_COUNT, AS WRITTEN BY --tcf-out, OR >NAME_xCOUNT; ANY OTHER RECORD COUNTS AS ONE READ, SO A PLAIN 
+    FASTA OF TRIMMED READS IS COLLAPSED HERE. THE RECORDS ARE ADDED batch_size AT A TIME TO store (A NEW CollapsedStore BY DEFAULT).
+    """
+    store = CollapsedStore() if store is None else store
+    seqs = []
+    counts = []
+    with dnaio.open(FAfile, fileformat="fasta") as fa:
+        for record in fa:
+            found = collapsed_count.search(record.name.split(None, 1)[0]) if record.name else None
+            seqs.append(record.sequence.upper())
+            counts.append(int(found.group(1) or found.group(2)) if found else 1)
+            if len(seqs) >= batch_size:
+                store.add(seqs, counts)
+                seqs = []
+                counts = []
+    store.add(seqs, counts)
+    return store
+
+
+def umi_trim_packed(store, front, back, min_len, pureStore=None):
+    """
+    UMIParser AND THE MINIMUM LENGTH FILTER OVER ALL THE READS OF A CollapsedStore (--numba-pll). THE PACKED READS ARE CUT BY THE 
+    umi_center KERNEL WITHOUT BEING DECODED, ONE READ LENGTH AT A TIME; THE OVERFLOW GOES THROUGH UMIParser. 
+    RETURNS THE STORE OF THE READS WITHOUT THEIR UMI (pureStore, A NEW CollapsedStore BY DEFAULT), WITH THE SAME COUNTS, AND ITS NUMBER OF READS.
+    """
+    store.compact()
+    pureStore = CollapsedStore() if pureStore is None else pureStore
+    trimmed = 0
+    for length, (codes, counts) in store.packed.items():
+        centerLen = max(length - front - back, 0) # UMIParser KEEPS s[front:-back], OR s[front:] WHEN back IS 0
+        if centerLen < min_len:
+            continue
+        if centerLen == 0:
+            centers = np.zeros(len(codes), dtype=np.uint64)
+        else:
+            centers = kernels.umi_center(codes, np.uint64(2 * back), np.uint64((1 << (2 * centerLen)) - 1))
+        pureStore.add_packed(centerLen, centers, counts)
+        trimmed += int(counts.sum())
+    pureSeqs = []
+    pureCounts = []
+    for s, c in store.overflow.items():
+        pureSeq, cutumiSeq = UMIParser(s, front, back)
+        if len(pureSeq) >= min_len:
+            pureSeqs.append(pureSeq)
+            pureCounts.append(c)
+            trimmed += c
+    pureStore.add(pureSeqs, pureCounts)
+    return pureStore, trimmed
+
+
+def fastq_chunks(FQfile, buffer_size, decompress_threads=1):
+    """
+    YIELDS THE INPUT FASTQ (OR FASTQ.gz) AS RAW BYTE BLOCKS OF UP TO buffer_size BYTES, EACH ENDING ON A RECORD BOUNDARY.
+    THE BLOCKS ARE SENT TO THE WORKERS AS IS, THE PARSING TO Sequence OBJECTS HAPPENS IN THE WORKERS.
+    A .gz FILE IS DECOMPRESSED BY A pigz SUBPROCESS WITH decompress_threads THREADS WHEN pigz IS INSTALLED (0: ALWAYS THE gzip MODULE)
+    """
+    with xopen(FQfile, 'rb', threads=decompress_threads) as fq:
+        for chunk in dnaio.read_chunks(fq, buffer_size):
+            yield bytes(chunk)
+
+
+def read_ahead(chunkSources, depth):
+    """
+    RUNS EACH GENERATOR OF chunkSources (READING, DECOMPRESSING AND SPLITTING ONE INPUT FILE, E.G. ONE LANE OF A SAMPLE) ON ITS OWN 
+    READER THREAD. THEY ALL FEED ONE QUEUE THAT KEEPS UP TO depth BLOCKS READY, SO THAT THE PARENT ONLY SUBMITS BLOCKS AND MERGES RESULTS. 
+    zlib AND FILE READS RELEASE THE GIL, SO THE THREADS RUN AT THE SAME TIME. YIELDS (INDEX OF THE SOURCE, BLOCK) PAIRS. 
+    AN EXCEPTION IN A READER IS RE-RAISED HERE.
+    """
+    blocks = queue.Queue(maxsize=depth)
+    done = object()
+
+    def reader(source, chunks):
+        try:
+            for chunk in chunks:
+                blocks.put((source, chunk))
+            blocks.put((source, done))
+        except BaseException as e:
+            blocks.put((source, e))
+
+    for source, chunks in enumerate(chunkSources):
+        threading.Thread(target=reader, args=(source, chunks), name="fastq-reader-%d" % source, daemon=True).start()
+    remaining = len(chunkSources)
+    while remaining:
+        source, chunk = blocks.get()
+        if chunk is done:
+            remaining -= 1
+        elif isinstance(chunk, BaseException):
+            raise chunk
+        else:
+            yield source, chunk
+
+
+def trim_stream(executor, chunks, max_inflight, trim_fq=None, shards=None):
+    """
+    PRODUCER/CONSUMER LOOP: SUBMITS THE (source, chunk) PAIRS TO THE WORKERS, NEVER HOLDING MORE THAN max_inflight OF THEM AT ONCE, 
+    AND YIELDS (source, result) PAIRS AS SOON AS THE RESULTS ARE AVAILABLE. THIS KEEPS THE MEMORY FLAT IRRESPECTIVE OF THE FILE SIZE.
+    IF trim_fq IS GIVEN, EACH WORKER WRITES THE TRIMMED READS OF ITS CHUNK TO THE COMPRESSED SHARD trim_fq.partN, WHOSE PATH IS
+    APPENDED TO THE LIST shards IN INPUT ORDER FOR merge_shards()
+    """
+    pending = {}
+    for shard_num, (source, chunk) in enumerate(chunks):
+        shard = None
+        if trim_fq:
+            shard = str(trim_fq) + ".part%d" % shard_num
+            if shards is not None:
+                shards.append(shard)
+        pending[executor.submit(cutadapt, chunk, shard)] = source
+        if len(pending) >= max_inflight:
+            done, notDone = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    for future in concurrent.futures.as_completed(pending):
+        yield pending[future], future.result()
+
+
+def remove_shards(trim_fq):
+    """
+    REMOVES THE SHARDS OF trim_fq LEFT BY A RUN THAT DID NOT REACH merge_shards()
+    """
+    trim_fq = Path(trim_fq)
+    for shard in trim_fq.parent.glob(trim_fq.name + ".part*"):
+        os.remove(shard)
+
+
+def merge_shards(trim_fq, shards):
+    """
+    CONCATENATES THE GZIP shards WRITTEN BY THE WORKERS (THE LIST FILLED BY trim_stream(), IN INPUT ORDER) INTO ONE trim.fq.gz FILE AND
+    REMOVES THEM. A SEQUENCE OF GZIP MEMBERS IS ITSELF A VALID GZIP FILE, SO NOTHING IS RECOMPRESSED HERE.
+    """
+    with open(trim_fq, 'wb') as fq_out:
+        for shard in shards:
+            with open(shard, 'rb') as part:
+                shutil.copyfileobj(part, fq_out)
+            os.remove(shard)
+
+
 # THIS IS WHERE EVERYTHIHNG HAPPENS - Modifiers, filters etc...
-def cutadapt(fq):
-    readDict={}
+def trim_read(fqreads, modifiers):
+    """
+    RUNS THE cutadapt MODIFIERS ON ONE READ. RETURNS THE TRIMMED READ, THE SEQUENCE TO COLLAPSE (WITH THE QIAseq UMI APPENDED)
+    OR None IF IT IS SHORTER THAN THE MINIMUM LENGTH, AND WHETHER THE QIAseq UMI WAS MISSING (NO ADAPTER, OR THE READ ENDS BEFORE THE UMI).
+    """
+    matches=[]
+    currentSeq = fqreads.sequence
+    offset = 0 # START OF THE CURRENT READ WITHIN THE RAW READ
+    umi_start = None # END OF THE 3' ADAPTER IN THE RAW READ
+    for modifier in modifiers:
+        if modifier is front_trimmer:
+            start, stop = quality_trim_index(fqreads.qualities, modifier.cutoff_front, modifier.cutoff_back, modifier.base)
+            offset += start
+            fqreads = fqreads[start:stop]
+            continue
+        if modifier is exact_cutter:
+            # FOR SUCH AN ADAPTER cutadapt ITSELF LOOKS FOR AN EXACT OCCURRENCE (str.find) BEFORE FALLING BACK TO THE ALIGNER, AND TRIMS
+            # FROM ITS START. DOING THE SAME HERE SKIPS THE Match OBJECTS AND STATISTICS; ONLY READS WITHOUT A COMPLETE EXACT COPY OF
+            # THE ADAPTER GO TO THE ALIGNER, EXACTLY AS THEY WOULD IN cutadapt.
+            pos = fqreads.sequence.upper().find(exact_adapter)
+            if pos >= 0:
+                umi_start = offset + pos + len(exact_adapter)
+                fqreads = fqreads[:pos]
+                continue
+        fqreads = modifier(fqreads, matches)
+        if modifier is umi_cutter and matches:
+            umi_start = offset + umi_offset(matches[0])
+    final_seq = fqreads.sequence
+    umi_missing = False
+    if qiagenumi:
+        umi_seq = currentSeq[umi_start:umi_start + umi_len] if umi_start is not None else ""
+        umi_missing = len(umi_seq) < umi_len
+        final_seq = fqreads.sequence + umi_seq
+    if int(len(final_seq)) >= int(min_len):
+        return fqreads, str(final_seq), umi_missing
+    return fqreads, None, umi_missing
+
+
+def umi_offset(match):
+    """
+    POSITION RIGHT AFTER THE WHOLE 3' ADAPTER IN THE READ THAT WAS GIVEN TO THE AdapterCutter, FROM ITS Match: THE END OF THE ALIGNMENT 
+    PLUS THE PART OF THE ADAPTER THAT WAS NOT ALIGNED (BEYOND THE READ IF THE READ ENDS INSIDE THE ADAPTER). WITH ERRORS CLOSE TO THE 
+    END OF THE ADAPTER THE ALIGNER MAY REPORT A DELETION WHERE THERE IS A MISMATCH, SO IF THE WHOLE ADAPTER FITS AT rstart WITH NO MORE 
+    MISMATCHES THAN THE ALIGNMENT HAS ERRORS, THAT PLACEMENT IS USED.
+    """
+    adapter = match.adapter.sequence
+    if match.errors:
+        window = match.read.sequence[match.rstart:match.rstart + len(adapter)].upper()
+        if len(window) == len(adapter) and sum(1 for a, b in zip(window, adapter) if a != b) <= match.errors:
+            return match.rstart + len(adapter)
+    return match.rstop + len(adapter) - match.astop
+
+
+def trim_sequence(sequence):
+    """
+    trim_read() FOR A READ WHOSE QUALITIES CANNOT CHANGE THE RESULT; WRAPPED IN A PER-WORKER LRU CACHE BY init_worker()
+    """
+    return trim_read(dnaio.Sequence("", sequence), cached_ingredients)[1:]
+
+
+@profiling.sampled
+def cutadapt(chunk, shard=None):
+    """
+    TRIMS AND COLLAPSES ONE CHUNK OF RAW FASTQ. RETURNS THE COLLAPSED READS AS A CollapsedStore, THE NUMBER OF INPUT READS,
+    THE HISTOGRAM OF TRIMMED READ LENGTHS (rlen_bins WIDE) AND THE NUMBER OF READS WITHOUT A QIAseq UMI FOR THE CHUNK.
+    """
+    trimmedSeqs=[]
     readDict_raw=[]
-    for fqreads in fq:
-        matches=[]
-        if qiagenumi:
-            currentSeq = fqreads.sequence
-            umi_seq = ""
-            for modifier in ingredients:
-                fqreads = modifier(fqreads, matches)
-            try:
-                umi_seq = currentSeq.split(str(fqreads.sequence))[1]
-                umi_cut = umi.split(",")
-                max_ad = len(qiaAdapter) + int(umi_cut[1])
-                umi_seq = umi_seq[:max_ad][-int(umi_cut[1]):]
-            except ValueError:
-                umi_seq = ""
-                #if qiaAdapter in currentSeq:
-                    #umi_seq = currentSeq.split(str(qiaAdapter))[1]
-                    #umi_cut = umi.split(",")
-                    #max_ad = len(qiaAdapter) + int(umi_cut[1])
-                    #umi_seq = umi_seq[:max_ad][-int(umi_cut[1]):]
-                #else:
-                #umi_seq = ""
-            final_seq = fqreads.sequence + umi_seq
-            if int(len(final_seq)) >= int(min_len):
-                readDict_raw.append('@'+fqreads.name+'\n' +
-                                    fqreads.sequence+'\n' +
-                                    '+\n' +
-                                    fqreads.qualities + '\n')
-                if str(final_seq) in readDict:
-                    readDict[str(final_seq)]+=1
-                else:
-                    readDict[str(final_seq)]=1
+    count=0
+    umi_missing=0
+    use_cache = trim_cached is not None and not shard # THE TRIMMED FASTQ NEEDS THE TRIMMED QUALITIES, NOT ONLY THE SEQUENCE
+    for fqreads in dnaio.FastqReader(io.BytesIO(chunk)):
+        count+=1
+        if use_cache and fqreads.qualities and min(fqreads.qualities) >= min_quality:
+            final_seq, no_umi = trim_cached(fqreads.sequence)
         else:
-            for modifier in ingredients:
-                fqreads = modifier(fqreads, matches)
-            if int(len(fqreads.sequence)) >= int(min_len):
-                # print(fqreads)
-                # <Sequence(name='TPNB500295:441:HJ2H3BGXG:1:11301:22790:10866 1:N:0:GTACTA', sequence='TAGACGGGCTCA', qualities='AAA/AEEEEEEE')>
+            fqreads, final_seq, no_umi = trim_read(fqreads, ingredients)
+            if shard and final_seq is not None:
                 readDict_raw.append('@'+fqreads.name+'\n' +
                                     fqreads.sequence+'\n' +
                                     '+\n' +
                                     fqreads.qualities + '\n')
-                if str(fqreads.sequence) in readDict:
-                    readDict[str(fqreads.sequence)]+=1
-                else:
-                    readDict[str(fqreads.sequence)]=1
-    trimmed_pairs = list(readDict.items())
-    return trimmed_pairs, readDict_raw
+        if final_seq is not None:
+            trimmedSeqs.append(final_seq)
+        umi_missing += no_umi
+    if shard:
+        with open(shard, 'wb') as shard_out:
+            shard_out.write(gzip.compress(''.join(readDict_raw).encode(), compresslevel=compression_level))
+    readStore = CollapsedStore()
+    readStore.add(trimmedSeqs)
+    readStore.compact()
+    return readStore, count, readStore.length_histogram(rlen_bins), umi_missing
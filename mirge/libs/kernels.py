@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+"""
+numba KERNELS FOR THE PURE PYTHON LOOPS OF miRge3.0, SWITCHED ON WITH --numba-pll.
+EACH KERNEL IS WRITTEN AS A PLAIN PYTHON LOOP OVER numpy ARRAYS AND IS COMPILED BY numba (nopython, WITHOUT THE GIL) WHEN numba IS
+INSTALLED. THE CALLERS KEEP THEIR ORIGINAL PYTHON CODE AS THE FALLBACK, WHICH IS USED WHEN --numba-pll IS OFF OR numba IS MISSING.
+tests/test_kernels.py CHECKS THAT THE KERNELS AND THE FALLBACKS GIVE THE SAME RESULTS ON FIXED INPUTS, benchmarks/bench_kernels.py ON LARGER
+ONES, WITH TIMINGS. --numba-cuda IS NOT IMPLEMENTED.
+"""
+
+enabled = False # SET BY enable(): --numba-pll WAS GIVEN AND numba CAN BE IMPORTED
+prange = numba.prange if numba is not None else range
+
+
+def jit(parallel=False):
+    """
+    DECORATOR: COMPILES THE KERNEL WITH numba WHEN IT IS INSTALLED, OTHERWISE LEAVES THE PYTHON FUNCTION AS IT IS
+    """
+    def compile_kernel(func):
+        if numba is None:
+            return func
+        return numba.njit(cache=True, nogil=True, parallel=parallel)(func)
+    return compile_kernel
+
+
+def enable(flag):
+    """
+    TURNS THE KERNELS ON (--numba-pll); WITHOUT numba A WARNING IS PRINTED AND THE PYTHON CODE IS USED
+    """
+    global enabled
+    if flag and numba is None:
+        print("WARNING: --numba-pll requires numba (pip install numba); continuing without the compiled kernels")
+    enabled = bool(flag) and numba is not None
+    return enabled
+
+
+def byte_matrix(seqs):
+    """
+    THE SEQUENCES AS A ROWS x max(len) uint8 MATRIX, PADDED WITH 0, AND THEIR LENGTHS; THIS IS THE INPUT OF THE KERNELS BELOW
+    """
+    lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=len(seqs))
+    bases = np.zeros((len(seqs), int(lengths.max()) if len(seqs) else 0), dtype=np.uint8)
+    for row, seq in enumerate(seqs):
+        bases[row, :lengths[row]] = np.frombuffer(seq.encode(), dtype=np.uint8)
+    return bases, lengths
+
+
+@jit()
+def umi_center(codes, shift, mask):
+    """
+    UMIParser ON 2-BIT PACKED READS (SEE classes/collapsedStore.py): DROPS THE 3' UMI (THE LOWEST shift BITS) AND KEEPS THE
+    INSERT BITS SELECTED BY mask, WHICH REMOVES THE 5' UMI. shift AND mask ARE np.uint64.
+    """
+    centers = np.empty(codes.shape[0], dtype=np.uint64)
+    for idx in range(codes.shape[0]):
+        centers[idx] = (codes[idx] >> shift) & mask
+    return centers
+
+
+@jit(parallel=True)
+def pair_distances(bases, starts, ends):
+    """
+    THE tRF CLUSTERING DISTANCE OF getDistance() FOR ALL PAIRS OF ALIGNED READS (ROWS OF bases, ALL OF THE SAME LENGTH):
+    |start1-start2| + |end1-end2| + THE NUMBER OF COLUMNS WHERE BOTH READS HAVE A BASE (NOT '-') AND THE BASES DIFFER
+    """
+    rows, width = bases.shape
+    distances = np.zeros((rows, rows), dtype=np.float64)
+    gap = 45 # '-'
+    for i in prange(rows):
+        for j in range(i + 1, rows):
+            substiCount = 0
+            for k in range(width):
+                if bases[i, k] != gap and bases[j, k] != gap and bases[i, k] != bases[j, k]:
+                    substiCount += 1
+            distance = abs(starts[i] - starts[j]) + abs(ends[i] - ends[j]) + substiCount
+            distances[i, j] = distance
+            distances[j, i] = distance
+    return distances
+
+
+@jit()
+def base_changes(target, bases, lengths, start, stop, fromBase, toBase):
+    """
+    PER-POSITION BASE COMPARISON OF A2IEditing() AND mismatchCountAnalysis(): FLAGS THE ALIGNMENT COLUMNS start..stop-1 WHERE THE
+    ALIGNED target HAS fromBase AND THE READ (ROW OF bases, OF lengths[row] BASES) HAS toBase. RETURNS A ROWS x COLUMNS BOOLEAN MATRIX.
+    """
+    hits = np.zeros((bases.shape[0], max(stop - start, 0)), dtype=np.bool_)
+    for row in range(bases.shape[0]):
+        for col in range(start, min(stop, lengths[row], target.shape[0])):
+            if target[col] == fromBase and bases[row, col] == toBase:
+                hits[row, col - start] = True
+    return hits
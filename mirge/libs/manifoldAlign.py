@@ -4,68 +4,129 @@ import pandas as pd
 import time
 import os
 import re
+import threading
 import concurrent.futures
+import numpy as np
 
 from mirge.libs.miRgeEssential import UID
+from mirge.libs import metrics
+from mirge.libs import annotationCache
 
+# SAM FILES OF THE ALIGNMENTS OF EACH bwtAlign() ITERATION, FOR -bam (bamFmt.py) AND FOR -trf (summarize())
+bamSamNames = {0: "miRge3_miRNA.sam", 8: "miRge3_miRNA.sam", 1: "miRge3_hairpin_miRNA.sam", 4: "miRge3_snorna.sam", 5: "miRge3_rrna.sam", 6: "miRge3_ncrna_others.sam", 7: "miRge3_mrna.sam"}
+trnaSamNames = {2: "miRge3_tRNA.sam", 3: "miRge3_pre_tRNA.sam"}
+read_buffer = 1 << 20 # BYTES OF THE PIPE BUFFERS OF alignPlusParse()
+query_block = 1 << 20 # BYTES OF FASTA PER WRITE TO THE STANDARD INPUT OF bowtie
 
-def alignPlusParse(bwtExec, iter_number, pdDataFrame, args, workDir):
+
+def query_blocks(rows, queries):
+    """
+    THE READS OF A bowtie RUN AS FASTA, IN BLOCKS OF ABOUT query_block BYTES: THE NAME OF EACH READ IS ITS POSITION IN rows (0, 1, ...)
+    """
+    block = []
+    size = 0
+    for queryId, query in enumerate(queries):
+        record = b">%d\n%s\n" % (queryId, query.encode())
+        block.append(record)
+        size += len(record)
+        if size >= query_block:
+            yield b"".join(block)
+            block = []
+            size = 0
+    if block:
+        yield b"".join(block)
+
+
+def feed(stdin, blocks):
+    """
+    WRITES THE blocks TO THE STANDARD INPUT OF bowtie AND CLOSES IT; RUNS IN A THREAD, WHILE alignPlusParse() READS THE OUTPUT.
+    IF bowtie STOPS EARLY, THE WRITING STOPS AND THE EXIT STATUS OF bowtie TELLS WHAT HAPPENED
+    """
+    try:
+        for block in blocks:
+            stdin.write(block)
+        stdin.close()
+    except (BrokenPipeError, ValueError):
+        pass
+
+
+def sam_output(args, workDir, iter_number):
+    """
+    THE SAM FILE OF THE ALIGNMENTS OF THE ITERATION iter_number OF bwtAlign(), OR None IF NONE IS WRITTEN
+    """
+    if args.tRNA_frag and iter_number in trnaSamNames:
+        return Path(workDir)/trnaSamNames[iter_number]
+    if args.bam_out and iter_number in bamSamNames:
+        return Path(workDir)/bamSamNames[iter_number]
+    return None
+
+
+def alignPlusParse(bwtExec, iter_number, pdDataFrame, args, workDir, rows, queries, cachedSam=(), samTails=None):
     """
     ALIGN TO BOWTIE, PARSE SAM FILE AND UPDATE THE DATAFRAME
+    THE READS queries (THE SEQUENCES TO ALIGN OF THE ROWS rows OF THE DATAFRAME) ARE WRITTEN TO THE STANDARD INPUT OF bowtie BY A THREAD,
+    NAMED BY THEIR POSITION IN rows, AND THE SAM OUTPUT IS READ FROM ITS STANDARD OUTPUT LINE BY LINE, AS BYTES, WHILE bowtie RUNS:
+    NEITHER IS EVER HELD IN MEMORY AS A WHOLE OR WRITTEN TO A FILE
+    cachedSam ARE THE SAM LINES OF THE READS ANNOTATED FROM THE ANNOTATION CACHE, WRITTEN TO THE SAM FILE OF THE ITERATION FIRST; samTails,
+    A DICTIONARY, GETS THE SAM RECORDS OF EACH ALIGNED ROW WITHOUT THE READ NAME, FOR THE CACHE. WITH NO READ LEFT TO ALIGN, bowtie IS NOT RUN
     """
     #indexNames = ['_mirna_', '_hairpin_', '_mature_trna', '_pre_trna', '_snorna', '_rrna', '_ncrna_others', '_mrna', '_mirna_', '_spike-in']
     colnames = list(pdDataFrame.columns)
     colToAct = 1 + int(iter_number)
+    samFile = sam_output(args, workDir, iter_number)
+    bwto = open(samFile, "ab") if samFile is not None else None
+    if bwto is not None:
+        bwto.writelines(cachedSam)
+    if len(rows) == 0:
+        if bwto is not None:
+            bwto.close()
+        return pdDataFrame
     print("[CMD:]", bwtExec)
-    bowtie = subprocess.run(str(bwtExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
-    if args.bam_out: 
-        if iter_number == 0 or iter_number == 8:
-            bwtoutput = Path(workDir)/"miRge3_miRNA.sam"
-            bwto = open(bwtoutput, "a+")
-        elif iter_number == 1:
-            bwtoutput = Path(workDir)/"miRge3_hairpin_miRNA.sam"
-            bwto = open(bwtoutput, "a+")
-        elif iter_number == 4: 
-            bwtoutput = Path(workDir)/"miRge3_snorna.sam"
-            bwto = open(bwtoutput, "a+")
-        elif iter_number == 5:
-            bwtoutput = Path(workDir)/"miRge3_rrna.sam" 
-            bwto = open(bwtoutput, "a+")
-        elif iter_number == 6:
-            bwtoutput = Path(workDir)/"miRge3_ncrna_others.sam" 
-            bwto = open(bwtoutput, "a+")
-        elif iter_number == 7:
-            bwtoutput = Path(workDir)/"miRge3_mrna.sam" 
-            bwto = open(bwtoutput, "a+")
-    if args.tRNA_frag:
-        if iter_number == 2:
-            bwtoutput = Path(workDir)/"miRge3_tRNA.sam"
-            bwto = open(bwtoutput, "a+")
-        elif iter_number == 3:
-            bwtoutput = Path(workDir)/"miRge3_pre_tRNA.sam"
-            bwto = open(bwtoutput, "a+")
+    sequences = pdDataFrame.index.values
+    hitIds = [] # READ ID AND REFERENCE OF EVERY ALIGNMENT, APPLIED TO THE DATAFRAME ONCE bowtie IS DONE
+    refs = []
+    try:
+        with metrics.popen(bwtExec, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=read_buffer) as bowtie:
+            writer = threading.Thread(target=feed, args=(bowtie.stdin, query_blocks(rows, queries)), daemon=True)
+            writer.start()
+            for srow in bowtie.stdout:
+                if srow.startswith(b'@'):
+                    continue
+                sam_line = srow.split(b'\t', 3)
+                if len(sam_line) > 2 and sam_line[2] != b"*":
+                    queryId = int(sam_line[0])
+                    hitIds.append(queryId)
+                    refs.append(sam_line[2])
+                    if bwto is not None or samTails is not None: # THE SAM FILES NAME THE READS BY THEIR SEQUENCE
+                        tail = srow[len(sam_line[0]):].rstrip(b'\n')
+                        if bwto is not None: # THE SPIKE-INS ARE NEVER WRITTEN
+                            bwto.write(sequences[rows[queryId]].encode() + tail + b'\n')
+                        if samTails is not None:
+                            samTails.setdefault(rows[queryId], []).append(tail)
+            writer.join()
+    finally:
+        if bwto is not None:
+            bwto.close()
+    apply_hits(pdDataFrame, colnames[colToAct], np.asarray(rows)[np.asarray(hitIds, dtype=np.int64)], refs)
+    return pdDataFrame
 
-    if bowtie.returncode==0:
-        bwtOut = bowtie.stdout
-        bwtErr = bowtie.stderr
-    for srow in bwtOut.split('\n'):
-        if not srow.startswith('@'):
-            sam_line = srow.split('\t')
-            if sam_line != ['']:
-                if sam_line[2] != "*":
-                    pdDataFrame.at[sam_line[0], colnames[colToAct]] = sam_line[2]
-                    pdDataFrame.at[sam_line[0], colnames[0]] = 1
-                    if iter_number != 2 and iter_number != 3 and iter_number != 9: #tRNA and pre_tRNA and spike-ins are ignored 
-                        if args.bam_out:
-                            bwto.write(srow+"\n")
-                    elif args.tRNA_frag:
-                        if iter_number != 9:
-                            bwto.write(srow+"\n")
 
+def apply_hits(pdDataFrame, column, hitRows, refs):
+    """
+    ANNOTATES THE ALIGNED READS OF ONE bowtie RUN IN PLACE, WITH ONE ASSIGNMENT PER COLUMN: column GETS THE REFERENCE AND annotFlag
+    (THE FIRST COLUMN) 1. hitRows AND refs ARE THE ROW POSITIONS OF THE READS AND THE REFERENCES (bytes) OF THE ALIGNMENTS, IN THE ORDER
+    OF THE SAM OUTPUT. A READ WITH SEVERAL ALIGNMENTS (-a) GETS THE REFERENCE OF THE LAST ONE bowtie REPORTED, AS WITH THE FORMER CELL BY
+    CELL UPDATE
+    """
+    if len(hitRows) == 0:
+        return pdDataFrame
+    hitRows = np.asarray(hitRows, dtype=np.int64)
+    last = len(hitRows) - 1 - np.unique(hitRows[::-1], return_index=True)[1] # THE LAST ALIGNMENT OF EACH READ
+    pdDataFrame.iloc[hitRows[last], pdDataFrame.columns.get_loc(column)] = [refs[hit].decode() for hit in last]
+    pdDataFrame.iloc[hitRows[last], 0] = 1
     return pdDataFrame
 
 
-
 def bwtAlign(args,pdDataFrame,workDir,ref_db):
     """
     THIS FUNCTION COLLECTS DATAFRAME AND USER ARGUMENTS TO MAP TO VARIOUS DATABASES USING BOWTIE. CALLED FIRST AND ONCE. 
@@ -74,7 +135,6 @@ def bwtAlign(args,pdDataFrame,workDir,ref_db):
     threads = args.threads
     begningTime = time.perf_counter()
     bwtCommand = Path(args.bowtie_path)/"bowtie " if args.bowtie_path else "bowtie "
-    bwtInput = Path(workDir)/"bwtInput.fasta"
     runlogFile = Path(workDir)/"run.log"
     outlog = open(str(runlogFile),"a+")
     if not args.quiet:
@@ -86,58 +146,75 @@ def bwtAlign(args,pdDataFrame,workDir,ref_db):
         iterations = 10
     else:
         iterations = 9
+    indexFiles = []
     for bwt_iter in range(iterations):
-        if bwt_iter == 0:
-            with open(bwtInput, 'w') as wseq:
-                for sequences in (pdDataFrame.index[pdDataFrame.index.str.len() < 26]):
-                    wseq.write(">"+str(sequences)+"\n")
-                    wseq.write(str(sequences)+"\n")
-
+        if bwt_iter == 0 or bwt_iter == 1 or bwt_iter == 8:
             indexName  = str(args.organism_name) + str(indexNames[bwt_iter]) + str(ref_db)
-            indexFiles = Path(args.libraries_path)/args.organism_name/"index.Libs"/indexName
-            bwtExec = str(bwtCommand) + " " + str(indexFiles) + str(parameters[bwt_iter]) + str(args.threads) + " " + str(bwtInput) 
-            alignPlusParse(bwtExec, bwt_iter, pdDataFrame, args, workDir)
-        
+        else:
+            indexName  = str(args.organism_name) + str(indexNames[bwt_iter])
+        indexFiles.append(Path(args.libraries_path)/args.organism_name/"index.Libs"/indexName)
+    # THE READS FOUND IN THE ANNOTATION CACHE GET THEIR ANNOTATION AND SAM RECORDS FROM IT; ONLY THE fresh ONES GO TO bowtie
+    cache = annotationCache.open_cache(args, ref_db, indexFiles, parameters[:iterations], bwtCommand)
+    fresh = np.ones(len(pdDataFrame), dtype=bool)
+    cachedSam = {}
+    if cache is not None:
+        entries = cache.lookup(pdDataFrame.index)
+        cachedRows = np.flatnonzero(entries >= 0)
+        fresh[cachedRows] = False
+        stages = cache.stages[entries[cachedRows]]
+        sequences = pdDataFrame.index.values
+        for bwt_iter in range(iterations):
+            stageRows = cachedRows[stages == bwt_iter]
+            if len(stageRows) == 0:
+                continue
+            pdDataFrame.iloc[stageRows, 1 + bwt_iter] = cache.refs[entries[stageRows]]
+            pdDataFrame.iloc[stageRows, 0] = 1
+            if sam_output(args, workDir, bwt_iter) is not None:
+                cachedSam[bwt_iter] = [(sequences[row] + tail + "\n").encode() for row in stageRows for tail in cache.sams[entries[row]].split("\n")]
+        cacheLog = f'Annotation cache: {len(cachedRows)} of {len(pdDataFrame)} unique reads found in {cache.path}\n'
+        if not args.quiet:
+            print(cacheLog, end='')
+        outlog.write(cacheLog)
+    samTails = {} if cache is not None else None
+    hitRows = {} # THE fresh ROWS ANNOTATED BY EACH ITERATION
+    for bwt_iter in range(iterations):
+        # THE ROWS OF THE DATAFRAME TO ALIGN AND THEIR SEQUENCES, STREAMED TO bowtie (READS FILE "-": ITS STANDARD INPUT)
+        if bwt_iter == 0:
+            rows = np.flatnonzero((pdDataFrame.index.str.len() < 26) & fresh)
         elif bwt_iter == 1:
-            with open(bwtInput, 'w') as wseq: 
-                for sequences in (pdDataFrame.index[pdDataFrame.index.str.len() > 25]):
-                    wseq.write(">"+str(sequences)+"\n")
-                    wseq.write(str(sequences)+"\n")
-
-            indexName  = str(args.organism_name) + str(indexNames[bwt_iter]) + str(ref_db)
-            indexFiles = Path(args.libraries_path)/args.organism_name/"index.Libs"/indexName
-            bwtExec = str(bwtCommand) + " " + str(indexFiles) + str(parameters[bwt_iter]) + str(args.threads) + " " + str(bwtInput) 
-            alignPlusParse(bwtExec, bwt_iter, pdDataFrame, args, workDir)
-
+            rows = np.flatnonzero((pdDataFrame.index.str.len() > 25) & fresh)
         else:
-            if bwt_iter == 8: 
-                indexName  = str(args.organism_name) + str(indexNames[bwt_iter]) + str(ref_db)
-            else:
-                indexName  = str(args.organism_name) + str(indexNames[bwt_iter])
-            if bwt_iter == 3:
-                with open(bwtInput, 'w') as wseq:
-                    for sequences in (pdDataFrame.index[pdDataFrame.annotFlag.eq(0)]):
-                        try:
-                            footer = sequences[:(re.search('T{3,}$', sequences).span(0)[0])]
-                            wseq.write(">"+str(sequences)+"\n")
-                            wseq.write(str(footer)+"\n")
-                        except AttributeError:
-                            pass
-            else:
-                with open(bwtInput, 'w') as wseq:
-                    for sequences in (pdDataFrame.index[pdDataFrame.annotFlag.eq(0)]):
-                        wseq.write(">"+str(sequences)+"\n")
-                        wseq.write(str(sequences)+"\n")
-
-            indexFiles = Path(args.libraries_path)/args.organism_name/"index.Libs"/indexName
-            bwtExec = str(bwtCommand) + " " + str(indexFiles) + str(parameters[bwt_iter]) + str(args.threads) + " " + str(bwtInput) 
-            alignPlusParse(bwtExec, bwt_iter, pdDataFrame, args, workDir)
+            rows = np.flatnonzero(pdDataFrame.annotFlag.eq(0).values & fresh)
+        queries = pdDataFrame.index.values[rows]
+        if bwt_iter == 3: # THE READS ENDING WITH A STRETCH OF T, WITHOUT IT
+            footers = pd.Series(queries).str.extract('^(.*?)T{3,}$', expand=False)
+            rows = rows[footers.notna().values]
+            queries = footers.dropna().values
+        bwtExec = str(bwtCommand) + " " + str(indexFiles[bwt_iter]) + str(parameters[bwt_iter]) + str(args.threads) + " -"
+        alignPlusParse(bwtExec, bwt_iter, pdDataFrame, args, workDir, rows, queries, cachedSam.get(bwt_iter, ()), samTails)
+        hitRows[bwt_iter] = rows[pdDataFrame.annotFlag.values[rows] == 1]
+    if cache is not None:
+        freshRows = np.flatnonzero(fresh)
+        stages = np.full(len(freshRows), -1, dtype=np.int8)
+        refs = np.full(len(freshRows), '', dtype=object)
+        for bwt_iter, rows in hitRows.items():
+            positions = np.searchsorted(freshRows, rows)
+            stages[positions] = bwt_iter
+            refs[positions] = pdDataFrame.iloc[rows, 1 + bwt_iter].values
+        cache.add(pdDataFrame.index.values[freshRows], stages, refs, [b"\n".join(samTails.get(row, ())).decode() for row in freshRows])
+        try:
+            cacheLog = f'Annotation cache: {len(freshRows)} unique reads added, {cache.save()} in {cache.path}\n'
+        except OSError as e:
+            cacheLog = f'Annotation cache: not updated, {e}\n'
+        if not args.quiet:
+            print(cacheLog, end='')
+        outlog.write(cacheLog)
     finish = time.perf_counter()
     if not args.spikeIn:
         pdDataFrame = pdDataFrame.drop(columns=['spike-in'])
     
-    os.remove(bwtInput)
-    pdDataFrame = pdDataFrame.fillna('')
+    annotCols = pdDataFrame.select_dtypes(include=object).columns # THE SPARSE SAMPLE COUNTS HAVE NO MISSING VALUES
+    pdDataFrame[annotCols] = pdDataFrame[annotCols].fillna('')
     if not args.quiet:
         print(f'Alignment completed in {round(finish-begningTime, 4)} second(s)\n')
     outlog.write(f'Alignment completed in {round(finish-begningTime, 4)} second(s)\n')
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+import contextlib
+from pathlib import Path
+
+"""
+MACHINE READABLE PERFORMANCE METRICS OF A RUN, WRITTEN AS JSON LINES TO run.metrics.jsonl IN THE OUTPUT DIRECTORY (NEXT TO run.log).
+EACH LINE IS ONE RECORD WITH A "type":
+    run         ONCE AT THE START: COMMAND LINE, NUMBER OF CPUs, THREADS
+    stage       ONE PER STAGE (trimming, alignment, summary, novel_mirna, ...) AND PER SAMPLE WHERE THE STAGE WORKS SAMPLE BY SAMPLE:
+                wall_s, cpu_s (THIS PROCESS AND ITS FINISHED CHILDREN, E.G. THE TRIMMING WORKERS AND bowtie), peak_rss_mb (HIGHEST
+                RESIDENT SET SO FAR OF THIS PROCESS AND OF ITS LARGEST FINISHED CHILD), reads, reads_per_s, unique_in, unique_out
+    subprocess  ONE PER EXTERNAL COMMAND (bowtie, samtools, RNAfold, ...): tool, command, wall_s, exit_status, AND THE STAGE AND SAMPLE
+                IT RAN IN
+    end         ONCE AT THE END: TOTAL wall_s AND cpu_s
+NOTHING IS WRITTEN UNTIL start() IS CALLED, SO THE LIBRARY FUNCTIONS CAN BE USED WITHOUT A METRICS FILE.
+"""
+
+metricsFile = None
+stages = [] # THE OPEN stage() RECORDS, INNERMOST LAST
+runStart = None
+
+
+def start(path, args=None):
+    """
+    STARTS THE METRICS OF A RUN: TRUNCATES path AND WRITES THE run RECORD
+    """
+    global metricsFile, runStart
+    metricsFile = Path(path)
+    metricsFile.write_text("")
+    runStart = (time.perf_counter(), cpu_seconds())
+    record("run", argv=sys.argv, cpus=os.cpu_count(), threads=getattr(args, "threads", None), pid=os.getpid())
+
+
+def finish():
+    """
+    WRITES THE end RECORD OF THE RUN
+    """
+    if metricsFile is None or runStart is None:
+        return
+    record("end", wall_s=round(time.perf_counter() - runStart[0], 4), cpu_s=round(cpu_seconds() - runStart[1], 4), peak_rss_mb=peak_rss_mb())
+
+
+def record(recordType, **fields):
+    """
+    APPENDS ONE JSON LINE; A NO-OP BEFORE start()
+    """
+    if metricsFile is None:
+        return
+    line = {"type": recordType, "time": round(time.time(), 3)}
+    line.update(fields)
+    with open(metricsFile, "a") as fout:
+        fout.write(json.dumps(line, default=str) + "\n")
+
+
+def cpu_seconds():
+    """
+    USER + SYSTEM CPU TIME OF THIS PROCESS AND OF ITS CHILDREN THAT HAVE BEEN WAITED FOR
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def peak_rss_mb():
+    """
+    HIGHEST RESIDENT SET SIZE SO FAR, IN MB, OF THIS PROCESS OR OF ITS LARGEST FINISHED CHILD (ru_maxrss IS IN KB ON LINUX, BYTES ON macOS)
+    """
+    scale = 1 << 20 if sys.platform == "darwin" else 1 << 10
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / scale, 1)
+
+
+def begin(name, sample=None, **fields):
+    """
+    OPENS THE STAGE name (OF ONE sample); RETURNS ITS RECORD, A dict WHERE THE CALLER CAN ADD reads, unique_in, unique_out, ... 
+    AND THAT end() COMPLETES AND WRITES
+    """
+    info = {"stage": name, "sample": sample}
+    info.update(fields)
+    info["_start"] = (time.perf_counter(), cpu_seconds())
+    stages.append(info)
+    return info
+
+
+def end(info):
+    """
+    CLOSES A STAGE OPENED BY begin(): ADDS ITS WALL AND CPU TIME, THE PEAK RSS AND THE READS PER SECOND, AND WRITES IT
+    """
+    if info in stages:
+        stages.remove(info)
+    wallStart, cpuStart = info.pop("_start")
+    wall = time.perf_counter() - wallStart
+    info["wall_s"] = round(wall, 4)
+    info["cpu_s"] = round(cpu_seconds() - cpuStart, 4)
+    info["peak_rss_mb"] = peak_rss_mb()
+    if info.get("reads") is not None:
+        info["reads_per_s"] = round(info["reads"] / wall, 1) if wall > 0 else None
+    record("stage", **info)
+
+
+def pool_usage(executor):
+    """
+    CPU SECONDS SO FAR AND HIGHEST PEAK RSS (MB) OF THE LIVE WORKERS OF A ProcessPoolExecutor, READ FROM /proc (LINUX ONLY, (0, 0) ELSEWHERE).
+    RUSAGE_CHILDREN ONLY COUNTS THE WORKERS ONCE THE POOL HAS SHUT DOWN, WHICH IS TOO LATE FOR THE PER-SAMPLE STAGES OF baking()
+    """
+    cpu = rss = 0.0
+    for pid in list(getattr(executor, "_processes", None) or {}):
+        try:
+            with open("/proc/%d/stat" % pid) as fin:
+                fields = fin.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+            with open("/proc/%d/status" % pid) as fin:
+                for line in fin:
+                    if line.startswith("VmHWM:"):
+                        rss = max(rss, int(line.split()[1]) / 1024)
+        except (OSError, ValueError, IndexError):
+            pass
+    return cpu, round(rss, 1)
+
+
+@contextlib.contextmanager
+def stage(name, sample=None, **fields):
+    """
+    begin() AND end() AROUND THE BODY OF A with BLOCK, WHICH GETS THE RECORD; ON AN EXCEPTION THE RECORD IS WRITTEN WITH "error"
+    """
+    info = begin(name, sample, **fields)
+    try:
+        yield info
+    except BaseException as e:
+        info["error"] = repr(e)
+        raise
+    finally:
+        end(info)
+
+
+def run(command, **kwargs):
+    """
+    subprocess.run(str(command), shell=True, **kwargs), RECORDING THE WALL TIME AND THE EXIT STATUS OF THE COMMAND UNDER THE CURRENT
+    STAGE; A CalledProcessError (check=True) IS RECORDED AND RE-RAISED
+    """
+    wallStart = time.perf_counter()
+    returncode = None
+    try:
+        completed = subprocess.run(str(command), shell=True, **kwargs)
+        returncode = completed.returncode
+        return completed
+    except subprocess.CalledProcessError as e:
+        returncode = e.returncode
+        raise
+    finally:
+        subprocess_record(command, time.perf_counter() - wallStart, returncode)
+
+
+@contextlib.contextmanager
+def popen(command, **kwargs):
+    """
+    subprocess.Popen(str(command), shell=True, **kwargs) FOR THE BODY OF A with BLOCK, WHICH READS THE OUTPUT OF THE COMMAND WHILE IT RUNS.
+    ON LEAVING THE BLOCK, WAITS FOR THE COMMAND AND RECORDS IT LIKE run(); A NON-ZERO EXIT STATUS RAISES CalledProcessError, LIKE
+    run(..., check=True). WITHOUT A stderr ARGUMENT THE ERRORS OF THE COMMAND GO TO A TEMPORARY FILE (A PIPE THAT NOBODY READS COULD
+    BLOCK THE COMMAND) AND ARE GIVEN TO THE CalledProcessError.
+    """
+    errors = None
+    if "stderr" not in kwargs:
+        errors = kwargs["stderr"] = tempfile.TemporaryFile()
+    wallStart = time.perf_counter()
+    try:
+        process = subprocess.Popen(str(command), shell=True, **kwargs)
+        try:
+            with process:
+                yield process
+        finally:
+            subprocess_record(command, time.perf_counter() - wallStart, process.returncode)
+        if process.returncode:
+            stderr = None
+            if errors is not None:
+                errors.seek(0)
+                stderr = errors.read()
+            raise subprocess.CalledProcessError(process.returncode, str(command), stderr=stderr)
+    finally:
+        if errors is not None:
+            errors.close()
+
+
+def system(command):
+    """
+    os.system(command), RECORDED LIKE run(); RETURNS THE EXIT STATUS OF os.system
+    """
+    wallStart = time.perf_counter()
+    status = os.system(command)
+    subprocess_record(command, time.perf_counter() - wallStart, os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8)
+    return status
+
+
+def subprocess_record(command, wall, returncode):
+    """
+    WRITES THE subprocess RECORD OF A COMMAND; THE TOOL IS THE PROGRAM RUN AFTER ANY LEADING "cd DIR &&"
+    """
+    current = stages[-1] if stages else {}
+    words = str(command).split("&&")[-1].replace("(", " ").split()
+    record("subprocess", stage=current.get("stage"), sample=current.get("sample"), tool=Path(words[0]).name if words else "",
+           command=str(command), wall_s=round(wall, 4), exit_status=returncode)
@@ -1,7 +1,10 @@
+import re
 import subprocess
 from pathlib import Path
 import cutadapt as ca
 
+lane_tag = re.compile(r"_L\d{3}(?=_|$)") # THE LANE PART OF ILLUMINA FILE NAMES, E.G. sample_S1_L001_R1_001
+
 
 def check_dependencies(args, runlogFile):
     """
@@ -94,25 +97,66 @@ def check_dependencies(args, runlogFile):
 
 
 
-def validate_files(args, in_fileArray, runlogFile, fastq_fullPath=[], base_names=[]):
+def is_fasta(files):
+    """
+    TRUE FOR A FASTA INPUT (*.fa, *.fasta, *.fna, OPTIONALLY .gz), WHICH IS READ AS ALREADY TRIMMED AND COLLAPSED READS
+    """
+    name = Path(files).name.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return name.endswith((".fa", ".fasta", ".fna"))
+
+
+def validate_files(args, in_fileArray, runlogFile, fastq_fullPath=None, base_names=None):
     """
-    THIS FUNCTION VERIFIES THE INPUT FILES TO BE RUN FOR EXTENSIONS ENDING WITH EITHER .fastq (OR) .fasta.gz. THERE BY OMIT OTHER FILES FROM RUNNING THROUGH miRge3.0
+    THIS FUNCTION VERIFIES THE INPUT FILES TO BE RUN FOR EXTENSIONS ENDING WITH EITHER .fastq (OR) .fastq.gz, OR FASTA FILES OF COLLAPSED READS. THERE BY OMIT OTHER FILES FROM RUNNING THROUGH miRge3.0
+    AN ENTRY OF in_fileArray IS EITHER A FILE OR A (SAMPLE NAME, FILE) PAIR FROM A SAMPLE SHEET. FILES OF THE SAME SAMPLE (SAME SAMPLE NAME IN THE 
+    SHEET, OR WITH --merge-lanes THE SAME FILE NAME APART FROM THE _L00N LANE TAG) ARE RETURNED AS ONE ENTRY OF fastq_fullPath: THE LIST OF ITS LANE FILES.
     """
+    fastq_fullPath = [] if fastq_fullPath is None else fastq_fullPath
+    base_names = [] if base_names is None else base_names
     outlog = open(str(runlogFile),"a+")
+    sampleFiles = {}
     for files in in_fileArray:
+       sampleName = None
+       if isinstance(files, (list, tuple)):
+           sampleName, files = files
        filetype = ''.join(Path(files).suffixes) if Path(files).suffix == ".gz" else Path(files).suffix
-       if Path(files).exists() and (filetype.endswith(".fastq") or filetype.endswith(".fastq.gz")):
+       if Path(files).exists() and (filetype.endswith(".fastq") or filetype.endswith(".fastq.gz") or is_fasta(files)):
        #if Path(files).exists() and (filetype == ".fastq" or filetype == ".fastq.gz"):
-           fastq_fullPath.append(str(Path(files).resolve()))
+           fullPath = str(Path(files).resolve())
+           collapsedInput = is_fasta(files)
            files = Path(files).name
-           base_names.append(('.').join(files.split('.')[:-2]) if Path(files).suffix == ".gz" else ('.').join(files.split('.')[:-1]))
+           baseName = ('.').join(files.split('.')[:-2]) if Path(files).suffix == ".gz" else ('.').join(files.split('.')[:-1])
+           if collapsedInput and baseName.endswith(".trim.collapse"): # <sample>.trim.collapse.fa FROM --tcf-out KEEPS THE SAMPLE NAME
+               baseName = baseName[:-len(".trim.collapse")]
+           if sampleName:
+               baseName = sampleName
+           elif args.merge_lanes:
+               baseName = lane_tag.sub("", baseName)
+           elif baseName in sampleFiles: # ONLY A SAMPLE SHEET OR --merge-lanes GROUPS FILES INTO ONE SAMPLE
+               print(f"\nERROR!: Sample {baseName} is given twice: {sampleFiles[baseName][0]} and {fullPath}\nRename one of them, or use a sample sheet or --merge-lanes to process them as one sample\n")
+               outlog.write(f"\nERROR!: Sample {baseName} is given twice: {sampleFiles[baseName][0]} and {fullPath}\nRename one of them, or use a sample sheet or --merge-lanes to process them as one sample\n")
+               exit()
+           sampleFiles.setdefault(baseName, []).append(fullPath)
            #base_names.append(Path(str(Path(files)).replace(''.join(Path(files).suffixes),'')).stem if Path(files).suffix == ".gz" else Path(files).stem)
        else:
             if not args.quiet:
-               print(f"\nWARNING: File {files} does not exists!") if not Path(files).exists() else print(f"\nWARNING: File {files} is neither fastq or fastq.gz format!")
+               print(f"\nWARNING: File {files} does not exists!") if not Path(files).exists() else print(f"\nWARNING: File {files} is neither fastq, fastq.gz or fasta format!")
                print(f"Omitting file {files}")
-            outlog.write(f"\nWARNING: File {files} does not exists!\n") if not Path(files).exists() else print(f"\nWARNING: File {files} is neither fastq or fastq.gz format!\n")
+            outlog.write(f"\nWARNING: File {files} does not exists!\n") if not Path(files).exists() else print(f"\nWARNING: File {files} is neither fastq, fastq.gz or fasta format!\n")
             outlog.write(f"Omitting file {files}\n")
+    for baseName, laneFiles in sampleFiles.items():
+        if len(set(is_fasta(laneFile) for laneFile in laneFiles)) > 1:
+            print(f"\nERROR!: Sample {baseName} mixes fastq and fasta files: {', '.join(laneFiles)}\n")
+            outlog.write(f"\nERROR!: Sample {baseName} mixes fastq and fasta files: {', '.join(laneFiles)}\n")
+            exit()
+        if len(laneFiles) > 1:
+            if not args.quiet:
+                print(f"Sample {baseName}: {len(laneFiles)} files processed as one sample")
+            outlog.write(f"Sample {baseName}: {len(laneFiles)} files processed as one sample\n")
+        fastq_fullPath.append(laneFiles[0] if len(laneFiles) == 1 else laneFiles)
+        base_names.append(baseName)
     #Validating files in the list where the list should not be empty:
     if not fastq_fullPath:
         print("\nERROR!: No valid input files were available!\nPlease verify miRge -s arguments\n")
@@ -122,6 +166,21 @@ def validate_files(args, in_fileArray, runlogFile, fastq_fullPath=[], base_names
     return fastq_fullPath, base_names
 
 
+def sample_sheet(lines):
+    """
+    PARSES THE LINES OF A -s .txt/.csv FILE: EITHER ONE INPUT FILE PER LINE, OR A SAMPLE SHEET OF "sample<TAB or ,>file" LINES
+    WHERE SEVERAL FILES (E.G. THE LANES OF A SAMPLE) SHARE ONE SAMPLE NAME. RETURNS FILES AND (SAMPLE, FILE) PAIRS.
+    """
+    entries = []
+    for line in lines:
+        fields = [field.strip() for field in re.split(r"[\t,]", line)]
+        if len(fields) == 2 and fields[0] and not Path(line).exists():
+            entries.append((fields[0], fields[1]))
+        elif line:
+            entries.append(line)
+    return entries
+
+
 
 """
 THE HASH TABLE BELOW, IT IS REQUIRED DURING THE ALIGNMENT STEP FOR CREATING A FEATURE IN GFF FILE WHICH IS UID
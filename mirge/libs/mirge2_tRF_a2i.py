@@ -13,6 +13,7 @@ from Bio import SeqIO
 from Bio import pairwise2
 from Bio.Alphabet import IUPAC, Gapped
 from scipy import stats
+from mirge.libs import kernels, metrics
 
 def addDashNew(seq, totalLength, start, end):
     newSeq = '-'*(start-1)+seq+'-'*(totalLength-end)
@@ -160,19 +161,27 @@ def getDistance(readInforDic):
     distanceDic = {}
     min_dis, max_dis, max_id = sys.float_info.max, 0.0, 0
     idList = list(readInforDic.keys())
+    pairDistances = None
+    if kernels.enabled and len(set(len(readInforDic[x]['allignedSeq']) for x in idList)) == 1:
+        alignedSeqs = [readInforDic[x]['allignedSeq'] for x in idList]
+        coordinates = np.array([coordinate(seq) for seq in alignedSeqs], dtype=np.int64)
+        pairDistances = kernels.pair_distances(kernels.byte_matrix(alignedSeqs)[0], coordinates[:, 0].copy(), coordinates[:, 1].copy())
     for i in range(0, len(idList)):
         for j in range(i+1, len(idList)):
             x1 = idList[i]
             x2 = idList[j]
-            seq1 = readInforDic[x1]['allignedSeq']
-            seq2 = readInforDic[x2]['allignedSeq']
-            coordinate1 = coordinate(seq1)
-            coordinate2 = coordinate(seq2)
-            substiCount = 0
-            for k in range(len(seq1)):
-                if seq1[k] != '-' and seq2[k] != '-' and seq1[k] != seq2[k]:
-                    substiCount = substiCount + 1
-            distance = weight1*abs(coordinate1[0]-coordinate2[0])+weight2*abs(coordinate1[1]-coordinate2[1])+weight3*substiCount
+            if pairDistances is not None:
+                distance = float(pairDistances[i, j])
+            else:
+                seq1 = readInforDic[x1]['allignedSeq']
+                seq2 = readInforDic[x2]['allignedSeq']
+                coordinate1 = coordinate(seq1)
+                coordinate2 = coordinate(seq2)
+                substiCount = 0
+                for k in range(len(seq1)):
+                    if seq1[k] != '-' and seq2[k] != '-' and seq1[k] != seq2[k]:
+                        substiCount = substiCount + 1
+                distance = weight1*abs(coordinate1[0]-coordinate2[0])+weight2*abs(coordinate1[1]-coordinate2[1])+weight3*substiCount
             min_dis, max_dis = min(min_dis, distance), max(max_dis, distance)
             distanceDic[(x1, x2)] = distance
             distanceDic[(x2, x1)] = distance
@@ -207,6 +216,17 @@ def min_distance(distanceDic, max_dis, max_id, rho):
     return np.array(delta, np.float32), np.array(nneigh, np.int32), np.array(nneighDistance, np.float32), sort_rho_idx.astype(np.int32)
 
 
+def base_change_columns(targetSeqAligned, alignSeqList, start, stop, startBase, endBase, matrix=None):
+    '''
+    For each aligned read, the columns start..stop-1 where targetSeqAligned has startBase and the read has endBase (kernels.base_changes).
+    Used with --numba-pll in place of scanning every column of every read. matrix is kernels.byte_matrix(alignSeqList) if already built.
+    '''
+    bases, lengths = matrix if matrix is not None else kernels.byte_matrix(alignSeqList)
+    target = np.frombuffer(targetSeqAligned.encode(), dtype=np.uint8)
+    hits = kernels.base_changes(target, bases, lengths, start, stop, ord(startBase), ord(endBase))
+    return [(np.flatnonzero(row) + start).tolist() for row in hits]
+
+
 def removeDash(seq):
     headDashCount, tailDashCount = DashCount(seq)
     return seq[headDashCount:len(seq)-tailDashCount]
@@ -346,6 +366,9 @@ def A2IEditing(targetSeq, seqList, countList, mirName, outfTmp, retainedSeqDic,
     a2IPositionCountDic = {}
     positionList = []
     alignSeqListKeptNew = []
+    if kernels.enabled: # ONLY THE READS COUNTED BELOW (ALIGNED AND RETAINED) GO TO THE KERNEL
+    	candidates = [j for j, seq in enumerate(alignSeqListTmp[1:]) if stateListTmp[j] and removeDash(seq) in retainedSeqDic]
+    	changeColumns = dict(zip(candidates, base_change_columns(targetSeqAligned, [alignSeqListTmp[j+1] for j in candidates], startLabel, endLabel+1-tailShift, startBase, endBase)))
 
     for j, seq in enumerate(alignSeqListTmp[1:]):
     	if stateListTmp[j] and removeDash(seq) in retainedSeqDic:
@@ -355,7 +378,7 @@ def A2IEditing(targetSeq, seqList, countList, mirName, outfTmp, retainedSeqDic,
     		alignSeqListKeptNew.append(seq)
     		seqCountTrue = seqCountTrue + 1
     		countSumTrue = countSumTrue + countList[j]
-    		for i in range(startLabel, endLabel+1-tailShift):
+    		for i in (changeColumns[j] if kernels.enabled else range(startLabel, endLabel+1-tailShift)):
     			try:
     				if targetSeqAligned[i] == startBase and alignSeqListTmp[j+1][i] == endBase:
     					positionNew = i+1-targetSeqAlignedHeadCount
@@ -437,6 +460,8 @@ def mismatchCountAnalysis(targetSeq, seqList, countList, retainedSeqDic):
     targetSeqAligned = alignSeqListTmp[0]
     targetSeqAlignedHeadCount = DashCount(targetSeqAligned)[0]
     basePairMismachCountList = []
+    if kernels.enabled: # ALL THE READS ARE COUNTED BELOW (_raw); THEIR MATRIX IS SHARED BY THE 12 BASE PAIRS
+    	alignMatrix = kernels.byte_matrix(alignSeqListTmp[1:])
     for basePair in [('A', 'G'),('A', 'C'),('A', 'T'),('T', 'G'),('T', 'A'),('T', 'C'),('C', 'G'),('C', 'A'),('C', 'T'),('G', 'A'),('G', 'C'),('G', 'T')]:
     	startBaseTmp = basePair[0]
     	endBaseTmp = basePair[1]
@@ -456,11 +481,13 @@ def mismatchCountAnalysis(targetSeq, seqList, countList, retainedSeqDic):
     	positionList = []
     	mismatchCountDic_filter = {}
     	positionList_filter = []
+    	if kernels.enabled:
+    		changeColumns = base_change_columns(targetSeqAligned, alignSeqListTmp[1:], startLabel, endLabel+1-tailShift, startBaseTmp, endBaseTmp, alignMatrix)
 
     	for j, seq in enumerate(alignSeqListTmp[1:]):
     		seqCount = seqCount + 1
     		countSum = countSum + countList[j]
-    		for i in range(startLabel, endLabel+1-tailShift):
+    		for i in (changeColumns[j] if kernels.enabled else range(startLabel, endLabel+1-tailShift)):
     			try:
     				if targetSeqAligned[i] == startBaseTmp and alignSeqListTmp[j+1][i] == endBaseTmp:
     					positionNew = i+1-targetSeqAlignedHeadCount
@@ -476,7 +503,7 @@ def mismatchCountAnalysis(targetSeq, seqList, countList, retainedSeqDic):
     		if stateListTmp[j]:
     			seqCountTrue = seqCountTrue + 1
     			countSumTrue = countSumTrue + countList[j]
-    			for i in range(startLabel, endLabel+1-tailShift):
+    			for i in (changeColumns[j] if kernels.enabled else range(startLabel, endLabel+1-tailShift)):
     				try:
     					if targetSeqAligned[i] == startBaseTmp and alignSeqListTmp[j+1][i] == endBaseTmp:
     						positionNew = i+1-targetSeqAlignedHeadCount
@@ -492,7 +519,7 @@ def mismatchCountAnalysis(targetSeq, seqList, countList, retainedSeqDic):
     		if stateListTmp[j] and removeDash(seq) in retainedSeqDic:
     			seqCountTrue2 = seqCountTrue2 + 1
     			countSumTrue2 = countSumTrue2 + countList[j]
-    			for i in range(startLabel, endLabel+1-tailShift):
+    			for i in (changeColumns[j] if kernels.enabled else range(startLabel, endLabel+1-tailShift)):
     				try:
     					if targetSeqAligned[i] == startBaseTmp and alignSeqListTmp[j+1][i] == endBaseTmp:
     						positionNew = i+1-targetSeqAlignedHeadCount
@@ -1065,7 +1092,7 @@ def a2i_editing(args, cannonical, isomirs, base_names, workDir, Filtered_miRNA_R
     retainedSeqDic = {}
     retainedSeqContentDicTmp = {}
     print("[CMD:]", bwtCommand)
-    bowtie = subprocess.run(str(bwtCommand), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+    bowtie = metrics.run(bwtCommand, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
     if bowtie.returncode==0:
         bwtOut = bowtie.stdout
         bwtErr = bowtie.stderr
@@ -1295,7 +1322,7 @@ def a2i_editing(args, cannonical, isomirs, base_names, workDir, Filtered_miRNA_R
     genome_index = Path(args.libraries_path)/args.organism_name/"index.Libs"/indexName
     bwtCommand = str(bwtCommand) + str(genome_index) + ' -n 0 -f -a -3 2 ' + str(seqtojudge)
     print(print("[CMD:]", bwtCommand))
-    bowtie = subprocess.run(str(bwtCommand), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+    bowtie = metrics.run(bwtCommand, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
     if bowtie.returncode==0:
         bwtOut = bowtie.stdout
         bwtErr = bowtie.stderr
@@ -1421,6 +1448,6 @@ def a2i_editing(args, cannonical, isomirs, base_names, workDir, Filtered_miRNA_R
         RscriptDir = Path(RscriptDirTmp)/('rScripts')/('A-to-I_plot.R')
         outA2Ipdf = Path(workDir)/('a-to-I.heatmap.pdf')
         print("CMD:", 'Rscript %s %s %s'%(RscriptDir, a2IEditingFileTrans, outA2Ipdf))
-        os.system('Rscript %s %s %s'%(RscriptDir, a2IEditingFileTrans, outA2Ipdf))
+        metrics.system('Rscript %s %s %s'%(RscriptDir, a2IEditingFileTrans, outA2Ipdf))
     
     os.remove(samToMapFasta)
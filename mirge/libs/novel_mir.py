@@ -33,44 +33,36 @@ from mirge.libs.screen_precusor_candidates import screen_precusor_candidates
 from mirge.libs.preprocess_featureFiles import preprocess_featureFiles, model_predict
 from mirge.libs.write_novel_report import write_novel_report
 from mirge.classes.exportHTML import FormatJS
+from mirge.libs.countMatrix import count_matrix
+from mirge.libs import metrics
 # from sklearn.externals import joblib 
 # /home/arun/.local/lib/python3.8/site-packages/sklearn/externals/joblib/__init__.py:15: FutureWarning: sklearn.externals.joblib is deprecated in 0.21 and will be removed in 0.23. Please import this functionality directly from joblib, which can be installed with: pip install joblib. If this warning is raised when loading pickled models, you may need to re-serialize those models with scikit-learn 0.21+.
 # warnings.warn(msg, category=FutureWarning)
 
 
 def convert2Fasta(pdUnmapped, infile, minLength, maxLength, countCutoff, outputdir2, species, speciesNameDic, base_names, rawReadCounts, filteredReadCounts):
-    pdUnmapped = pdUnmapped.reset_index(level=['Sequence'])
     outf1 = open((Path(outputdir2)/"unmapped_mirna_raw.fa"), "w+")
     outf2 = open((Path(outputdir2)/"unmapped_mirna.fa"), "w+")
-    cols1 = ["Sequence"] + base_names
-    unmap = pd.DataFrame(pdUnmapped, columns= cols1)
-    unmap['Sum'] =  unmap[base_names].sum(axis=1)
-    finalColumns = ['Sequence','Sum']+base_names
-    unmap = unmap.reindex(columns=finalColumns) # RAW dataframe
-    unmap.index = unmap.index + 1 # Setting to start index from 1 instead of 0
-    filtered_unmap = unmap[(unmap['Sequence'].str.len() >= minLength) & (unmap['Sequence'].str.len() <= maxLength) & (unmap['Sum'] >= countCutoff)] #Filtered Dataframe
-    unmapList = unmap.reset_index().values.tolist()
-    for index, row in enumerate(unmapList): 
-        outf1.write(">mir"+str(row[0])+"_"+str(row[2])+"\n"+row[1]+"\n")
-    filtered_unmapList = filtered_unmap.reset_index().values.tolist()
-    for index, row in enumerate(filtered_unmapList):
-        outf2.write(">mir"+str(row[0])+"_"+str(row[2])+"\n"+row[1]+"\n")
-    for each_sample in base_names:
-        current_fname_raw = "unmapped_mirna_"+each_sample+"_raw.fa"
+    sequences = pdUnmapped.index.tolist()
+    counts = count_matrix(pdUnmapped, base_names).tocsc() # SPARSE sequences x samples; THE UNMAPPED SET IS NEVER MADE DENSE
+    counts.sort_indices()
+    seqSum = np.asarray(counts.sum(axis=1)).ravel()
+    seqLen = np.fromiter((len(seq) for seq in sequences), dtype=np.int64, count=len(sequences))
+    filtered = (seqLen >= minLength) & (seqLen <= maxLength) & (seqSum >= countCutoff) # Filtered rows
+    for index, seq in enumerate(sequences): # Sequence ids start from 1 
+        outf1.write(">mir"+str(index+1)+"_"+str(seqSum[index])+"\n"+seq+"\n")
+    for index in np.flatnonzero(filtered):
+        outf2.write(">mir"+str(index+1)+"_"+str(seqSum[index])+"\n"+sequences[index]+"\n")
+    for col, each_sample in enumerate(base_names):
         current_fname_filtered = "unmapped_mirna_"+each_sample+".fa"
-        #outfn_raw = open((Path(outputdir2)/current_fname_raw), "w+") 
         outfn_filtered = open((Path(outputdir2)/current_fname_filtered), "w+")
-        Sample_DF_raw = pd.DataFrame(unmap[unmap[each_sample] >= 1], columns=['Sequence', each_sample]) 
-        rawReadCounts[each_sample] = Sample_DF_raw.shape[0]
-        Sample_DF_filtered = pd.DataFrame(filtered_unmap[filtered_unmap[each_sample] >= countCutoff], columns=['Sequence', each_sample])
-        filteredReadCounts[each_sample] = Sample_DF_filtered.shape[0]
-        Sample_DF_rawList = Sample_DF_raw.reset_index().values.tolist() 
-        Sample_DF_filteredList = Sample_DF_filtered.reset_index().values.tolist()
-        #for index, row in enumerate(Sample_DF_rawList):
-        #    outfn_raw.write(">mir"+str(row[0])+"_"+str(row[2])+"\n"+row[1]+"\n")
-        #outfn_raw.close()
-        for index, row in enumerate(Sample_DF_filteredList):
-            outfn_filtered.write(">mir"+str(row[0])+"_"+str(row[2])+"\n"+row[1]+"\n")
+        rows = counts.indices[counts.indptr[col]:counts.indptr[col+1]]
+        values = counts.data[counts.indptr[col]:counts.indptr[col+1]]
+        rawReadCounts[each_sample] = int((values >= 1).sum())
+        keep = (values >= countCutoff) & filtered[rows]
+        filteredReadCounts[each_sample] = int(keep.sum())
+        for index, value in zip(rows[keep].tolist(), values[keep].tolist()):
+            outfn_filtered.write(">mir"+str(index+1)+"_"+str(value)+"\n"+sequences[index]+"\n")
         outfn_filtered.close()
     outf1.close()
     outf2.close()
@@ -335,6 +327,7 @@ def predict_nmir(args, workDir, ref_db, base_names, pdUnmapped):
         outfLog.write('********************\n')
         outfLog.flush()
         for files in base_names:
+            sampleStage = metrics.begin("novel_mirna", files, unique_in=rawReadCounts[files], unique_filtered=filteredReadCounts[files])
             errorTrue = 0
             outfLog.write(f'Processing {files}\n')
             outfLog.write(f'**There are {str(rawReadCounts[files])} collapsed reads in the raw fasta file\n')
@@ -346,12 +339,12 @@ def predict_nmir(args, workDir, ref_db, base_names, pdUnmapped):
             outfile1 = Path(outputdir2)/("unmapped_mirna_"+ files +"_vs_genome.sam")
             bwtExec = str(bwtCmdTmp) +" "+ str(genome_index) + " " + str(fileNameTemp) + " -f -n 0 --best -a --threads " + str(args.threads) + " -m " + str(mapping_loc) + " -l "+ str(seedLength) + " -S " + str(outfile1)
             print("[CMD:]", bwtExec)
-            bowtie = subprocess.run(str(bwtExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+            bowtie = metrics.run(bwtExec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
             # SORT SAM FILE
             outfile2 = Path(outputdir2)/("unmapped_mirna_"+ files +"_vs_genome_sorted.sam") 
             samyExec = str(samtoolsCmdTmp) + " sort --threads "+ str(args.threads) + " -O sam -T sample.sort -o " + str(outfile2) + " " + str(outfile1)
             print("[CMD:]", samyExec)
-            samysort = subprocess.run(str(samyExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+            samysort = metrics.run(samyExec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
             time4 = time.perf_counter()
             outfLog.write('Mapping reads to humna genome time: %.4fs\n'%(time4-time3))
             outfLog.write('Clustering the reads based on the coordinate in the genome\n')
@@ -375,7 +368,7 @@ def predict_nmir(args, workDir, ref_db, base_names, pdUnmapped):
             bwtBuildExec = str(bwtBuildCmdTmp) +" -f "+ str(clusterTrimedFile_orig_FASTA) + " " + str(outfile3) + " --threads " + str(args.threads) 
             try:
                 print("[CMD:]", bwtBuildExec)
-                bowtie = subprocess.run(str(bwtBuildExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+                bowtie = metrics.run(bwtBuildExec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
             except subprocess.CalledProcessError:
                 errorTrue = 1
                 pass
@@ -384,7 +377,7 @@ def predict_nmir(args, workDir, ref_db, base_names, pdUnmapped):
             bwt2Exec = str(bwtCmdTmp) +" "+ str(outfile3) + " " + str(fileNameTemp) + " -f -n 0 --best -a --norc --threads " + str(args.threads) + " -m " + str(mapping_loc) + " -l "+ str(seedLength) + " -S " + str(outfile4)
             try:
                 print("[CMD:]", bwt2Exec)
-                bowtie = subprocess.run(str(bwt2Exec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+                bowtie = metrics.run(bwt2Exec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
             except subprocess.CalledProcessError:
                 errorTrue = 1
                 pass
@@ -404,7 +397,7 @@ def predict_nmir(args, workDir, ref_db, base_names, pdUnmapped):
                 outfile4_tmp2 = Path(outputdir2)/(files+"_tmp2.sam")
                 bwt3Exec = str(bwtCmdTmp) +" "+ str(outfile3) + " " + str(imperfect_FASTA) + " -f -n 1 -l 15 -5 1 -3 3 --best --strata -a --norc --threads " + str(args.threads) + " -S " + str(outfile4_tmp2)
                 print("[CMD:]", bwt3Exec)
-                bowtie = subprocess.run(str(bwt3Exec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+                bowtie = metrics.run(bwt3Exec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
                 # Combine the aligned result of the two type of reads: perfect matched reads and imperfect matched reads.
                 combined_Sam = Path(outputdir2)/(files+".sam")  
                 combineSam(str(outfile4), str(outfile4_tmp2), str(combined_Sam))
@@ -440,7 +433,7 @@ def predict_nmir(args, workDir, ref_db, base_names, pdUnmapped):
                 outfile_str = str(Path(outputdir2)/(files+"_precursor_tmp.str"))
                 rnafld_exec = str(rnafoldCmdTmp) + " " + str(infile_pre) + " --noPS --noLP > " + str(outfile_str)
                 print("[CMD:]", rnafld_exec)
-                rnafldRun = subprocess.run(str(rnafld_exec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+                rnafldRun = metrics.run(rnafld_exec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
                 strFileOut= str(Path(outputdir2)/(files+"_precursor.str"))
                 renameStrFile(infile_pre, outfile_str, strFileOut)
                 time12 = time.perf_counter()
@@ -463,6 +456,8 @@ def predict_nmir(args, workDir, ref_db, base_names, pdUnmapped):
                 featureFile = fileToPredict
                 clusterFile = str(Path((outputdir2)/(files+'_cluster.txt')))
                 write_novel_report(novelmiRNALListFile, featureFile, clusterFile, str(rnafoldCmdTmp), str(Path(outputdir2)), files)
+            sampleStage["error"] = "no cluster sequences" if errorTrue == 1 else None
+            metrics.end(sampleStage)
     if errorTrue ==1: 
         print(f'No cluster sequences are generated and prediction is aborted.')
     predict_end_time = time.perf_counter()
@@ -3,6 +3,19 @@ import sys
 import argparse
 import subprocess
 
+def memory_size(value):
+    """
+    PARSES A MEMORY SIZE SUCH AS 64G, 500M OR 2048 (MEGABYTES WITHOUT A UNIT) INTO BYTES
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    value = value.strip().upper().rstrip('B')
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(float(value) * units['M'])
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid memory size: '%s' (examples: 64G, 500M)" % value)
+
 def parseArg():
     version = '3.0'
     parser = argparse.ArgumentParser(description='miRge3.0 (Comprehensive analysis of small RNA sequencing Data)',usage='miRge3.0 [options]',formatter_class=argparse.RawTextHelpFormatter,)
@@ -10,7 +23,7 @@ def parseArg():
         parser.print_help(sys.stderr)
         sys.exit(1)
     parser.add_argument('--version', action='version', version='%s'%(version))
-    group = parser.add_argument_group("Options",description='''-s,    --samples            list of one or more samples separated by comma or a file with list of samples separated by new line (accepts *.fastq, *.fastq.gz) 
+    group = parser.add_argument_group("Options",description='''-s,    --samples            list of one or more samples separated by comma or a file with list of samples separated by new line (accepts *.fastq, *.fastq.gz, and *.fa, *.fasta of collapsed reads such as <sample>.trim.collapse.fa; a .txt/.csv file may also be a sample sheet of "sample,file" lines, where all the files of a sample are processed as one sample) 
 -db,   --mir-DB             the reference database of miRNA. Options: miRBase and miRGeneDB (Default: miRBase) 
 -lib,  --libraries-path     the path to miRge libraries 
 -on,   --organism-name      the organism name can be human, mouse, fruitfly, nematode, rat or zebrafish
@@ -21,6 +34,20 @@ def parseArg():
 -cpu,  --threads            the number of processors to use for trimming, qc, and alignment (Default: 1)
 -ai,   --AtoI               switch to calculate A to I editing (Default: off)
 -tcf   --tcf-out            switch to write trimmed and collapsed fasta file (Default: off)
+-tfq   --trim-fq-out        switch to write the trimmed reads of each sample to <sample>.trim.fq.gz (Default: off)
+-tc    --trim-cache         the number of distinct raw reads whose trimming result is cached by each trimming process; 0 to disable (Default: 65536)
+-dt    --decompress-threads the number of pigz threads decompressing each *.fastq.gz input, if pigz is installed; 0 to use python's gzip (Default: 1)
+-bs    --buffer-size        the size in bytes of the blocks of reads sent to the trimming processes (Default: 4000000)
+       --numba-pll          switch to run the UMI, tRF clustering and A-to-I loops as numba compiled kernels; requires numba (Default: off)
+-ml    --merge-lanes        switch to process the files whose names differ only by the lane tag (_L001, _L002, ...) as one sample (Default: off)
+-snf   --sniff              check the adapter and UMI options on the first reads of each sample before the run: warn, abort (stop on any problem) or off (Default: warn)
+-snr   --sniff-reads        the number of reads of each sample checked by --sniff (Default: 10000)
+-ckp   --checkpoint-dir     switch on per-sample checkpoints of the trimmed and collapsed reads in this directory, reused by later runs with the same input and trimming options; each input file is hashed in full for its key (Default: off)
+-acd   --annotation-cache-dir switch on a cache of the annotation of the unique reads by the bowtie alignments in this directory, shared by the runs that use it; only the reads not in it are aligned (Default: off)
+-mem   --max-memory         memory budget for collapsing the reads of a sample, e.g. 48G; beyond it, sorted runs of counts are spilled to disk and merged at the end (Default: no limit)
+-tmp   --scratch-dir        the directory of the runs spilled with --max-memory (Default: the output directory of the run)
+-pfl   --profile            switch to run each stage under cProfile and tracemalloc and write its .pstats file and top allocation sites to the profile directory of the run (Default: off)
+-pfw   --profile-workers    with --profile, profile one chunk in N in each trimming process as well; 0 to profile the parent only (Default: 0)
 -gff   --gff-out            switch to output isomiR results in gff format (Default: off) 
 -bam   --bam-out            switch to output isomiR results in gff format (Default: off) 
 -trf   --tRNA-frag          switch to analyze tRNA fragment and halves (Default: off)
@@ -38,6 +65,18 @@ def parseArg():
     group.add_argument('-cpu', '--threads', type=int, default='0', help=argparse.SUPPRESS)
     group.add_argument('-ai', '--AtoI', action='store_true', default=False, help=argparse.SUPPRESS)
     group.add_argument('-tcf', '--tcf-out', action='store_true', default=False, help=argparse.SUPPRESS)
+    group.add_argument('-tfq', '--trim-fq-out', action='store_true', default=False, help=argparse.SUPPRESS)
+    group.add_argument('-tc', '--trim-cache', type=int, default=65536, help=argparse.SUPPRESS)
+    group.add_argument('-dt', '--decompress-threads', type=int, default=1, help=argparse.SUPPRESS)
+    group.add_argument('-ml', '--merge-lanes', action='store_true', default=False, help=argparse.SUPPRESS)
+    group.add_argument('-snf', '--sniff', choices=['warn', 'abort', 'off'], default='warn', help=argparse.SUPPRESS)
+    group.add_argument('-snr', '--sniff-reads', type=int, default=10000, help=argparse.SUPPRESS)
+    group.add_argument('-ckp', '--checkpoint-dir', default=None, help=argparse.SUPPRESS)
+    group.add_argument('-acd', '--annotation-cache-dir', default=None, help=argparse.SUPPRESS)
+    group.add_argument('-mem', '--max-memory', type=memory_size, default=None, help=argparse.SUPPRESS)
+    group.add_argument('-tmp', '--scratch-dir', default=None, help=argparse.SUPPRESS)
+    group.add_argument('-pfl', '--profile', action='store_true', default=False, help=argparse.SUPPRESS)
+    group.add_argument('-pfw', '--profile-workers', type=int, default=0, help=argparse.SUPPRESS)
     group.add_argument('-bam', '--bam-out', action='store_true', default=False, help=argparse.SUPPRESS)
     group.add_argument('-gff', '--gff-out', action='store_true', default=False, help=argparse.SUPPRESS)
     group.add_argument('-trf', '--tRNA-frag', action='store_true', default=False, help=argparse.SUPPRESS)
@@ -55,8 +94,10 @@ def parseArg():
                             modifications are applied after adapter trimming
 -NX,   --trim-n             Trim N's on ends of reads
 -m,    --minimum-length     Discard reads shorter than LEN. (Default: 16)
+       --no-exact-adapter   switch off the exact-match shortcut for a single 3' adapter, so every read goes through the cutadapt aligner; the trimmed reads are the same either way (Default: off)
 -umi,  --uniq-mol-ids       Removes PCR duplicates and trim UMI of length by specifying two comma-separated cutoffs as 5’ cutoff,3’ bp from both ends of the read. eg: 4,4 or 0,4 
 -udd,  --umiDedup           Specifies argument to removes PCR duplicates (Default: False); if TRUE it will remove UMI and remove PCR duplicates otherwise it only remove UMI and keep the raw counts
+-umm,  --umi-method         How -udd merges the UMIs of an insert that differ by one base (sequencing errors): directional, adjacency or unique (no merging) (Default: directional)
 -umiq, --umiqiagen          Removes PCR duplicates of reads obtained from Qiagen platform (Default: Illumina; "-umi x,y " Required)
 
 
@@ -74,6 +115,7 @@ def parseArg():
     group1.add_argument("-umi", "--uniq-mol-ids", default=None, help=argparse.SUPPRESS)
     group1.add_argument("-qumi", "--qiagenumi", action='store_true', default=False, help=argparse.SUPPRESS)
     group1.add_argument("-udd", "--umiDedup", action='store_true', default=False, help=argparse.SUPPRESS)
+    group1.add_argument("-umm", "--umi-method", choices=['directional', 'adjacency', 'unique'], default='directional', help=argparse.SUPPRESS)
     #### we use none of the following cutadapt options but are required to pass default values for miRNA and cutadapt pipeline
     group1.add_argument("-op", "--output", metavar="FILE", help=argparse.SUPPRESS) #"Default: write to standard output"
     group1.add_argument("--compression-level", type=int, default=6, help=argparse.SUPPRESS)
@@ -85,10 +127,11 @@ def parseArg():
     group1.add_argument("--match-read-wildcards", action="store_true", default=False,help=argparse.SUPPRESS)
     group1.add_argument("-N", "--no-match-adapter-wildcards", action="store_false", default=True, dest='match_adapter_wildcards',help=argparse.SUPPRESS)
     group1.add_argument("--fasta", default=False, action='store_true',help=argparse.SUPPRESS)
-    group1.add_argument("--buffer-size", type=int, default=4000000, help=argparse.SUPPRESS)
+    group1.add_argument("-bs", "--buffer-size", type=int, default=4000000, help=argparse.SUPPRESS)
     group1.add_argument("--no-indels", action='store_false', dest='indels', default=True, help=argparse.SUPPRESS)
+    group1.add_argument("--no-exact-adapter", action='store_false', dest='exact_adapter', default=True, help=argparse.SUPPRESS)
     group1.add_argument("-M", "--maximum-length", default=None, type=int, metavar="LEN[:LEN2]", help=argparse.SUPPRESS)
-    group1.add_argument("--numba-pll", default=None, action='store_false', help=argparse.SUPPRESS)
+    group1.add_argument("--numba-pll", default=False, action='store_true', help=argparse.SUPPRESS)
     group1.add_argument("--numba-cuda", default=None, action='store_false', help=argparse.SUPPRESS)
 
     ## group - 3 ##
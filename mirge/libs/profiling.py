@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+import os
+import pstats
+import cProfile
+import functools
+import contextlib
+import tracemalloc
+from pathlib import Path
+
+"""
+OPT-IN PROFILING OF THE PIPELINE STAGES (-pfl, --profile): EACH STAGE RUNS UNDER cProfile AND tracemalloc AND WRITES, TO THE profile
+DIRECTORY OF THE OUTPUT DIRECTORY, NN_<stage>.pstats (READ WITH python -m pstats OR snakeviz) AND NN_<stage>.alloc.txt (THE LINES THAT
+ALLOCATED THE MOST MEMORY THAT WAS STILL HELD AT THE END OF THE STAGE, AND THE PEAK TRACED MEMORY). NN IS THE ORDER IN WHICH THE STAGES
+FINISHED. A STAGE THAT RUNS INSIDE ANOTHER ONE (create_gff INSIDE summarize, ...) PAUSES THE PROFILER OF THE OUTER STAGE, SO ITS TIME
+IS ONLY IN ITS OWN FILE.
+WITH -pfw N (--profile-workers) AS WELL, EACH TRIMMING WORKER ALSO PROFILES ONE CHUNK IN N WITH cProfile; THE WORKER PROFILES ARE MERGED INTO
+NN_<stage>.workers.pstats OF THE STAGE THAT RAN THE POOL (baking).
+WITHOUT THESE OPTIONS, stage() AND sampled() DO NOTHING.
+"""
+
+top_allocations = 25 # LINES LISTED IN EACH .alloc.txt
+trace_frames = 1 # FRAMES KEPT BY tracemalloc PER ALLOCATION: ONE IS ENOUGH TO GROUP BY LINE, AND THE CHEAPEST
+
+profileDir = None
+stages = [] # THE OPEN stage() RECORDS, INNERMOST LAST
+finished = 0
+
+workerProfile = None # IN A PROFILED TRIMMING WORKER: THE cProfile.Profile, ONE CALL IN workerEvery IS PROFILED
+workerEvery = 1
+workerCalls = 0
+workerPath = None
+
+
+def start(args, workDir):
+    """
+    ENABLES THE PROFILING OF THE RUN WITH --profile; RETURNS THE profile DIRECTORY OR None
+    """
+    global profileDir
+    if args.profile:
+        profileDir = Path(workDir)/"profile"
+        profileDir.mkdir(parents=True, exist_ok=True)
+    return profileDir
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    PROFILES THE BODY OF A with BLOCK AS THE STAGE name (WITH --profile)
+    """
+    if profileDir is None:
+        yield
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(trace_frames)
+    if stages:
+        outer = stages[-1]
+        outer["profile"].disable()
+        outer["peak"] = max(outer["peak"], tracemalloc.get_traced_memory()[1])
+    if hasattr(tracemalloc, "reset_peak"): # PYTHON >= 3.9; BEFORE, THE PEAK IS THE PEAK SINCE THE FIRST STAGE
+        tracemalloc.reset_peak()
+    info = {"name": name, "profile": cProfile.Profile(), "peak": 0, "snapshot": tracemalloc.take_snapshot()}
+    stages.append(info)
+    info["profile"].enable()
+    try:
+        yield
+    finally:
+        info["profile"].disable()
+        stages.remove(info)
+        info["peak"] = max(info["peak"], tracemalloc.get_traced_memory()[1])
+        write_stage(info)
+        if stages:
+            stages[-1]["peak"] = max(stages[-1]["peak"], info["peak"])
+            stages[-1]["profile"].enable()
+        else:
+            tracemalloc.stop()
+
+
+def write_stage(info):
+    """
+    WRITES THE .pstats AND .alloc.txt FILES OF A FINISHED stage(), AND THE MERGED PROFILES OF THE WORKERS THAT RAN DURING IT
+    """
+    global finished
+    finished += 1
+    prefix = profileDir/("%02d_%s" % (finished, info["name"]))
+    info["profile"].dump_stats(str(prefix) + ".pstats")
+    # THE ALLOCATIONS OF THE PROFILERS THEMSELVES ARE LEFT OUT
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile, pstats)] + [tracemalloc.Filter(False, __file__)])
+    current = tracemalloc.get_traced_memory()[0]
+    with open(str(prefix) + ".alloc.txt", "w") as fout:
+        fout.write(f"stage {info['name']}: traced memory at the end {current / 1048576:.1f} MB, peak {info['peak'] / 1048576:.1f} MB\n")
+        fout.write(f"top {top_allocations} lines by memory allocated during the stage and still held at its end:\n")
+        for stat in snapshot.compare_to(info["snapshot"], "lineno")[:top_allocations]:
+            fout.write(str(stat) + "\n")
+    workerFiles = sorted((profileDir/"workers").glob("*.pstats"))
+    if workerFiles:
+        pstats.Stats(*[str(path) for path in workerFiles]).dump_stats(str(prefix) + ".workers.pstats")
+        for path in workerFiles:
+            path.unlink()
+        (profileDir/"workers").rmdir()
+
+
+def start_worker(workerDir, every):
+    """
+    CALLED BY THE INITIALIZER OF A TRIMMING WORKER WITH --profile-workers: PROFILES ONE CALL IN every OF THE sampled() FUNCTIONS
+    """
+    global workerProfile, workerEvery, workerPath
+    workerProfile = cProfile.Profile()
+    workerEvery = max(1, every)
+    workerPath = Path(workerDir)/"workers"
+    workerPath.mkdir(parents=True, exist_ok=True)
+    workerPath = workerPath/("worker.%d.pstats" % os.getpid())
+
+
+def sampled(function):
+    """
+    DECORATOR OF THE FUNCTIONS RUN BY THE WORKERS (cutadapt()): IN A PROFILED WORKER, ONE CALL IN workerEvery RUNS UNDER ITS PROFILER,
+    WHOSE CUMULATIVE STATISTICS ARE WRITTEN AFTER EACH PROFILED CALL (A WORKER HAS NO RELIABLE EXIT HOOK). OTHERWISE A PLAIN CALL.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global workerCalls
+        if workerProfile is None:
+            return function(*args, **kwargs)
+        workerCalls += 1
+        if (workerCalls - 1) % workerEvery:
+            return function(*args, **kwargs)
+        workerProfile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            workerProfile.disable()
+            workerProfile.dump_stats(str(workerPath))
+    return wrapper
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+import sys
+import itertools
+from collections import Counter
+import numpy as np
+import dnaio
+from cutadapt.modifiers import AdapterCutter
+
+from mirge.libs import digest
+from mirge.libs.miRgeEssential import is_fasta
+
+"""
+QUICK PRE-PASS OVER THE FIRST READS OF EACH INPUT, RUN BEFORE baking() (-snf, --sniff): A WRONG -a OR A MISSING -umi OTHERWISE ONLY
+SHOWS UP AT THE END OF THE RUN AS A NEAR-ZERO miRNA COUNT IN annotation.report.csv.
+FOR EACH SAMPLE IT COUNTS THE OVER-REPRESENTED k-MERS OF THE 3' PART OF THE READS, MATCHES THEM AGAINST THE ADAPTERS OF THE KNOWN
+SMALL RNA KITS AND TRIMS THE READS WITH THE ACTUAL TRIMMING OPTIONS TO LOOK AT THE LENGTH PROFILE: miRNAs PEAK AT 20-24 nt ONCE THE
+ADAPTER AND THE UMI ARE REMOVED.
+"""
+
+# KIT NAME: (3' ADAPTER, -umi LAYOUT OR None, QIAseq UMI). NEXTflex v3 SHARES THE TruSeq ADAPTER AND ADDS 4 RANDOM BASES ON EACH SIDE OF THE INSERT.
+kits = {
+    "Illumina TruSeq small RNA": ("TGGAATTCTCGGGTGCCAAGG", None, False),
+    "NEXTflex small RNA v3": ("TGGAATTCTCGGGTGCCAAGG", "4,4", False),
+    "QIAseq miRNA": ("AACTGTAGGCACCATCAAT", "0,12", True),
+    "Illumina small RNA v1.5": ("ATCTCGTATGCCGTCTTCTGCTTG", None, False),
+    "NEBNext small RNA": ("AGATCGGAAGAGCACACGTCT", None, False),
+}
+
+kmer_size = 12
+min_probe = 8 # SHORTER 3' ADAPTERS MATCH BY CHANCE TOO OFTEN TO BE PROBED
+mirna_peak = 22 # EXPECTED MODE OF THE miRNA INSERT LENGTHS
+min_adapter_fraction = 0.1 # BELOW THIS FRACTION OF READS, AN ADAPTER IS CONSIDERED ABSENT
+kit_fraction = 0.3 # A KIT ADAPTER IN AT LEAST THIS FRACTION OF READS IDENTIFIES THE KIT
+overrepresented = 0.05 # A k-MER IN AT LEAST THIS FRACTION OF READS IS OVER-REPRESENTED
+min_trimmed_fraction = 0.2
+
+
+def first_reads(FQfile, reads):
+    """
+    THE dnaio RECORDS OF THE FIRST reads READS OF A FASTQ(.gz) FILE
+    """
+    with dnaio.open(str(FQfile), fileformat="fastq") as fqin:
+        return list(itertools.islice(fqin, reads))
+
+
+def adapter_positions(seqs, adapter):
+    """
+    POSITION OF THE FIRST kmer_size BASES OF adapter IN EACH READ, -1 WHERE IT IS MISSING
+    """
+    probe = adapter[:kmer_size].upper()
+    return np.fromiter((seq.find(probe) for seq in seqs), dtype=np.int64, count=len(seqs))
+
+
+def adapter_probes():
+    """
+    THE PROBES OF THE 3' ADAPTERS OF THE RUN, TAKEN FROM THE ADAPTERS PARSED BY cutadapt FOR THE TRIMMING (digest.ingredients, SO -a file:,
+    -a name=SEQ, ... ARE RESOLVED): THE FIRST kmer_size BASES OF EACH PLAIN 3' ADAPTER. ANCHORED ($) OR NON-INTERNAL (X) ADAPTERS, AND
+    ADAPTERS WITH WILDCARDS OR SHORTER THAN min_probe, CANNOT BE LOOKED FOR WITH str.find AND ARE NOT PROBED. RETURNS THE PROBES AND
+    WHETHER ANY 3' ADAPTER WAS GIVEN.
+    """
+    probes = []
+    threePrime = False
+    for modifier in digest.ingredients:
+        if not isinstance(modifier, AdapterCutter):
+            continue
+        for adapter in modifier.adapters:
+            threePrime = threePrime or getattr(getattr(adapter, 'where', None), 'name', None) in ('BACK', 'SUFFIX', 'BACK_NOT_INTERNAL')
+            sequence = digest.back_adapter_sequence(adapter)
+            if sequence is not None and len(sequence) >= min_probe and not set(sequence.upper()) - set("ACGT"):
+                probes.append(sequence[:kmer_size].upper())
+    return probes, threePrime
+
+
+def top_kmers(seqs, start=kmer_size, top=5):
+    """
+    THE k-MERS FOUND (FROM POSITION start ON, I.E. IN THE 3' PART OF THE READS) IN AT LEAST overrepresented OF THE READS, MOST FREQUENT
+    (THEN MOST 5') FIRST, AS (k-MER, FRACTION OF READS) PAIRS. LOW COMPLEXITY k-MERS (POLY-A, NNN, ...) ARE IGNORED.
+    """
+    kmers = Counter()
+    for seq in seqs:
+        kmers.update({seq[pos:pos + kmer_size] for pos in range(start, len(seq) - kmer_size + 1)})
+    found = []
+    for kmer, count in kmers.most_common():
+        if count < overrepresented * len(seqs):
+            break
+        if len(set(kmer)) > 2 and "N" not in kmer:
+            found.append((kmer, count / len(seqs)))
+    # THE k-MERS OF ONE ADAPTER ARE EQUALLY FREQUENT; THE ONE CLOSEST TO THE 5' END IS THE START OF THE ADAPTER
+    position = {kmer: np.median([pos for pos in (seq.find(kmer) for seq in seqs[:1000]) if pos >= 0] or [0]) for kmer, fraction in found}
+    return sorted(found, key=lambda item: (-round(item[1], 2), position[item[0]]))[:top]
+
+
+def trial_trim(records):
+    """
+    TRIMS THE READS WITH THE cutadapt MODIFIERS OF THE RUN (digest.init_worker() MUST HAVE BEEN CALLED); RETURNS THE FRACTION OF READS
+    THAT PASS THE MINIMUM LENGTH AND THE MODE OF THEIR LENGTHS (UMI INCLUDED, AS BEFORE THE UMI STEP OF baking())
+    """
+    lengths = []
+    for record in records:
+        final_seq = digest.trim_read(record, digest.ingredients)[1]
+        if final_seq is not None:
+            lengths.append(len(final_seq))
+    if not lengths:
+        return 0.0, 0
+    return len(lengths) / len(records), int(np.bincount(lengths).argmax())
+
+
+def random_bases(kit):
+    """
+    NUMBER OF UMI OR RANDOM BASES THAT A READ OF THE kit KEEPS AFTER ADAPTER TRIMMING
+    """
+    umiLayout = kits[kit][1]
+    return sum(int(value) for value in umiLayout.split(",")) if umiLayout else 0
+
+
+def kit_suggestion(kit):
+    adapter, umiLayout, qiagen = kits[kit]
+    return "-a " + adapter + (" -umi " + umiLayout if umiLayout else "") + (" -qumi" if qiagen else "")
+
+
+def sniff_sample(args, FQfile, reads):
+    """
+    SNIFFS ONE INPUT FILE; RETURNS A ONE LINE DESCRIPTION AND THE LIST OF PROBLEMS FOUND
+    """
+    records = first_reads(FQfile, reads)
+    seqs = [record.sequence.upper() for record in records]
+    if not seqs:
+        return "no reads", ["the file has no reads"]
+    problems = []
+    kitPositions = {kit: adapter_positions(seqs, adapter) for kit, (adapter, umiLayout, qiagen) in kits.items()}
+    kitFractions = {kit: float(np.mean(positions >= 0)) for kit, positions in kitPositions.items()}
+    bestKit = max(kitFractions, key=kitFractions.get)
+    adapters, anyAdapter = adapter_probes()
+    given = max((float(np.mean(adapter_positions(seqs, adapter) >= 0)) for adapter in adapters), default=0.0)
+    trimmedFraction, peak = trial_trim(records)
+    umiCut = [int(value) for value in args.uniq_mol_ids.split(",")] if args.uniq_mol_ids else [0, 0]
+    insertPeak = peak - sum(umiCut)
+    if kitFractions[bestKit] >= kit_fraction:
+        # KITS WITH THE SAME ADAPTER ARE TOLD APART BY THE LENGTH OF THEIR RANDOM BASES: THE ADAPTER STARTS AFTER THE INSERT AND THEM
+        positions = kitPositions[bestKit]
+        adapterPeak = int(np.bincount(positions[positions >= 0]).argmax())
+        sameAdapter = [kit for kit in kits if kits[kit][0] == kits[bestKit][0]]
+        bestKit = min(sameAdapter, key=lambda kit: abs(adapterPeak - mirna_peak - random_bases(kit)))
+    else:
+        bestKit = None
+    adapterInfo = f"3' adapter in {100 * given:.1f}% of reads" if adapters or not anyAdapter else "3' adapter not checked"
+    description = (f"{len(seqs)} reads, {adapterInfo}, {100 * trimmedFraction:.1f}% kept after trimming, "
+                   f"trimmed length peak {peak} nt" + (f", looks like {bestKit}" if bestKit else ""))
+
+    # A WRONG ADAPTER MAKES THE LENGTH PROFILE MEANINGLESS, SO THE LENGTH CHECKS ONLY RUN WITH THE RIGHT ONE
+    # ADAPTERS THAT CANNOT BE PROBED (anyAdapter WITHOUT adapters) ARE NOT CHECKED
+    if not anyAdapter and bestKit:
+        problems.append(f"no 3' adapter (-a) was given, but the {bestKit} adapter is in {100 * kitFractions[bestKit]:.1f}% of the reads; try {kit_suggestion(bestKit)}")
+    elif adapters and given < min_adapter_fraction:
+        if bestKit and kits[bestKit][0][:kmer_size] not in adapters:
+            problems.append(f"the 3' adapter (-a) is in only {100 * given:.1f}% of the reads, but the {bestKit} adapter is in {100 * kitFractions[bestKit]:.1f}%; try {kit_suggestion(bestKit)}")
+        else:
+            kmers = top_kmers(seqs)
+            hint = f"; the over-represented 3' k-mer {kmers[0][0]} ({100 * kmers[0][1]:.1f}% of the reads) may be the start of the adapter" if kmers else ""
+            problems.append(f"the 3' adapter (-a) is in only {100 * given:.1f}% of the reads" + hint)
+    if not problems:
+        if trimmedFraction < min_trimmed_fraction:
+            problems.append(f"only {100 * trimmedFraction:.1f}% of the reads are at least {args.minimum_length} nt long after trimming")
+        elif bestKit and kits[bestKit][1] and not args.uniq_mol_ids:
+            problems.append(f"the reads look like {bestKit}, whose random bases are not removed without -umi; try {kit_suggestion(bestKit)}")
+        elif not args.uniq_mol_ids and peak >= mirna_peak + 6:
+            problems.append(f"the trimmed reads peak at {peak} nt, longer than miRNAs (20-24 nt); if the library has random bases or a UMI, set -umi")
+        elif args.uniq_mol_ids and insertPeak < mirna_peak - 4:
+            problems.append(f"once the -umi {args.uniq_mol_ids} bases are removed the reads peak at {insertPeak} nt, shorter than miRNAs (20-24 nt); check -umi")
+        elif bestKit and kits[bestKit][2] and not args.qiagenumi:
+            problems.append(f"QIAseq reads carry their UMI after the adapter, which needs -qumi; try {kit_suggestion(bestKit)}")
+    return description, problems
+
+
+def sniff_inputs(args, inFileArray, inFileBaseArray, runlogFile):
+    """
+    RUNS sniff_sample() ON THE FIRST (LANE) FILE OF EACH FASTQ SAMPLE AND REPORTS THE PROBLEMS; WITH --sniff abort, EXITS IF THERE IS ANY.
+    COLLAPSED FASTA INPUTS ARE ALREADY TRIMMED AND ARE SKIPPED.
+    """
+    outlog = open(str(runlogFile), "a+")
+    digest.init_worker(args)
+    found = 0
+    for FQfile, baseName in zip(inFileArray, inFileBaseArray):
+        FQfile = FQfile[0] if isinstance(FQfile, (list, tuple)) else FQfile
+        if is_fasta(FQfile):
+            continue
+        description, problems = sniff_sample(args, FQfile, args.sniff_reads)
+        if not args.quiet:
+            print(f"Sniffing {baseName}: {description}")
+        outlog.write(f"Sniffing {baseName}: {description}\n")
+        for problem in problems:
+            print(f"WARNING: {baseName}: {problem}")
+            outlog.write(f"WARNING: {baseName}: {problem}\n")
+        found += len(problems)
+    if found and args.sniff == "abort":
+        outlog.write("ERROR: the input check found problems with the trimming options (see the warnings above); use --sniff warn to run anyway\n")
+        outlog.close()
+        sys.exit("ERROR: the input check found problems with the trimming options (see the warnings above); use --sniff warn to run anyway")
+    outlog.close()
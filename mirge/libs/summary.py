@@ -12,6 +12,8 @@ from mirge.libs.bamFmt import sam_header, bow2bam, createBAM
 from mirge.libs.mirge2_tRF_a2i import trna_deliverables, a2i_editing
 import os, sys
 from mirge.classes.exportHTML import FormatJS
+from mirge.libs.countMatrix import class_sums, group_sum, dense_counts
+from mirge.libs import metrics, profiling
 """
 THIS SCRIPT CONTAINS LOTS OF PANDAS FUNCTION TO DERIVE THE SUMMARY (EXCEPT FOR GFF-FUNCTION)
 IF YOU ARE A DEVELOPER, AND WANT TO UNDERSTAND THIS SCRIPT!! I WOULD RECOMMEND YOU TO BE THOROUGH WITH pandas FUNCTIONS 
@@ -681,7 +683,7 @@ def trfTypes(seq, tRNAName, start, trnaStruDic):
     return trfType
 
 
-def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique):
+def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trimmedReadCounts, trimmedReadCountsUnique, laneReadCounts=None):
     """
     THIS FUNCTION IS CALLED FIRST FROM THE miRge3.0 to summarize the output.  
     """
@@ -698,11 +700,7 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
         col_vars = ['hmir','mtrna','pmtrna','snorna','rrna','ncrna','mrna']
     empty_list=dict() #Actually this is a dictionary, to collect dictionary of `sample names` as keys and `sum of expression` as values for each element of col_vars. Sorry for naming it _list. 
     for element, col_in in enumerate(col_headers):
-        for file_name in base_names:
-            if col_vars[element] in empty_list:
-                empty_list[col_vars[element]].update({file_name:pdMapped[pdMapped[col_in].astype(bool)][file_name].values.sum()})
-            else:
-                empty_list[col_vars[element]] = {file_name:pdMapped[pdMapped[col_in].astype(bool)][file_name].values.sum()}
+        empty_list[col_vars[element]] = class_sums(pdMapped, pdMapped[col_in].astype(bool), base_names)
 
     
     """
@@ -749,14 +747,13 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
         subpdMapped = subpdMapped.drop(columns=['Sequence','hairpin miRNA','mature tRNA','primary tRNA','snoRNA','rRNA','ncrna others','mRNA','annotFlag'])
 
     subpdMapped['miRNA_cbind'] = subpdMapped[['exact miRNA', 'isomiR miRNA']].apply(lambda x: ''.join(x), axis = 1)
-    subpdMapped['miRNA_fin'] = subpdMapped['miRNA_cbind'].map(mirMergedNameDic)
-    subpdMapped = subpdMapped.fillna(0)
+    subpdMapped['miRNA_fin'] = subpdMapped['miRNA_cbind'].map(mirMergedNameDic).fillna(0)
     subpdMapped.loc[subpdMapped.miRNA_fin == 0, 'miRNA_fin'] = subpdMapped.miRNA_cbind
     subpdMapped.set_index('miRNA_cbind',inplace = True)
     cannonical.set_index('exact miRNA',inplace = True)
     isomirs.set_index('isomiR miRNA',inplace = True)
-    cann_collapse = cannonical.groupby(['exact miRNA']).sum()[base_names]
-    iso_collapse = isomirs.groupby(['isomiR miRNA']).sum()[base_names]
+    cann_collapse = group_sum(cannonical, 'exact miRNA', base_names)
+    iso_collapse = group_sum(isomirs, 'isomiR miRNA', base_names)
     cann_collapse = cann_collapse.reset_index(level=['exact miRNA'])
     iso_collapse = iso_collapse.reset_index(level=['isomiR miRNA'])
     df = pd.DataFrame(cann_collapse['exact miRNA'].tolist(), columns = ['exact miRNA'])
@@ -773,7 +770,7 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
     Filtered_miRNA_Reads = df.sum(axis = 0, skipna = True)[base_names]
     Filtered_miRNA_Reads = Filtered_miRNA_Reads.to_dict()
     miR_RPM = (df.div(df.sum(axis=0))*1000000).round(4)
-    miRNA_df = subpdMapped.groupby(['miRNA_cbind']).sum()[base_names]
+    miRNA_df = group_sum(subpdMapped, 'miRNA_cbind', base_names)
     sumTotal = miRNA_df.sum(axis = 0, skipna = True)
     l_1d = sumTotal.to_dict()
     miRgefileToCSV = Path(workDir)/"miR.Counts.csv"
@@ -784,7 +781,7 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
     bwtExec = str(bwtCommand) + " -n " + str(indexFiles)
     #bwtExec = "bowtie-inspect -n /home/arun/repositories/Project_120919/mirge/Libs/human/index.Libs/human_mirna_miRBase"
     print("[CMD:]", bwtExec)
-    bowtie = subprocess.run(str(bwtExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+    bowtie = metrics.run(bwtExec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
     if bowtie.returncode==0:
         bwtOut = bowtie.stdout
         bwtErr = bowtie.stderr
@@ -817,7 +814,7 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
         bwtCommand = Path(args.bowtie_path)/"bowtie-inspect" if args.bowtie_path else "bowtie-inspect"
         bwtExec = str(bwtCommand) + " -a 20000 -e "+ str(precursor_file)
         print("[CMD:]", bwtExec)
-        bowtie = subprocess.run(str(bwtExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+        bowtie = metrics.run(bwtExec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
         #READING PRECURSOR miRNA SEQUENCES INFORMATION IN A DICTIONARY (pre_mirDict)
         if bowtie.returncode==0:
             bwtOut = bowtie.stdout
@@ -842,13 +839,14 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
                 else:
                     mirDict[headmil_mi] = mil
         d = Differ()
-        create_gff(args, pre_mirDict, mirDict, d, filenamegff, cannonical_4gff, isomirs_4gff, base_names, ref_db, annotation_lib, workDir, mirRPM_completeSet)
+        with metrics.stage("gff"), profiling.stage("create_gff"):
+            create_gff(args, pre_mirDict, mirDict, d, filenamegff, dense_counts(cannonical_4gff, base_names), dense_counts(isomirs_4gff, base_names), base_names, ref_db, annotation_lib, workDir, mirRPM_completeSet)
 
     if args.bam_out:
         pd_frame = ['snoRNA','rRNA','ncrna others','mRNA']
         bwt_idx_prefname = ['snorna','rrna','ncrna_others','mrna']
         for igv_idx, igv_name in enumerate(pd_frame):
-            dfRNA2sam = pdMapped[pdMapped[igv_name].astype(bool)]
+            dfRNA2sam = dense_counts(pdMapped[pdMapped[igv_name].astype(bool)], base_names)
             pre_cols_birth = ["Sequence", igv_name]
             cols1 = pre_cols_birth + base_names
             df_sam_out = pd.DataFrame(dfRNA2sam, columns= cols1) # Gives list of list containg Sequence, RNA type, expression values for the samples 
@@ -862,7 +860,6 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
     trimmed_counts={}
     for file_name in base_names:
         numOfRows = df.index[df[file_name] > 0].shape[0]
-        mapped_rows = pdMapped.index[pdMapped[file_name] > 0].shape[0]
         mirna_dict = {file_name:numOfRows}
         miRNA_counts.update(mirna_dict)
 
@@ -1007,6 +1004,9 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
             #print(each_isoSeq)
             # ['AAAAAACTCTAAACAA', 'hsa-miR-3145-5p', 0, 1]
 
+    if args.isoform_entropy or args.AtoI:
+        cannonical_4ie = dense_counts(cannonical_4ie, base_names)
+        isomirs_4ie = dense_counts(isomirs_4ie, base_names)
     if args.isoform_entropy:        
         create_ie(args, cannonical_4ie, isomirs_4ie, base_names, workDir, Filtered_miRNA_Reads)
     
@@ -1033,12 +1033,13 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
         for sD in canonical_ai:
             seqDic[sD[0]] = sD[1:]
         #print(seqDic)
-        a2i_editing(args, cannonical_4ie, isomirs_4ie, base_names, workDir, Filtered_miRNA_Reads, mirMergedNameDic, mirDic, ref_db, seqDic, onlyCanmiRNA)
+        with metrics.stage("a2i"), profiling.stage("a2i_editing"):
+            a2i_editing(args, cannonical_4ie, isomirs_4ie, base_names, workDir, Filtered_miRNA_Reads, mirMergedNameDic, mirDic, ref_db, seqDic, onlyCanmiRNA)
         pass
     
     if args.tRNA_frag:
-        m_trna_pre = pdMapped[pdMapped['mature tRNA'].astype(bool)]
-        p_trna_pre = pdMapped[pdMapped['primary tRNA'].astype(bool)]
+        m_trna_pre = dense_counts(pdMapped[pdMapped['mature tRNA'].astype(bool)], base_names)
+        p_trna_pre = dense_counts(pdMapped[pdMapped['primary tRNA'].astype(bool)], base_names)
         m_trna_cols1 = ["Sequence","mature tRNA"] + base_names
         p_trna_cols2 = ["Sequence","primary tRNA"] + base_names
         m_trna = pd.DataFrame(m_trna_pre, columns= m_trna_cols1).values.tolist() # Gives list of list containg Sequence, mature tRNA, expression values for the samples - mature tRNA 
@@ -1143,7 +1144,7 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
         bwtCommand = Path(args.bowtie_path)/"bowtie-inspect" if args.bowtie_path else "bowtie-inspect"
         bwtExec = str(bwtCommand) +" -a 20000 -e "+ str(indexFiles)
         print("[CMD:]", bwtExec)
-        bowtie = subprocess.run(str(bwtExec), shell=True, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
+        bowtie = metrics.run(bwtExec, check=True, stdout=subprocess.PIPE, text=True, stderr=subprocess.PIPE, universal_newlines=True)
         #READING PRECURSOR miRNA SEQUENCES INFORMATION IN A DICTIONARY (pre_mirDict)
         if bowtie.returncode==0:
             bwtOut2 = bowtie.stdout
@@ -1197,7 +1198,8 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
             ## CALLING EXTERNAL FUNCTION FROM miRge2 TO OUTPUT THE tRNF RESULT FILES 
             mature_tRNA_Reads_values = list(empty_list[col_vars[1]].values())
             primary_tRNA_Reads_values = list(empty_list[col_vars[2]].values())
-            trna_deliverables(args, workDir, pretrnaNameSeqDic, trfContentDic, mature_tRNA_Reads_values, primary_tRNA_Reads_values, trnaAAanticodonDic, base_names, trnaStruDic, duptRNA2UniqueDic, trfMergedList, tRNAtrfDic, trfMergedNameDic)
+            with metrics.stage("trf"), profiling.stage("trna_deliverables"):
+                trna_deliverables(args, workDir, pretrnaNameSeqDic, trfContentDic, mature_tRNA_Reads_values, primary_tRNA_Reads_values, trnaAAanticodonDic, base_names, trnaStruDic, duptRNA2UniqueDic, trfMergedList, tRNAtrfDic, trfMergedNameDic)
 
             #pretrnaNameSeqDic
     summary = pd.DataFrame.from_dict(pre_summary).fillna(0).astype(int)
@@ -1252,6 +1254,9 @@ def summarize(args, workDir, ref_db,base_names, pdMapped, sampleReadCounts, trim
         #print(sorted(honey_data))
         #dict(sorted(mirRPM_completeSet.values.tolist(), key=int, reverse=True)[:40])
     #print(list(summary['Remaining Reads'].values()))
+    if laneReadCounts: # SAMPLES GIVEN AS SEVERAL LANE FILES: INPUT READS OF EACH LANE, AFTER THE TOTAL
+        summary['Input Reads per Lane'] = [("; ".join(f"{lane}:{reads}" for lane, reads in laneReadCounts[nme].items()) if nme in laneReadCounts else "") for nme in summary.index]
+        colRearrange.insert(colRearrange.index('Total Input Reads') + 1, 'Input Reads per Lane')
     summary = summary.reindex(columns=colRearrange)
     summary.index.name = "Sample name(s)"
     report = Path(workDir)/"annotation.report.csv"
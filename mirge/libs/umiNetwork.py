@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+from pathlib import Path
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from mirge.classes.collapsedStore import CollapsedStore, encode, decode
+
+"""
+UMI DEDUPLICATION OF -udd (--umiDedup) WITH CORRECTION OF THE SEQUENCING ERRORS INSIDE THE UMIs (-umm, --umi-method).
+EACH COLLAPSED READ IS SPLIT INTO ITS INSERT AND ITS UMI (THE 5' AND 3' BASES OF -umi, AS UMIParser). THE UMIs OF ONE INSERT FORM A
+NETWORK WHERE UMIs AT HAMMING DISTANCE 1 ARE NEIGHBOURS, AND EACH GROUP OF THE NETWORK COUNTS AS ONE MOLECULE, AS IN UMI-tools:
+    directional  A ABSORBS ITS NEIGHBOUR B WHEN count(A) >= 2 count(B) - 1, TRANSITIVELY, STARTING FROM THE MOST ABUNDANT UMIs
+    adjacency    EACH CONNECTED COMPONENT HOLDS AS MANY MOLECULES AS THE FEWEST MOST ABUNDANT UMIs WHOSE NEIGHBOURS COVER IT
+    unique       EVERY DISTINCT UMI IS A MOLECULE (NO ERROR CORRECTION)
+THE NEIGHBOURS ARE FOUND WITHOUT COMPARING PAIRS OF UMIs: BLANKING POSITION i OF TWO UMIs THAT ONLY DIFFER AT i GIVES THE SAME KEY, SO
+SORTING THE (INSERT, BLANKED UMI) KEYS OF EACH POSITION BRINGS ALL THE NEIGHBOURS NEXT TO EACH OTHER (AT MOST 4 ROWS SHARE A KEY).
+UMIs WITH N (OR ANY OTHER CHARACTER THAN A, C, G AND T) ARE NOT PACKED AND ARE ALWAYS A MOLECULE OF THEIR OWN.
+"""
+
+umi_methods = ['directional', 'adjacency', 'unique']
+
+
+class UmiTable:
+    """
+    ONE ROW PER DISTINCT (INSERT, UMI) PAIR: insert (INDEX INTO inserts()), umi (2-BIT PACKED, umiLen BASES), packable (umi IS VALID) AND
+    reads. THE INSERTS ARE KEPT PACKED PER LENGTH (groups: length -> SORTED UNIQUE CODES) AND, FOR THE ONES THAT CANNOT BE PACKED, AS str.
+    """
+    def __init__(self, umiLen):
+        self.umiLen = umiLen
+        self.groups = [] # (insert length, sorted unique insert codes), IN THE ORDER OF THEIR INSERT INDEXES
+        self.insertStrs = [] # INSERTS THAT CANNOT BE PACKED, AFTER ALL THE PACKED ONES
+        self.insert = []
+        self.umi = []
+        self.packable = []
+        self.reads = []
+        self.umiStrs = {} # ROW -> UMI str FOR THE UMIs THAT CANNOT BE PACKED
+
+    def nInserts(self):
+        return sum(len(codes) for length, codes in self.groups) + len(self.insertStrs)
+
+    def add_rows(self, insert, umi, packable, reads):
+        self.insert.append(np.asarray(insert, dtype=np.int64))
+        self.umi.append(np.asarray(umi, dtype=np.uint64))
+        self.packable.append(np.asarray(packable, dtype=bool))
+        self.reads.append(np.asarray(reads, dtype=np.int64))
+
+    def finish(self):
+        self.insert = np.concatenate(self.insert) if self.insert else np.zeros(0, dtype=np.int64)
+        self.umi = np.concatenate(self.umi) if self.umi else np.zeros(0, dtype=np.uint64)
+        self.packable = np.concatenate(self.packable) if self.packable else np.zeros(0, dtype=bool)
+        self.reads = np.concatenate(self.reads) if self.reads else np.zeros(0, dtype=np.int64)
+        return self
+
+    def inserts(self):
+        seqs = []
+        for length, codes in self.groups:
+            seqs += decode(codes, length)
+        return seqs + self.insertStrs
+
+    def umis(self):
+        seqs = decode(self.umi, self.umiLen)
+        for row, seq in self.umiStrs.items():
+            seqs[row] = seq
+        return seqs
+
+
+def umi_split(s, front, back):
+    """
+    UMIParser(s, front, back) WITHOUT ITS QUIRK FOR back == 0, WHERE THE WHOLE READ ENDS UP IN THE UMI
+    """
+    return s[front:len(s) - back], s[:front] + s[len(s) - back:]
+
+
+def umi_table(store, front, back, min_len):
+    """
+    SPLITS ALL THE READS OF A CollapsedStore INTO INSERT AND UMI, KEEPING THE INSERTS OF AT LEAST min_len BASES. THE PACKED READS ARE
+    SPLIT WITH BIT OPERATIONS, ONE READ LENGTH AT A TIME; THE OVERFLOW ONE BY ONE.
+    """
+    store.compact()
+    table = UmiTable(front + back)
+    offset = 0
+    for length, (codes, counts) in sorted(store.packed.items()):
+        centerLen = length - front - back
+        if centerLen < min_len:
+            continue
+        centers = (codes >> np.uint64(2 * back)) & np.uint64((1 << (2 * centerLen)) - 1)
+        fronts = codes >> np.uint64(2 * (length - front)) if front else np.zeros(len(codes), dtype=np.uint64)
+        umis = (fronts << np.uint64(2 * back)) | (codes & np.uint64((1 << (2 * back)) - 1))
+        uniqueCenters, insert = np.unique(centers, return_inverse=True)
+        table.groups.append((centerLen, uniqueCenters))
+        table.add_rows(offset + insert, umis, np.ones(len(codes), dtype=bool), counts)
+        offset += len(uniqueCenters)
+    insertIds = {}
+    rows = []
+    for s, c in store.overflow.items():
+        pureSeq, umiSeq = umi_split(s, front, back)
+        if len(pureSeq) >= min_len:
+            rows.append((insertIds.setdefault(pureSeq, offset + len(insertIds)), umiSeq, c))
+    table.insertStrs = list(insertIds)
+    if rows:
+        umiSeqs = [row[1] for row in rows]
+        umis, packable = encode(umiSeqs, front + back)
+        first = sum(len(part) for part in table.umi)
+        for idx in np.flatnonzero(~packable).tolist():
+            table.umiStrs[first + idx] = umiSeqs[idx]
+        table.add_rows([row[0] for row in rows], np.where(packable, umis, np.uint64(0)), packable, [row[2] for row in rows])
+    return table.finish()
+
+
+def umi_neighbours(table):
+    """
+    ALL PAIRS OF ROWS WITH THE SAME INSERT AND PACKED UMIs AT HAMMING DISTANCE 1, EACH PAIR ONCE, AS TWO ARRAYS OF ROWS
+    """
+    rows = np.flatnonzero(table.packable)
+    insert = table.insert[rows]
+    umi = table.umi[rows]
+    src = []
+    dst = []
+    for pos in range(table.umiLen):
+        blanked = umi & ~np.uint64(3 << (2 * pos))
+        order = np.lexsort((blanked, insert))
+        sortedInsert = insert[order]
+        sortedBlanked = blanked[order]
+        for step in (1, 2, 3):
+            same = (sortedInsert[step:] == sortedInsert[:-step]) & (sortedBlanked[step:] == sortedBlanked[:-step])
+            src.append(rows[order[:-step][same]])
+            dst.append(rows[order[step:][same]])
+    if not src:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(src), np.concatenate(dst)
+
+
+def adjacency_lists(nRows, src, dst):
+    """
+    CSR ADJACENCY OF THE DIRECTED EDGES src -> dst: THE NEIGHBOURS OF ROW r ARE targets[starts[r]:starts[r + 1]]
+    """
+    order = np.argsort(src, kind="stable")
+    starts = np.zeros(nRows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=nRows), out=starts[1:])
+    return starts, dst[order]
+
+
+def priority(table, rows):
+    """
+    rows SORTED BY DECREASING READ COUNT, TIES BROKEN BY INSERT AND UMI SO THAT THE RESULT DOES NOT DEPEND ON THE INPUT ORDER
+    """
+    return rows[np.lexsort((table.umi[rows], table.insert[rows], -table.reads[rows]))]
+
+
+def directional_groups(table, src, dst):
+    """
+    THE MOLECULE (ROW OF ITS MOST ABUNDANT UMI) OF EACH ROW WITH THE directional METHOD
+    """
+    molecule = np.arange(len(table.reads))
+    a = np.concatenate((src, dst))
+    b = np.concatenate((dst, src))
+    keep = table.reads[a] >= 2 * table.reads[b] - 1
+    a, b = a[keep], b[keep]
+    if len(a) == 0:
+        return molecule
+    starts, targets = adjacency_lists(len(molecule), a, b)
+    starts = starts.tolist()
+    targets = targets.tolist()
+    visited = set()
+    for root in priority(table, np.unique(np.concatenate((a, b)))).tolist():
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for neighbour in targets[starts[node]:starts[node + 1]]:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    molecule[neighbour] = root
+                    stack.append(neighbour)
+    return molecule
+
+
+def adjacency_groups(table, src, dst):
+    """
+    THE MOLECULE OF EACH ROW WITH THE adjacency METHOD: IN EACH CONNECTED COMPONENT, THE MOST ABUNDANT UMIs ARE TAKEN ONE BY ONE UNTIL
+    THEY AND THEIR NEIGHBOURS COVER THE COMPONENT; EACH OF THEM IS A MOLECULE AND EVERY OTHER UMI JOINS THE FIRST OF THEM IT IS A NEIGHBOUR OF
+    """
+    nRows = len(table.reads)
+    molecule = np.arange(nRows)
+    if len(src) == 0:
+        return molecule
+    graph = sparse.coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(nRows, nRows)).tocsr()
+    nComponents, component = csgraph.connected_components(graph, directed=False)
+    starts, targets = adjacency_lists(nRows, np.concatenate((src, dst)), np.concatenate((dst, src)))
+    linked = priority(table, np.unique(np.concatenate((src, dst))))
+    members = {}
+    for row in linked.tolist():
+        members.setdefault(component[row], []).append(row)
+    for nodes in members.values():
+        covered = set()
+        leads = []
+        for node in nodes:
+            leads.append(node)
+            covered.add(node)
+            covered.update(targets[starts[node]:starts[node + 1]].tolist())
+            if len(covered) == len(nodes):
+                break
+        observed = set(leads)
+        for lead in leads:
+            for neighbour in targets[starts[lead]:starts[lead + 1]].tolist():
+                if neighbour not in observed:
+                    observed.add(neighbour)
+                    molecule[neighbour] = lead
+    return molecule
+
+
+def dedup(store, front, back, min_len, method="directional", tablePath=None, pureStore=None):
+    """
+    -udd: COUNTS THE MOLECULES OF EACH INSERT OF A CollapsedStore OF READS WITH THEIR UMI. RETURNS THE STORE OF THE INSERTS WITH THEIR
+    NUMBER OF MOLECULES (pureStore, A NEW CollapsedStore BY DEFAULT) AND THE TOTAL NUMBER OF MOLECULES. WITH tablePath, THE UMI TABLE IS
+    WRITTEN THERE (SEE write_table()).
+    """
+    table = umi_table(store, front, back, min_len)
+    if method == "unique" or len(table.reads) == 0:
+        molecule = np.arange(len(table.reads))
+    else:
+        src, dst = umi_neighbours(table)
+        molecule = directional_groups(table, src, dst) if method == "directional" else adjacency_groups(table, src, dst)
+    isMolecule = molecule == np.arange(len(molecule))
+    molecules = np.bincount(table.insert[isMolecule], minlength=table.nInserts()).astype(np.int64)
+    pureStore = CollapsedStore() if pureStore is None else pureStore
+    offset = 0
+    for length, codes in table.groups:
+        pureStore.add_packed(length, codes, molecules[offset:offset + len(codes)])
+        offset += len(codes)
+    pureStore.add(table.insertStrs, molecules[offset:])
+    if tablePath is not None:
+        write_table(tablePath, table, molecule)
+    return pureStore, int(molecules.sum())
+
+
+def write_table(path, table, molecule):
+    """
+    WRITES THE UMI TABLE OF A SAMPLE AS A COMPRESSED .npz, ONE ROW PER DISTINCT (INSERT, UMI) PAIR:
+        inserts   THE INSERT SEQUENCES, '\\n' SEPARATED (uint8)      insert    INDEX OF THE INSERT OF EACH ROW
+        umi       THE UMI OF EACH ROW (FIXED WIDTH bytes)           reads     ITS NUMBER OF READS
+        molecule  THE ROW OF THE UMI IT WAS MERGED INTO (ITSELF FOR THE UMI THAT REPRESENTS A MOLECULE)
+    """
+    path = Path(path)
+    with open(path, 'wb') as fout:
+        np.savez_compressed(fout, inserts=np.frombuffer("\n".join(table.inserts()).encode(), dtype=np.uint8),
+                            insert=table.insert, umi=np.array(table.umis(), dtype="S%d" % max(table.umiLen, 1)),
+                            reads=table.reads, molecule=molecule)
+
+
+def read_table(path):
+    """
+    READS A TABLE WRITTEN BY write_table() BACK AS A pandas DataFrame OF insert, umi, reads AND molecule (THE UMI OF ITS MOLECULE)
+    """
+    import pandas as pd
+    with np.load(path) as data:
+        inserts = np.array(data['inserts'].tobytes().decode().split("\n"), dtype=object)
+        umi = data['umi'].astype(str)
+        return pd.DataFrame({'insert': inserts[data['insert']], 'umi': umi, 'reads': data['reads'], 'molecule': umi[data['molecule']]})
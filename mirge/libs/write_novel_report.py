@@ -9,6 +9,7 @@ from Bio.Seq import Seq
 from Bio.Alphabet import generic_dna
 import re
 from mirge.classes.exportHTML import FormatJS
+from mirge.libs import metrics
 
 def Shifting(xcDic, ycDic):
     minx = min([xcDic[key] for key in xcDic.keys()])
@@ -783,7 +784,7 @@ def write_novel_report(novelmiRNALListFile, featureFile, clusterFile, rnafoldCmd
                 f1 = str(files+'_precusorTmp.fa')
                 f2 = str(files+'_precusorTmp.str')
                 print("CMD:", 'cd %s && %s -d 0 < %s > %s'%(Path(outputdir2), rnafoldCmdTmp, f1, f2))
-                os.system('cd %s && %s -d 0 < %s > %s'%(Path(outputdir2), rnafoldCmdTmp, f1, f2))
+                metrics.system('cd %s && %s -d 0 < %s > %s'%(Path(outputdir2), rnafoldCmdTmp, f1, f2))
                 f3 = str(Path(outputdir2)/(files+'_novel_miRNA_'+str(i)+'_ss.ps'))
                 f4 = str(Path(dir_tmp)/(files+'_novel_miRNA_'+str(i)+'.pdf'))
                 try:
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+EQUIVALENCE OF THE --numba-pll KERNELS (mirge/libs/kernels.py) AND THE PYTHON CODE THEY REPLACE, ON SMALL FIXED INPUTS.
+EACH CALLER IS RUN WITH kernels.enabled OFF AND ON; WITHOUT numba THE KERNELS RUN AS PLAIN PYTHON, WHICH STILL CHECKS THEIR LOGIC.
+benchmarks/bench_kernels.py RUNS THE SAME COMPARISONS ON LARGER INPUTS AND TIMES THEM.
+
+    python -m pytest tests
+"""
+import io
+import random
+
+import pytest
+
+from mirge.classes.collapsedStore import CollapsedStore
+from mirge.libs import digest, kernels
+from mirge.libs import mirge2_tRF_a2i as a2i
+
+
+def both_ways(func, *args):
+    """
+    THE RESULT OF func(*args) WITH THE KERNELS OFF AND WITH THE KERNELS ON
+    """
+    enabled = kernels.enabled
+    try:
+        kernels.enabled = False
+        expected = func(*args)
+        kernels.enabled = True
+        return expected, func(*args)
+    finally:
+        kernels.enabled = enabled
+
+
+def random_seq(rng, length, bases="ACGT"):
+    return "".join(rng.choice(bases) for _ in range(length))
+
+
+def umi_trim(store, front, back, min_len):
+    """
+    THE -umi BRANCH OF baking(): umi_trim_packed() WITH THE KERNELS ON, UMIParser READ BY READ WITHOUT THEM
+    """
+    if kernels.enabled:
+        pureStore, trimmed = digest.umi_trim_packed(store, front, back, min_len)
+        return sorted(pureStore.items()), trimmed
+    pureSeqs, pureCounts, trimmed = [], [], 0
+    for s, c in store.items():
+        pureSeq = digest.UMIParser(s, front, back)[0]
+        if len(pureSeq) >= min_len:
+            pureSeqs.append(pureSeq)
+            pureCounts.append(c)
+            trimmed += c
+    pureStore = CollapsedStore()
+    pureStore.add(pureSeqs, pureCounts)
+    return sorted(pureStore.items()), trimmed
+
+
+@pytest.mark.parametrize("front,back", [(0, 4), (4, 4), (4, 0), (12, 12)])
+def test_umi_center(front, back):
+    rng = random.Random(1)
+    seqs = [random_seq(rng, rng.randint(14, 40)) for _ in range(500)]
+    seqs += [seq[:5] + "N" + seq[6:] for seq in seqs[:20]] # NOT 2-BIT PACKED: THE OVERFLOW OF THE STORE
+    store = CollapsedStore()
+    store.add(seqs, [rng.randint(1, 100) for _ in seqs])
+    expected, result = both_ways(umi_trim, store, front, back, 16)
+    assert result == expected
+
+
+def test_pair_distances():
+    rng = random.Random(2)
+    width = 60
+    template = random_seq(rng, width)
+    readInforDic = {}
+    for idx in range(1, 81):
+        start = rng.randint(0, width // 2)
+        end = rng.randint(start + 14, width)
+        bases = "".join(rng.choice("ACGT") if rng.random() < 0.03 else base for base in template[start:end])
+        readInforDic[idx] = {'allignedSeq': "-" * start + bases + "-" * (width - end), 'count': 1}
+    expected, result = both_ways(a2i.getDistance, readInforDic)
+    assert result == expected
+
+
+def isomirs(rng, reads):
+    """
+    A CANONICAL miRNA, ISOMIRS OF IT WITH SHIFTED ENDS AND A-TO-G CHANGES, THEIR COUNTS AND THE RETAINED SEQUENCES
+    """
+    flank = random_seq(rng, 6)
+    target = random_seq(rng, 22)
+    extended = flank + target + flank
+    seqs = {target}
+    while len(seqs) < reads:
+        start = rng.randint(3, 9)
+        seq = extended[start:start + rng.randint(18, 24)]
+        seqs.add("".join("G" if base == "A" and rng.random() < 0.1 else base for base in seq))
+    seqs = sorted(seqs)
+    counts = [rng.randint(1, 500) for _ in seqs]
+    retained = {seq: 1 for seq in seqs if rng.random() < 0.8}
+    return target, seqs, counts, retained
+
+
+def a2i_editing(target, seqs, counts, retained):
+    detail = io.StringIO()
+    result = a2i.A2IEditing(target, seqs, counts, "hsa-miR-test", detail, retained, "A", "G")
+    return result, detail.getvalue()
+
+
+@pytest.mark.parametrize("seed", [3, 4, 5])
+def test_base_changes(seed):
+    target, seqs, counts, retained = isomirs(random.Random(seed), 60)
+    expected, result = both_ways(a2i_editing, target, seqs, counts, retained)
+    assert result == expected
+    expected, result = both_ways(a2i.mismatchCountAnalysis, target, seqs, counts, retained)
+    assert result == expected